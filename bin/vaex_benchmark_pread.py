@@ -0,0 +1,68 @@
+"""Benchmarks reading columns using mmap, pread and pread with O_DIRECT (see VAEX_NO_MMAP), on a cold and warm page cache.
+
+The page cache is made cold using posix_fadvise(POSIX_FADV_DONTNEED), which the kernel may ignore for pages that are
+still mapped, for exact numbers run as root with --drop-caches (which writes to /proc/sys/vm/drop_caches).
+
+Example:
+
+$ python bin/vaex_benchmark_pread.py big.hdf5 x y
+"""
+import argparse
+import os
+import sys
+import time
+
+import vaex
+import vaex.dataset_mmap
+
+
+def make_cold(path, drop_caches=False):
+    vaex.dataset_mmap.buffer_pool.clear()
+    if drop_caches:
+        os.system("sync")
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("1\n")
+    else:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def benchmark(path, expressions, mode, cold, repeat, drop_caches=False):
+    vaex.dataset_mmap.no_mmap = mode
+    times = []
+    for i in range(repeat):
+        if cold:
+            make_cold(path, drop_caches)
+        else:
+            vaex.dataset_mmap.buffer_pool.clear()  # we only want to measure the page cache
+        df = vaex.open(path)
+        df.executor.cache = None  # we want to read the data, not the cached results
+        t0 = time.time()
+        df.sum(expressions)
+        times.append(time.time() - t0)
+        df.close_files()
+    bytes = sum(df.dtype(expression).itemsize for expression in expressions) * len(df)
+    return min(times), bytes
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(argv[0])
+    parser.add_argument("-r", "--repeat", default=3, help="repeat benchmark X times (default: %(default)s)", type=int)
+    parser.add_argument("-m", "--modes", default="mmap,pread,direct", help="readers to compare (default: %(default)s)")
+    parser.add_argument("--drop-caches", default=False, action="store_true", help="drop the page cache of the whole system (needs root)")
+    parser.add_argument("filename", help="filename of dataset to use")
+    parser.add_argument("expressions", help="list of columns to read", nargs="+")
+    args = parser.parse_args(argv[1:])
+
+    modes = {"mmap": False, "pread": True, "direct": "direct"}
+    for name in args.modes.split(","):
+        for cold in [True, False]:
+            seconds, bytes = benchmark(args.filename, args.expressions, modes[name], cold, args.repeat, args.drop_caches)
+            print("%-6s %-4s page cache: %8.3f s %8.3f GiB/s" % (name, "cold" if cold else "warm", seconds, bytes / 1024.**3 / seconds))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
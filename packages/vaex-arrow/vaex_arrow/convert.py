@@ -1,47 +1,88 @@
 import pyarrow
 import numpy as np
 
-def arrow_array_from_numpy_array(array):
+def arrow_array_from_numpy_array(array, type=None):
+    """Converts a (masked) numpy array to an arrow array, the mask becomes the validity bitmap.
+
+    :param type: arrow type of the result, by default inferred from the dtype
+    """
     dtype = array.dtype
     mask = None
     if np.ma.isMaskedArray(array):
-        mask = array.mask
-    if dtype.kind == 'S':
+        mask = np.ma.getmaskarray(array)
+        array = array.data
+    if dtype.kind == 'S' and type is None:
         type = pyarrow.binary(dtype.itemsize)
         arrow_array = pyarrow.array(array, type, mask=mask)
     else:
         if dtype.isnative:
-            arrow_array = pyarrow.array(array, mask=mask)
+            arrow_array = pyarrow.array(array, type, mask=mask)
         else:
             # TODO: we copy here, but I guess we should not... or give some warning
-            arrow_array = pyarrow.array(array.astype(dtype.newbyteorder('=')), mask=mask)
+            arrow_array = pyarrow.array(array.astype(dtype.newbyteorder('=')), type, mask=mask)
     return arrow_array
 
+def _is_variable_length(arrow_type):
+    """True for utf8 (string) and (variable length) binary arrays, which have an offset and a data buffer"""
+    return arrow_type in [pyarrow.string(), pyarrow.binary()]
+
+def _unpack_bits(buffer, offset, length):
+    """Unpacks an arrow bitmap (least significant bit first) to a boolean array"""
+    bits = np.frombuffer(buffer, np.uint8, len(buffer))
+    # we do have to change the ordering of the bits
+    return np.unpackbits(bits).reshape((len(bits), 8))[:, ::-1].reshape(-1)[offset:offset + length].astype(np.bool_)
+
+def _objects_from_buffers(arrow_type, offsets_buffer, data_buffer, offset, length):
+    """Returns an object array of the str (utf8) or bytes (binary) values, from the offsets and the data buffer"""
+    offsets = np.frombuffer(offsets_buffer, np.int32, offset + length + 1)[offset:]
+    # only copy the bytes of this slice, not those of the whole (record batch) buffer
+    start, end = int(offsets[0]), int(offsets[-1])
+    data = data_buffer.slice(start, end - start).to_pybytes() if data_buffer is not None else b''
+    offsets = (offsets - start).tolist()
+    values = [data[i1:i2] for i1, i2 in zip(offsets[:-1], offsets[1:])]
+    if arrow_type == pyarrow.string():
+        values = [value.decode('utf8') for value in values]
+    array = np.empty(length, dtype=object)
+    array[:] = values
+    return array
+
+def numpy_dtype_from_arrow_type(arrow_type):
+    if _is_variable_length(arrow_type):
+        return np.dtype('O')
+    elif isinstance(arrow_type, pyarrow.FixedSizeBinaryType):
+        return np.dtype("S" + str(arrow_type.byte_width))
+    else:
+        return np.dtype(arrow_type.to_pandas_dtype())
+
 def numpy_array_from_arrow_array(arrow_array):
+    """Returns a numpy array that shares the memory with the arrow array (a view), with a mask for the null values.
+
+    utf8 and binary arrays cannot be viewed as a numpy array, they are converted to an object array of str or bytes.
+    """
     arrow_type = arrow_array.type
     buffers = arrow_array.buffers()
-    assert len(buffers) == 2
+    offset = arrow_array.offset
+    length = len(arrow_array)
     bitmap_buffer = buffers[0]
-    data_buffer = buffers[1]
-    if isinstance(arrow_type, type(pyarrow.binary(1))):  # todo, is there a better way to typecheck?
-        # mimics python/pyarrow/array.pxi::Array::to_numpy
-        buffers = arrow_array.buffers()
-        assert len(buffers) == 2
-        dtype = "S" + str(arrow_type.byte_width)
-        # arrow seems to do padding, check if it is all ok
-        expected_length = arrow_type.byte_width * len(arrow_array)
-        actual_length = len(buffers[-1])
-        if actual_length < expected_length:
-            raise ValueError('buffer is smaller (%d) than expected (%d)' % (actual_length, expected_length))
-        array = np.frombuffer(buffers[-1], dtype, len(arrow_array))# TODO: deal with offset ? [arrow_array.offset:arrow_array.offset + len(arrow_array)]
+    dtype = numpy_dtype_from_arrow_type(arrow_type)
+    if _is_variable_length(arrow_type):
+        assert len(buffers) == 3
+        array = _objects_from_buffers(arrow_type, buffers[1], buffers[2], offset, length)
     else:
-        dtype = arrow_array.type.to_pandas_dtype()
-    array = np.frombuffer(data_buffer, dtype, len(arrow_array))
+        assert len(buffers) == 2
+        data_buffer = buffers[1]
+        if arrow_type == pyarrow.bool_():
+            array = _unpack_bits(data_buffer, offset, length)
+        else:
+            # arrow seems to do padding, check if it is all ok
+            expected_length = dtype.itemsize * (offset + length)
+            actual_length = len(data_buffer)
+            if actual_length < expected_length:
+                raise ValueError('buffer is smaller (%d) than expected (%d)' % (actual_length, expected_length))
+            array = np.frombuffer(data_buffer, dtype, offset + length)[offset:]
     if bitmap_buffer is not None:
         # arrow uses a bitmap https://github.com/apache/arrow/blob/master/format/Layout.md
-        bitmap = np.frombuffer(bitmap_buffer, np.uint8, len(bitmap_buffer))
-        # we do have to change the ordering of the bits
-        mask = 1-np.unpackbits(bitmap).reshape((len(bitmap),8))[:,::-1].reshape(-1)[:len(arrow_array)]
+        mask = ~_unpack_bits(bitmap_buffer, offset, length)
         array = np.ma.MaskedArray(array, mask=mask)
     return array
 
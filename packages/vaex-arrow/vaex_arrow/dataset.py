@@ -6,12 +6,68 @@ import pyarrow as pa
 
 import vaex.dataset
 import vaex.file.other
-from .convert import numpy_array_from_arrow_array
+from vaex.dataframe import Column
+from .convert import numpy_array_from_arrow_array, numpy_dtype_from_arrow_type
 logger = logging.getLogger("vaex_arrow")
 
 
+class ColumnArrow(Column):
+    """A column backed by a list of arrow arrays (e.g. one for each record batch), which are kept as they are
+    (memory mapped when read from a file), and only converted to numpy when a slice is requested.
+
+    Slices within a chunk are views on the arrow buffers (except for utf8 and binary data, which are converted to
+    object arrays), slices spanning multiple chunks are concatenated. The executor aligns its passes over the
+    data with the chunks, see :attr:`chunk_offsets`.
+    """
+    def __init__(self, chunks):
+        self.chunks = [chunk for chunk in chunks if len(chunk)] or chunks[:1]
+        lengths = [len(chunk) for chunk in self.chunks]
+        self.chunk_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.dtype = numpy_dtype_from_arrow_type(self.chunks[0].type)
+        self.shape = (len(self),)
+        self.is_masked = any(chunk.null_count > 0 for chunk in self.chunks)
+
+    def __len__(self):
+        return int(self.chunk_offsets[-1])
+
+    def trim(self, i1, i2):
+        return ColumnArrow(self._slices(i1, i2))
+
+    def _slices(self, start, stop):
+        """Returns the (zero copy) slices of the chunks that cover the rows start to stop"""
+        first = max(0, np.searchsorted(self.chunk_offsets, start, side='right') - 1)
+        slices = []
+        for index in range(first, len(self.chunks)):
+            offset = self.chunk_offsets[index]
+            if offset >= stop and slices:
+                break
+            i1 = max(start - offset, 0)
+            i2 = min(stop - offset, len(self.chunks[index]))
+            slices.append(self.chunks[index].slice(int(i1), int(max(i2 - i1, 0))))
+        return slices
+
+    def __getitem__(self, slice):
+        start, stop, step = slice.start, slice.stop, slice.step
+        start = start or 0
+        stop = len(self) if stop is None else stop
+        assert step in [None, 1]
+        arrays = [numpy_array_from_arrow_array(chunk) for chunk in self._slices(start, stop)]
+        if len(arrays) == 1:
+            array = arrays[0]
+        elif any(np.ma.isMaskedArray(array) for array in arrays):
+            array = np.ma.concatenate(arrays)
+        else:
+            array = np.concatenate(arrays)
+        if self.is_masked and not np.ma.isMaskedArray(array):
+            array = np.ma.array(array, mask=np.zeros(len(array), dtype=np.bool_))
+        return array
+
+
 class DatasetArrow(vaex.dataset.DatasetLocal):
-    """Implements storage using arrow"""
+    """Implements storage using arrow, reading both the arrow IPC file and stream format.
+
+    The record batches are memory mapped, and each column keeps all batches (see :class:`ColumnArrow`).
+    """
 
     def __init__(self, filename=None, table=None, write=False):
         super(DatasetArrow, self).__init__(name=filename, path=filename, column_names=[])
@@ -23,23 +79,29 @@ class DatasetArrow(vaex.dataset.DatasetLocal):
 
     def _load(self):
         source = pa.memory_map(self.path)
-        reader = pa.open_stream(source)
-        table = pa.Table.from_batches([b for b in reader])
-        self._load_table(table)
-    
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+            schema = reader.schema
+        except pa.ArrowInvalid:  # not the file format, so it should be the stream format
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+            batches = list(reader)
+            schema = reader.schema
+        self._load_batches(schema, batches)
+
     def _load_table(self, table):
-        self._length_unfiltered =  self._length_original = table.num_rows
-        for col in table.columns:
-            name = col.name
-            # TODO: keep the arrow columns, and support and test chunks
-            arrow_array = col.data.chunks[0]
-            array = numpy_array_from_arrow_array(arrow_array)
-
-            self.columns[name] = array
+        self._load_batches(table.schema, table.to_batches())
+
+    def _load_batches(self, schema, batches):
+        self._length_unfiltered = self._length_original = sum(batch.num_rows for batch in batches)
+        for i, field in enumerate(schema):
+            name = field.name
+            chunks = [batch.column(i) for batch in batches] or [pa.array([], type=field.type)]
+            self.columns[name] = ColumnArrow(chunks)
             self.column_names.append(name)
             self._save_assign_expression(name, vaex.expression.Expression(self, name))
 
-
     @classmethod
     def can_open(cls, path, *args, **kwargs):
         return path.rpartition('.')[2] == 'arrow'
@@ -53,4 +115,3 @@ class DatasetArrow(vaex.dataset.DatasetLocal):
         return []
 
 vaex.file.other.dataset_type_map["arrow"] = DatasetArrow
-
@@ -7,6 +7,8 @@ import logging
 
 import numpy as np
 import vaex
+import vaex.execution
+import vaex.utils
 
 from .convert import arrow_array_from_numpy_array
 
@@ -22,7 +24,9 @@ except:
 logger = logging.getLogger("vaex_arrow.export")
 
 def export(dataset, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=True, sort=None, ascending=True):
-    """
+    """Exports the DataFrame to an arrow stream file, in chunks of record batches (except when shuffling, which needs
+    all rows of a column in memory)
+
     :param DatasetLocal dataset: dataset to export
     :param str path: path for file
     :param lis[str] column_names: list of column names to export or None for all columns
@@ -35,9 +39,10 @@ def export(dataset, path, column_names=None, byteorder="=", shuffle=False, selec
     :return:
     """
     column_names = column_names or dataset.get_column_names(virtual=virtual, strings=True)
-    for name in column_names:
-        if name not in dataset.columns:
-            warnings.warn('Exporting to arrow with virtual columns is not efficient')
+    if shuffle:
+        for name in column_names:
+            if name not in dataset.columns:
+                warnings.warn('Exporting to arrow with virtual columns is not efficient')
     N = len(dataset) if not selection else dataset.selected_length(selection)
     if N == 0:
         raise ValueError("Cannot export empty table")
@@ -65,13 +70,20 @@ def export(dataset, path, column_names=None, byteorder="=", shuffle=False, selec
         order_array = shuffle_array
 
     if sort:
-        if selection:
-            raise ValueError("sorting selections not yet supported")
         logger.info("sorting...")
-        indices = np.argsort(dataset.evaluate(sort))
-        order_array = indices if ascending else indices[::-1]
+        # we only sort the N rows that we export
+        # the selected rows (that pass the filter) are sorted by the external sort, chunk by chunk
+        dataset = dataset.trim()
+        indices = dataset._sort(sort, ascending, selection=selection or None, filtered=True)
+        dataset = dataset.take(indices)
+        selection = False
+        sort = None
         logger.info("sorting done")
 
+    if not shuffle:
+        _export_batches(dataset, path, column_names, selection, progress)
+        return
+
     if selection:
         full_mask = dataset.evaluate_selection_mask(selection)
     else:
@@ -98,3 +110,49 @@ def export(dataset, path, column_names=None, byteorder="=", shuffle=False, selec
         writer = pa.RecordBatchStreamWriter(sink, b[0].schema)
         writer.write_table(table)
 
+
+def _export_batches(dataset, path, column_names, selection, progress):
+    """Writes the DataFrame as a stream of record batches, one for each chunk of rows.
+
+    The chunks are evaluated by the thread pool of the executor, a window of chunks at a time, and the record batches
+    are written in order, so memory usage does not depend on the length of the DataFrame.
+    """
+    if progress == True:
+        progress = vaex.utils.progressbar_callable(title="exporting")
+    progress = progress or (lambda value: True)
+    thread_pool = dataset.executor.thread_pool
+    parts = list(vaex.utils.subdivide(dataset.length_unfiltered(), max_length=dataset.executor.buffer_size))
+    parts = vaex.execution._align_parts(parts, dataset._chunk_boundaries())
+    window = 2 * thread_pool.nthreads
+    batches = {}
+
+    def process(thread_index, i1, i2):
+        arrays = [dataset.evaluate(name, i1, i2, filtered=False) for name in column_names]
+        if selection or dataset.filtered:
+            mask = dataset.evaluate_selection_mask(selection or None, i1=i1, i2=i2)
+            arrays = [array[mask] for array in arrays]
+        batches[i1] = arrays
+
+    writer = None
+    types = None
+    with pa.OSFile(path, 'wb') as sink:
+        for start in range(0, len(parts), window):
+            for _ in thread_pool.map(process, parts[start:start + window], unpack=True):
+                pass
+            for i1, i2 in parts[start:start + window]:
+                arrays = batches.pop(i1)
+                if len(arrays[0]) == 0:
+                    continue
+                if types is None:  # the first batch determines the schema
+                    arrow_arrays = [arrow_array_from_numpy_array(array) for array in arrays]
+                    types = [arrow_array.type for arrow_array in arrow_arrays]
+                else:
+                    arrow_arrays = [arrow_array_from_numpy_array(array, type) for array, type in zip(arrays, types)]
+                batch = pa.RecordBatch.from_arrays(arrow_arrays, column_names)
+                if writer is None:
+                    writer = pa.RecordBatchStreamWriter(sink, batch.schema)
+                writer.write_batch(batch)
+            if not progress(parts[min(len(parts), start + window) - 1][1] / float(parts[-1][1])):
+                break
+        if writer is not None:
+            writer.close()
@@ -159,6 +159,9 @@ def open(path, convert=False, shuffle=False, copy_index=True, *args, **kwargs):
                         ds = vaex.file.open(filename_hdf5)
                     else:
                         ds = vaex.file.open(filename_hdf5, *args, **kwargs)
+                elif ext == '.csv' and convert:
+                    # streaming conversion, the csv file does not need to fit into memory
+                    ds = _convert_csv(path, shuffle=shuffle, copy_index=copy_index, **kwargs)
                 else:
                     if ext == '.csv':  # special support for csv.. should probably approach it a different way
                         ds = from_csv(path, copy_index=copy_index, **kwargs)
@@ -179,16 +182,17 @@ def open(path, convert=False, shuffle=False, copy_index=True, *args, **kwargs):
                     filename_hdf5 = _convert_name(filenames, shuffle=shuffle)
                 if os.path.exists(filename_hdf5) and convert:  # also check mtime
                     ds = open(filename_hdf5)
+                elif convert and all(os.path.splitext(filename)[1] == '.csv' for filename in filenames):
+                    # converts the files in parallel, and concatenates the columns
+                    ds = _convert_csv_many(filenames, filename_hdf5, shuffle=shuffle, copy_index=copy_index, **kwargs)
                 else:
-                    # with ProcessPoolExecutor() as executor:
-                    # executor.submit(read_csv_and_convert, filenames, shuffle=shuffle, **kwargs)
                     DataFrames = []
                     for filename in filenames:
                         DataFrames.append(open(filename, convert=bool(convert), shuffle=shuffle, **kwargs))
                     ds = vaex.dataframe.DataFrameConcatenated(DataFrames)
-                if convert:
-                    ds.export_hdf5(filename_hdf5, shuffle=shuffle)
-                    ds = vaex.file.open(filename_hdf5, *args, **kwargs)
+                    if convert:
+                        ds.export_hdf5(filename_hdf5, shuffle=shuffle)
+                        ds = vaex.file.open(filename_hdf5, *args, **kwargs)
 
         if ds is None:
             raise IOError('Unknown error opening: {}'.format(path))
@@ -433,37 +437,46 @@ def read_csv_and_convert(path, shuffle=False, copy_index=True, **kwargs):
     :param kwargs: parameters passed to pandas' read_cvs
 
     '''
-    from concurrent.futures import ProcessPoolExecutor
-    import pandas as pd
     filenames = glob.glob(path)
     if len(filenames) > 1:
         filename_hdf5 = _convert_name(filenames, shuffle=shuffle)
-        filename_hdf5_noshuffle = _convert_name(filenames, shuffle=False)
         if not os.path.exists(filename_hdf5):
-            if not os.path.exists(filename_hdf5_noshuffle):
-                # with ProcessPoolExecutor() as executor:
-                # executor.submit(read_csv_and_convert, filenames, shuffle=shuffle, **kwargs)
-                for filename in filenames:
-                    read_csv_and_convert(filename, shuffle=shuffle, copy_index=copy_index, **kwargs)
-                ds = open_many([_convert_name(k, shuffle=shuffle) for k in filenames])
-            else:
-                ds = open(filename_hdf5_noshuffle)
-            ds.export_hdf5(filename_hdf5, shuffle=shuffle)
+            return _convert_csv_many(filenames, filename_hdf5, shuffle=shuffle, copy_index=copy_index, **kwargs)
         return open(filename_hdf5)
     else:
         filename = filenames[0]
         filename_hdf5 = _convert_name(filename, shuffle=shuffle)
         filename_hdf5_noshuffle = _convert_name(filename, shuffle=False)
         if not os.path.exists(filename_hdf5):
-            if not os.path.exists(filename_hdf5_noshuffle):
-                df = pd.read_csv(filename, **kwargs)
-                ds = from_pandas(df, copy_index=copy_index)
-            else:
-                ds = open(filename_hdf5_noshuffle)
-            ds.export_hdf5(filename_hdf5, shuffle=shuffle)
+            return _convert_csv(filename, shuffle=shuffle, copy_index=copy_index, **kwargs)
         return open(filename_hdf5)
 
 
+def _convert_csv(filename, shuffle=False, copy_index=True, **kwargs):
+    '''Converts a csv file to hdf5 in chunks (see :func:`vaex.hdf5.export.convert_csv`), and opens it'''
+    import vaex.hdf5.export
+    filename_hdf5 = _convert_name(filename, shuffle=shuffle)
+    filename_hdf5_noshuffle = _convert_name(filename, shuffle=False)
+    if not os.path.exists(filename_hdf5_noshuffle):
+        vaex.hdf5.export.convert_csv(filename, filename_hdf5_noshuffle, copy_index=copy_index, **kwargs)
+    if shuffle:
+        open(filename_hdf5_noshuffle).export_hdf5(filename_hdf5, shuffle=shuffle)
+    return open(filename_hdf5)
+
+
+def _convert_csv_many(filenames, filename_hdf5, shuffle=False, copy_index=True, **kwargs):
+    '''Converts csv files in parallel, and concatenates them into a single hdf5 file (see :func:`vaex.hdf5.export.convert_csv_many`), and opens it'''
+    import vaex.hdf5.export
+    if shuffle:
+        filename_hdf5_noshuffle = _convert_name(filenames, shuffle=False)
+        if not os.path.exists(filename_hdf5_noshuffle):
+            vaex.hdf5.export.convert_csv_many(filenames, filename_hdf5_noshuffle, copy_index=copy_index, **kwargs)
+        open(filename_hdf5_noshuffle).export_hdf5(filename_hdf5, shuffle=shuffle)
+    else:
+        vaex.hdf5.export.convert_csv_many(filenames, filename_hdf5, copy_index=copy_index, **kwargs)
+    return open(filename_hdf5)
+
+
 aliases = vaex.settings.main.auto_store_dict("aliases")
 
 # py2/p3 compatibility
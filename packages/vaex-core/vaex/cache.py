@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""Cache for the results of tasks (statistics like count, mean, minmax, etc).
+
+The results are keyed by a fingerprint of the data (the files the columns are memory mapped from, including
+their modification time and size, and the offsets into those files), the state of the DataFrame (virtual
+columns, variables, functions, selections, filter and active range) and the arguments of the task
+(the expressions, normalized to their syntax tree, and binby, limits, shape, etc). Only DataFrames whose
+columns are all memory mapped (read only) are cached, since in memory arrays, or files opened for writing, can be
+modified without us knowing.
+
+Statistics over files that grow by appending rows do not need to pass over all rows again. Next to the result, we
+store the merged grids of the statistic, together with the number of rows it covers (the watermark), under a key that
+does not depend on the number of rows. When the DataFrame has more rows, only the new rows are processed, and merged
+with the stored grids (see :meth:`vaex.tasks.TaskStatistic.resume`). Since this reads the earlier rows of the columns
+the task depends on, to check (using digests of blocks of rows) that they were not modified, it is disabled by default,
+pass resume=True to the executor or set ``VAEX_CACHE_RESUME=1`` to enable it.
+
+The cache has an in memory tier (an LRU cache, bounded by the number of bytes of the results) and an optional
+on disk tier, in ``~/.vaex/cache``, which survives restarts of the Python process.
+
+Since files can still be modified in place by other processes (which the fingerprint may not notice), the cache is
+disabled by default. The executor uses :func:`get_default` by default, which can be configured using the environment
+variables ``VAEX_CACHE_SIZE`` (in bytes, 0, the default, disables the cache) and ``VAEX_CACHE_DISK`` (when set, also
+cache on disk).
+
+Example:
+
+>>> import vaex, vaex.cache
+>>> df = vaex.open('big.hdf5')
+>>> df.executor = vaex.execution.Executor(cache=vaex.cache.Cache())  # or run with VAEX_CACHE_SIZE=268435456
+>>> df.mean(df.x)  # takes a pass over the data
+>>> df.mean(df.x)  # returns instantly
+>>> df.executor.cache.clear()
+"""
+from __future__ import division, print_function
+import ast
+import collections
+import copy
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import uuid
+import warnings
+import weakref
+import numpy as np
+
+import vaex.expresso
+import vaex.utils
+
+logger = logging.getLogger("vaex.cache")
+
+MB = 1024**2
+maxsize_default = 256 * MB
+memory_size_default = int(os.environ.get('VAEX_CACHE_SIZE', 0))
+disk_default = bool(os.environ.get('VAEX_CACHE_DISK', False))
+resume_default = os.environ.get('VAEX_CACHE_RESUME', '0') not in ('', '0', 'false', 'False')
+disk_size_default = 1024 * MB
+
+
+def nbytes(value):
+    """Returns the (approximate) number of bytes a value uses, counting the data of numpy arrays"""
+    if isinstance(value, np.ndarray):
+        size = value.nbytes
+        if np.ma.isMaskedArray(value) and value.mask is not np.ma.nomask:
+            size += value.mask.nbytes
+        return size
+    elif isinstance(value, (list, tuple)):
+        return sum(nbytes(k) for k in value) + 8 * len(value)
+    elif isinstance(value, dict):
+        return sum(nbytes(k) + nbytes(v) for k, v in value.items())
+    elif isinstance(value, (bytes, str)):
+        return len(value)
+    else:
+        return 8
+
+
+class Cache(object):
+    """Cache with an in memory LRU tier, bounded by the number of bytes of the values, and an optional on disk tier.
+
+    Values are copied when they are stored and retrieved, so the values in the cache cannot be modified, unless copy
+    is False (e.g. for read only arrays).
+
+    :param int maxsize: maximum number of bytes of all values in memory
+    :param str path: directory for the on disk tier, or None to only cache in memory
+    :param int disk_maxsize: maximum number of bytes of all values on disk, when exceeded, the least recently used
+        values are removed
+    :param bool copy: copy the values when they are stored and retrieved
+    """
+    def __init__(self, maxsize=maxsize_default, path=None, disk_maxsize=disk_size_default, copy=True):
+        self.maxsize = maxsize
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self.copy = copy
+        self.values = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.values or (self.path is not None and os.path.exists(self._filename(key)))
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.values:
+                value, size = self.values.pop(key)
+                self.values[key] = value, size  # most recently used
+                self.hits += 1
+                return self._copy(value)
+        value = self._disk_get(key)
+        if value is None:
+            self.misses += 1
+            return default
+        value, = value
+        self.hits += 1
+        self._memory_set(key, value)
+        return self._copy(value)
+
+    def set(self, key, value):
+        value = self._copy(value)
+        self._memory_set(key, value)
+        self._disk_set(key, value)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.size = 0
+        if self.path is not None:
+            for filename in glob.glob(os.path.join(self.path, '*.pickle')):
+                os.remove(filename)
+
+    def _copy(self, value):
+        return copy.deepcopy(value) if self.copy else value
+
+    def _memory_set(self, key, value):
+        size = nbytes(value)
+        if size > self.maxsize:
+            return
+        with self.lock:
+            if key in self.values:
+                self.size -= self.values.pop(key)[1]
+            self.values[key] = value, size
+            self.size += size
+            while self.size > self.maxsize:
+                key, (value, size) = self.values.popitem(last=False)
+                self.size -= size
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+    def _disk_get(self, key):
+        """Returns a tuple with the value, or None when the value is not on disk"""
+        if self.path is None:
+            return None
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(filename, None)  # we use the modification time to remove the least recently used values
+            return value,
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _disk_set(self, key, value):
+        if self.path is None:
+            return
+        try:
+            fd, filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(filename, self._filename(key))  # atomic, so other processes never see half written files
+        except (IOError, OSError, pickle.PicklingError):
+            logger.exception("could not write %r to the disk cache", key)
+            return
+        stats = []
+        for filename in glob.glob(os.path.join(self.path, '*.pickle')):
+            try:
+                stats.append((os.stat(filename), filename))
+            except OSError:
+                pass  # removed by another process
+        total = sum(stat.st_size for stat, filename in stats)
+        for stat, filename in sorted(stats, key=lambda item: item[0].st_mtime):
+            if total <= self.disk_maxsize:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= stat.st_size
+
+
+_default = []
+
+
+def get_default():
+    """Returns the cache used by the executors by default, or None when caching is disabled (VAEX_CACHE_SIZE=0, the default)"""
+    if not _default:
+        if memory_size_default > 0:
+            path = vaex.utils.get_private_dir('cache') if disk_default else None
+            _default.append(Cache(memory_size_default, path=path))
+        else:
+            _default.append(None)
+    return _default[0]
+
+
+def normalize_expression(expression):
+    """Returns a string that is equal for expressions that only differ in formatting (e.g. 'x+1' and 'x + 1')"""
+    expression = str(expression)
+    try:
+        return ast.dump(vaex.expresso.parse_expression(expression))
+    except Exception:
+        return expression
+
+
+def fingerprint(df, prefix=False):
+    """Returns a fingerprint of the data and the state of the DataFrame, or None when the data cannot be fingerprinted.
+
+    If prefix is True, the fingerprint does not depend on the number of rows (the length of the columns and their offsets
+    in the files, the size and modification time of the files, and the active range), so it stays the same when rows
+    are appended to the files (which may move the columns). This requires the active range to start at 0, otherwise
+    None is returned.
+    """
+    import vaex.dataset_mmap
+    columns = vaex.dataset_mmap.mapped_columns(df, readonly=True)
+    if columns is None or (prefix and df._index_start != 0):
+        return None
+    paths = sorted(set(data[0] for data, mask in columns.values()) | set(mask[0] for data, mask in columns.values() if mask))
+    files = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        files.append(path if prefix else (path, stat.st_ino, stat.st_mtime, stat.st_size))
+    import vaex.serialize
+    if not all(vaex.serialize.can_serialize(function.f) for function in df.functions.values()):
+        return None  # they would not be part of the state
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        state = df.state_get()
+    # leave out the metadata (descriptions, units, etc), which does not change the results
+    state = {name: state[name] for name in ['virtual_columns', 'variables', 'functions', 'selections', 'active_range']}
+    if prefix:
+        def without_length(spec):  # (path, offset, dtype, shape, strides)
+            return (spec[0], spec[2], spec[4]) if spec else spec
+        columns = {name: (without_length(data), without_length(mask)) for name, (data, mask) in columns.items()}
+        del state['active_range']
+    return sorted(columns.items()), files, state
+
+
+def rows_digests(df, rows, digests=(), digests_rows=0, block_size=1024**2, columns=None, map=map):
+    """Returns the digests of the first rows of the columns, one for each block of block_size rows, which are used to
+    check that the rows of an earlier pass were not modified (and thus that the files only grew by appending rows).
+
+    :param int rows: number of rows (from the start of the columns)
+    :param digests: digests returned earlier for the first digests_rows rows, of which the digests of the complete
+        blocks are reused
+    :param int block_size: number of rows per digest
+    :param columns: names of the columns to include (default all), e.g. only the columns a task depends on
+    :param map: function like the builtin map, used to compute the digests of the blocks (e.g. in a thread pool)
+    """
+    columns = sorted(df.columns) if columns is None else columns
+    digests = list(digests)[:min(rows, digests_rows) // block_size]
+
+    def block_digest(start):
+        digest = hashlib.sha1()
+        for name in columns:
+            part = df.columns[name][start:min(start + block_size, rows)]
+            if np.ma.isMaskedArray(part):
+                digest.update(np.ascontiguousarray(np.ma.getmaskarray(part)).view(np.uint8))
+                part = part.data
+            digest.update(np.ascontiguousarray(part).view(np.uint8))
+        return digest.hexdigest()
+    digests.extend(map(block_digest, range(len(digests) * block_size, rows, block_size)))
+    return digests
+
+
+def _json_default(value):
+    if isinstance(value, np.ndarray):  # e.g. variables, the repr would abbreviate large arrays
+        return [value.dtype.str, value.shape, hashlib.sha1(np.ascontiguousarray(value).view(np.uint8)).hexdigest()]
+    return repr(value)
+
+
+def key(task, prefix=False):
+    """Returns the key of the result of the task in the cache, or None when the task cannot be cached.
+
+    If prefix is True, returns the key for the state of a resumable task (see :meth:`vaex.tasks.TaskStatistic.resume`), which
+    does not depend on the number of rows (see :func:`fingerprint`)
+    """
+    if prefix and not task.resumable:
+        return None
+    task_fingerprint = task.fingerprint()
+    if task_fingerprint is None:
+        return None
+    df_fingerprint = fingerprint(task.df, prefix=prefix)
+    if df_fingerprint is None:
+        return None
+    text = json.dumps([task_fingerprint, df_fingerprint, prefix], sort_keys=True, default=_json_default)
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+class SelectionMaskCache(Cache):
+    """Cache for the masks of the selections (and the filter), shared by the DataFrames attached to it and their copies.
+
+    The webserver makes a copy of a DataFrame for each request, which would otherwise evaluate the selections and the
+    filter again for each request. The masks are stored bit packed (a bit per row), keyed by the DataFrame that was
+    attached, the selection (including the previous selections it is combined with), the filter, the virtual columns,
+    variables and functions, the columns (such that copies with other, or trimmed, columns do not share masks), and the
+    rows. When a variable or (virtual) column of an attached DataFrame changes, its
+    masks are removed.
+
+    Example:
+
+    >>> cache = vaex.cache.SelectionMaskCache(100 * vaex.cache.MB)
+    >>> cache.attach(df)
+    >>> dfc = df.copy()
+    >>> dfc.count(selection='x > 0')  # stores the masks
+    >>> df.copy().count(selection='x > 0')  # uses the masks
+
+    :param int maxsize: maximum number of bytes of the (bit packed) masks
+    """
+    def __init__(self, maxsize=maxsize_default):
+        super(SelectionMaskCache, self).__init__(maxsize, copy=False)
+        self._columns = {}  # maps id(column) to (weak reference, number), see _column_number
+        self._columns_lock = threading.Lock()
+        self._column_numbers = itertools.count()
+
+    def _column_number(self, column):
+        """Returns a number that identifies the column, which unlike id() is not reused for another column once the
+        column is garbage collected, or None when the column does not support weak references"""
+        key = id(column)
+        with self._columns_lock:
+            entry = self._columns.get(key)
+            if entry is None or entry[0]() is not column:
+                def remove(ref):
+                    with self._columns_lock:
+                        if key in self._columns and self._columns[key][0] is ref:
+                            del self._columns[key]
+                try:
+                    entry = self._columns[key] = weakref.ref(column, remove), next(self._column_numbers)
+                except TypeError:
+                    return None
+            return entry[1]
+
+    def attach(self, df):
+        """Shares the masks of the selections of df and its copies (made after attaching)"""
+        token = str(uuid.uuid4())
+        df._selection_mask_cache = self, token
+        df.signal_variable_changed.connect(lambda *args: self.invalidate(token))
+        df.signal_column_changed.connect(lambda *args: self.invalidate(token))
+
+    def invalidate(self, token):
+        """Removes the masks of the DataFrame that was attached with token (and its copies)"""
+        with self.lock:
+            for key in [key for key in self.values if key[0] == token]:
+                self.size -= self.values.pop(key)[1]
+
+    def key(self, df, token, name, selection, i1, i2):
+        """Returns the key of the mask of the selection for the rows i1 to i2 (relative to the active range), or None
+        when the mask cannot be shared"""
+        import vaex.dataframe
+        columns = sorted((column_name, self._column_number(column)) for column_name, column in df.columns.items())
+        if any(number is None for column_name, number in columns):
+            return None
+        filter = None
+        if df.filtered and name != vaex.dataframe.FILTER_SELECTION_NAME:
+            filter = df.get_selection(vaex.dataframe.FILTER_SELECTION_NAME).to_dict()
+        state = [name, selection.to_dict(), filter, sorted(df.virtual_columns.items()), sorted(df.variables.items()),
+                 sorted((function_name, id(function)) for function_name, function in df.functions.items()),
+                 columns, df._index_start + i1, df._index_start + i2]
+        text = json.dumps(state, sort_keys=True, default=_json_default)
+        return token, hashlib.sha1(text.encode('utf8')).hexdigest()
+
+    def get_mask(self, key, length):
+        """Returns the mask (of length rows) stored under key, or None"""
+        packed = self.get(key)
+        if packed is not None:
+            return np.unpackbits(packed)[:length].astype(np.bool_)
+
+    def set_mask(self, key, mask):
+        """Stores the mask under key, only boolean arrays without missing values are stored"""
+        if isinstance(mask, np.ndarray) and not np.ma.isMaskedArray(mask) and mask.dtype == np.bool_:
+            self.set(key, np.packbits(mask))
@@ -30,6 +30,7 @@ import vaex.execution
 import vaex.expresso
 import logging
 import vaex.kld
+import vaex.zonemaps
 from . import selections, tasks, scopes
 from .functions import expression_namespace
 from .delayed import delayed, delayed_args, delayed_list
@@ -100,6 +101,8 @@ _doc_snippets["limits"] = """description for the min and max values for the expr
 _doc_snippets["shape"] = """shape for the array where the statistic is calculated on, if only an integer is given, it is used for all dimensions, e.g. shape=128, shape=[128, 256]"""
 _doc_snippets["percentile_limits"] = """description for the min and max values to use for the cumulative histogram, should currently only be 'minmax'"""
 _doc_snippets["percentile_shape"] = """shape for the array where the cumulative histogram is calculated on, integer type"""
+_doc_snippets["percentage"] = """percentage (between 0 and 100) or a list of percentages"""
+_doc_snippets["sketch_size"] = """size of the quantile sketches, a larger size gives more accurate results, but uses more memory, see :class:`vaex.sketch.KLL`"""
 _doc_snippets["selection"] = """Name of selection to use (or True for the 'default'), or all the data (when selection is None or False), or a list of selections"""
 _doc_snippets["delay"] = """Do not return the result, but a proxy for delayhronous calculations (currently only for internal use)"""
 _doc_snippets["progress"] = """A callable that takes one argument (a floating point value between 0 and 1) indicating the progress, calculations are cancelled when this callable returns False"""
@@ -199,7 +202,9 @@ class DataFrame(object):
 
         self._categories = collections.OrderedDict()
         self._selection_mask_caches = collections.defaultdict(dict)
+        self._selection_mask_cache = None  # (vaex.cache.SelectionMaskCache, token) when attached to a shared cache
         self._renamed_columns = []
+        self._zone_maps = {}  # maps column name to a vaex.zonemaps.ZoneMap
 
     def __getattr__(self, name):
         # will support the hidden methods
@@ -238,9 +243,10 @@ class DataFrame(object):
     def filtered(self):
         return self.has_selection(FILTER_SELECTION_NAME)
 
-    def map_reduce(self, map, reduce, arguments, progress=False, delay=False, info=False, ordered_reduce=False, name='map reduce (custom)'):
+    def map_reduce(self, map, reduce, arguments, progress=False, delay=False, info=False, ordered_reduce=False, name='map reduce (custom)', fingerprint=None):
         # def map_wrapper(*blocks):
-        task = tasks.TaskMapReduce(self, arguments, map, reduce, info=info, ordered_reduce=ordered_reduce)
+        # only when a fingerprint is given (which identifies map and reduce), the result can be cached, see vaex.cache
+        task = tasks.TaskMapReduce(self, arguments, map, reduce, info=info, ordered_reduce=ordered_reduce, fingerprint=fingerprint)
         progressbar = vaex.utils.progressbars(progress)
         progressbar.add_task(task, name)
         self.executor.schedule(task)
@@ -259,30 +265,39 @@ class DataFrame(object):
         arguments = _ensure_strings_from_expressions(arguments)
         return lazy_function(*arguments)
 
+    @docsubst
     def unique(self, expression, return_inverse=False, progress=False, delay=False):
+        """Returns the distinct values of an expression in sorted order (missing values last).
+
+        The values are found in a single pass using hash tables (see :class:`vaex.tasks.TaskValueCounts`), so memory
+        usage scales with the number of distinct values, not with the number of rows.
+
+        :param expression: expression, e.g. 'x'
+        :param return_inverse: also return, for each row, the index into the distinct values
+        :param progress: {progress}
+        :param delay: {delay}
+        :returns: the distinct values, and when return_inverse is True, a tuple (values, indices)
+        """
+        values_counts = self._value_counts(expression, return_inverse=return_inverse, progress=progress, delay=True)
+
+        @delayed
+        def finish(result):
+            if return_inverse:
+                values, counts, inverse = result
+                return values, inverse
+            else:
+                values, counts = result
+                return values
+        return self._delay(delay, finish(values_counts))
+
+    def _value_counts(self, expression, selection=None, return_inverse=False, progress=None, delay=False):
+        """Returns the distinct values of expression (sorted) and their counts, and optionally the inverse indices"""
         expression = _ensure_string_from_expression(expression)
-        if return_inverse:
-            def map(thread_index, i1, i2, ar):  # this will be called with a chunk of the data
-                return i1, (np.unique(ar, return_inverse=True))  # returns (sort key, (unique elements, indices))
-            def reduce(a, b):  # gets called with a list of the return values of map
-                uniques_a, indices_a = a
-                uniques_b, indices_b = b
-                Na = len(uniques_a)
-                Nb = len(uniques_b)
-                joined = np.concatenate([uniques_a, uniques_b])  # put all 'sub-unique' together
-                uniques, indices_joined = np.unique(joined, return_inverse=True)  # find all the unique items
-                # get back the merged indices
-                indices = np.concatenate([indices_joined[:Na][indices_a], indices_joined[Na:][indices_b]])
-                return uniques, indices
-            return self.map_reduce(map, reduce, [expression], delay=delay, progress=progress, info=True, ordered_reduce=True, name='unique')
-            # return np.unique(self.evaluate(expression), return_inverse=return_inverse)
-        else:
-            def map(ar):  # this will be called with a chunk of the data
-                return np.unique(ar)  # returns the unique elements
-            def reduce(a, b):  # gets called with a list of the return values of map
-                joined = np.concatenate([a, b])  # put all 'sub-unique' together
-                return np.unique(joined)  # find all the unique items
-        return self.map_reduce(map, reduce, [expression], delay=delay, progress=progress, name='unique')
+        task = tasks.TaskValueCounts(self, expression, selection=selection, return_inverse=return_inverse)
+        self.executor.schedule(task)
+        progressbar = vaex.utils.progressbars(progress)
+        progressbar.add_task(task, "value counts for %r" % expression)
+        return self._delay(delay, task)
 
     @docsubst
     def mutual_information(self, x, y=None, mi_limits=None, mi_shape=256, binby=[], limits=None, shape=default_shape, sort=False, selection=False, delay=False):
@@ -1142,6 +1157,71 @@ class DataFrame(object):
             return value
         return self._delay(delay, finish2(result))
 
+    @docsubst
+    def percentile_sketch(self, expression, percentage=50., binby=[], limits=None, shape=default_shape, sketch_size=256, selection=False, delay=False, progress=None):
+        """Calculate the percentile given by percentage (or a list of percentages), possibly on a grid defined by binby.
+
+        Unlike :meth:`percentile_approx`, this does not need the limits of the expression, but uses a quantile
+        sketch (see :mod:`vaex.sketch`) for each bin, so it can be calculated in the same pass as other statistics.
+        The error in the rank is about 1.7/sketch_size (e.g. with the default size, the median will be between the
+        49.3 and 50.7 percentile), for less than sketch_size values, the result is exact.
+
+        Example:
+
+        >>> df.percentile_sketch("x", 10), df.percentile_sketch("x", [10, 90])
+        (-8.3220355, array([-8.3220355,  7.92080358]))
+        >>> df.percentile_sketch("x", 50, binby="x", shape=5, limits=[-10, 10])
+        array([-7.56462982, -3.61036641, -0.01296306,  3.56697863,  7.45838367])
+
+        :param expression: {expression}
+        :param percentage: {percentage}
+        :param binby: {binby}
+        :param limits: {limits}
+        :param shape: {shape}
+        :param sketch_size: {sketch_size}
+        :param selection: {selection}
+        :param delay: {delay}
+        :param progress: {progress}
+        :return: {return_stat_scalar}, when percentage is a list, the last dimension has the same length
+        """
+        expression = _ensure_strings_from_expressions(expression)
+        binby = _ensure_strings_from_expressions(_ensure_list(binby))
+        waslist, [expressions, ] = vaex.utils.listify(expression)
+        percentage_waslist, [percentages, ] = vaex.utils.listify(percentage)
+        quantiles = [float(percentage) / 100 for percentage in percentages]
+        progressbar = vaex.utils.progressbars(progress)
+
+        @delayed
+        def calculate(expression, limits):
+            task = tasks.TaskQuantile(self, expression, binby, shape, limits, quantiles, k=sketch_size, selection=selection)
+            self.executor.schedule(task)
+            progressbar.add_task(task, "percentile for %s" % expression)
+            return task
+
+        @delayed
+        def finish(*grids):
+            values = [grid if percentage_waslist else grid[..., 0] for grid in grids]
+            return vaex.utils.unlistify(waslist, values)
+        limits = self.limits(binby, limits, delay=True)
+        stats = [calculate(expression, limits) for expression in expressions]
+        return self._delay(delay, finish(*stats))
+
+    @docsubst
+    def median_sketch(self, expression, binby=[], limits=None, shape=default_shape, sketch_size=256, selection=False, delay=False, progress=None):
+        """Calculate the median, possibly on a grid defined by binby, using quantile sketches, see :meth:`percentile_sketch`.
+
+        :param expression: {expression}
+        :param binby: {binby}
+        :param limits: {limits}
+        :param shape: {shape}
+        :param sketch_size: {sketch_size}
+        :param selection: {selection}
+        :param delay: {delay}
+        :param progress: {progress}
+        :return: {return_stat_scalar}
+        """
+        return self.percentile_sketch(expression, 50, binby=binby, limits=limits, shape=shape, sketch_size=sketch_size, selection=selection, delay=delay, progress=progress)
+
     def _use_delay(self, delay):
         return delay == True
 
@@ -1745,6 +1825,8 @@ class DataFrame(object):
     def is_masked(self, column):
         '''Return if a column is a masked (numpy.ma) column.'''
         if column in self.columns:
+            if isinstance(self.columns[column], Column):
+                return getattr(self.columns[column], 'is_masked', False)
             return np.ma.isMaskedArray(self.columns[column])
         return False
 
@@ -2524,6 +2606,15 @@ class DataFrame(object):
         funcs = set(expression_namespace.keys())
         return vaex.expresso.validate_expression(expression, vars, funcs)
 
+    def _chunk_boundaries(self):
+        """Returns the row numbers (relative to the active range) where columns are split into chunks (e.g. the record
+        batches of arrow files) or blocks of zone maps, or None when the columns are contiguous"""
+        offsets = [column.chunk_offsets for column in self.columns.values() if hasattr(column, 'chunk_offsets')]
+        offsets += [zone_map.boundaries() for zone_map in vaex.zonemaps._zone_maps(self).values()]
+        if not offsets:
+            return None
+        return np.unique(np.concatenate(offsets)) - self._index_start
+
     def _block_scope(self, i1, i2):
         variables = {key: self.evaluate_variable(key) for key in self.variables.keys()}
         return scopes._BlockScope(self, i1, i2, **variables)
@@ -2606,6 +2697,8 @@ class DataFrame(object):
             self.virtual_columns[new_name] = expression
         if store_in_state:
             self._renamed_columns.append((name, new_name))
+        if name in self._zone_maps:
+            self._zone_maps[new_name] = self._zone_maps.pop(name)
         for d in [self.ucds, self.units, self.descriptions]:
             if name in d:
                 d[new_name] = d[name]
@@ -3561,6 +3654,9 @@ class DataFrame(object):
                         df.columns[name] = column[self._index_start:self._index_end]
                     else:
                         df.columns[name] = column.trim(self._index_start, self._index_end)
+                    zone_map = vaex.zonemaps.get(self, name)
+                    if zone_map is not None:
+                        df._zone_maps[name] = zone_map.trim(df.columns[name], self._index_start)
         df._length_original = self.length_unfiltered()
         df._length_unfiltered = df._length_original
         df._index_start = 0
@@ -3593,7 +3689,8 @@ class DataFrame(object):
         # which should be shared among multiple ColumnIndex'es, so we store
         # them in this dict
         direct_indices_map = {}
-        indices = np.array(indices)
+        # the (memory mapped) row numbers of a sort are not copied into memory
+        indices = np.asarray(indices) if isinstance(indices, np.memmap) else np.array(indices)
         for name in df:
             column = df.columns.get(name)
             if column is not None:
@@ -3767,9 +3864,14 @@ class DataFrame(object):
             start = offset
 
     @docsubst
-    def sort(self, by, ascending=True, kind='quicksort'):
+    def sort(self, by, ascending=True, kind='quicksort', progress=None):
         '''Return a sorted DataFrame, sorted by the expression 'by'
 
+        Each chunk of the DataFrame is sorted in parallel, and when the DataFrame does not fit into a single
+        chunk, the sorted chunks are written to temporary (memory mapped) files and merged, so the
+        expressions do not need to fit into memory. The sort is stable, and missing values (masked or NaN) are
+        put last.
+
         {note_copy}
 
         {note_filter}
@@ -3791,18 +3893,70 @@ class DataFrame(object):
           1  c      3  1.44
           2  a      1  0.64
           3  b      2  0.04
-
-        :param str or expression by: expression to sort by
-        :param bool ascending: ascending (default, True) or descending (False)
-        :param str kind: kind of algorithm to use (passed to numpy.argsort)
+        >>> df.sort(['x > 2', 's'], ascending=[True, False])
+          #  s      x     y
+          0  b      2  0.04
+          1  a      1  0.64
+          2  d      4  4.84
+          3  c      3  1.44
+
+        :param str or expression or list by: expression, or list of expressions to sort by (the first being the most significant)
+        :param bool or list ascending: ascending (default, True) or descending (False), or a list with a value for each expression
+        :param str kind: ignored, only kept for backwards compatibility (the sort is always stable)
+        :param progress: {progress}
         '''
         self = self.trim()
-        values = self.evaluate(by, filtered=False)
-        indices = np.argsort(values, kind=kind)
-        if not ascending:
-            indices = indices[::-1].copy()  # this may be used a lot, so copy for performance
+        indices = self._sort(by, ascending, progress=progress)
         return self.take(indices)
 
+    @docsubst
+    def nlargest(self, n, expression, selection=False, progress=None):
+        '''Return a DataFrame with the n rows that have the largest values for expression, in descending order
+
+        This takes a single pass over the data, where each thread keeps the n largest values (and rows) it has
+        seen, so it is exact and much faster than sorting. For equal values, the first row comes first, and
+        rows with missing values (masked or NaN) are skipped.
+
+        {note_copy}
+
+        Example:
+
+        >>> df = vaex.from_arrays(x=np.array([3, 1, 4, 1, 5, 9, 2, 6]))
+        >>> df.nlargest(3, 'x')
+          #    x
+          0    9
+          1    6
+          2    5
+
+        :param int n: number of rows
+        :param str or expression expression: numerical or datetime expression
+        :param selection: {selection}
+        :param progress: {progress}
+        '''
+        return self._top(n, expression, largest=True, selection=selection, progress=progress)
+
+    @docsubst
+    def nsmallest(self, n, expression, selection=False, progress=None):
+        '''Return a DataFrame with the n rows that have the smallest values for expression, in ascending order, see :meth:`nlargest`
+
+        {note_copy}
+
+        Example:
+
+        >>> df = vaex.from_arrays(x=np.array([3, 1, 4, 1, 5, 9, 2, 6]))
+        >>> df.nsmallest(3, 'x')
+          #    x
+          0    1
+          1    1
+          2    2
+
+        :param int n: number of rows
+        :param str or expression expression: numerical or datetime expression
+        :param selection: {selection}
+        :param progress: {progress}
+        '''
+        return self._top(n, expression, largest=False, selection=selection, progress=progress)
+
     @docsubst
     def fillna(self, value, fill_nan=True, fill_masked=True, column_names=None, prefix='__original_', inplace=False):
         '''Return a DataFrame, where missing values/NaN are filled with 'value'
@@ -4409,6 +4563,8 @@ class DataFrameLocal(DataFrame):
         df._renamed_columns = list(self._renamed_columns)
         df.units.update(self.units)
         df._categories.update(self._categories)
+        df._zone_maps.update(self._zone_maps)
+        df._selection_mask_cache = self._selection_mask_cache
         column_names = column_names or self.get_column_names(hidden=True)
         all_column_names = self.get_column_names(hidden=True)
 
@@ -4708,9 +4864,67 @@ class DataFrameLocal(DataFrame):
                                 print("%s[%d] == %s != %s other.%s[%d] (diff = %s)" % (column_name, indices[i], values1[i], values2[i], column_name, indices[i], diff))
         return different_values, missing, type_mismatch, meta_mismatch
 
+    def _hash_index(self, expressions, progress=None, delay=False):
+        """Build a :class:`vaex.hash.HashIndex` for the (list of) expressions in a single pass over the data"""
+        expressions = _ensure_strings_from_expressions(_ensure_list(expressions))
+        task = tasks.TaskHashIndex(self, expressions)
+        self.executor.schedule(task)
+        progressbar = vaex.utils.progressbars(progress)
+        progressbar.add_task(task, "hash index for %r" % (expressions,))
+        return self._delay(delay, task)
+
+    def _sort(self, by, ascending=True, progress=None, delay=False, selection=None, filtered=False):
+        """Returns the row numbers (ignoring the filter, unless filtered is True) that sort the DataFrame by the (list of)
+        expressions, only the rows of the selection (and the filter) are sorted when selection is given"""
+        by = _ensure_strings_from_expressions(_ensure_list(by))
+        if isinstance(ascending, (list, tuple)):
+            if len(ascending) != len(by):
+                raise ValueError('ascending should have the same length as by (%d), not %d' % (len(by), len(ascending)))
+            ascending = list(ascending)
+        else:
+            ascending = [ascending] * len(by)
+        task = tasks.TaskSort(self, by, ascending, selection=selection, filtered=filtered)
+        self.executor.schedule(task)
+        progressbar = vaex.utils.progressbars(progress)
+        progressbar.add_task(task, "sort by %r" % (by,))
+        return self._delay(delay, task)
+
+    def _top(self, n, expression, largest, selection=False, progress=None):
+        """Returns a DataFrame with the n rows with the smallest (or largest) values of expression"""
+        self = self.trim()
+        task = tasks.TaskTopK(self, _ensure_string_from_expression(expression), n, largest=largest, selection=selection)
+        self.executor.schedule(task)
+        progressbar = vaex.utils.progressbars(progress)
+        progressbar.add_task(task, "%s %d" % ("nlargest" if largest else "nsmallest", n))
+        values, rows = self._delay(False, task)
+        return self.take(rows)
+
+    def _hash_lookup(self, index, expressions, progress=None):
+        """Returns for every row (ignoring the filter) the row number of the matching key in index, or -1 when not found"""
+        expressions = _ensure_strings_from_expressions(_ensure_list(expressions))
+        rows = np.zeros(self.length_unfiltered(), dtype=np.int64)
+
+        def map(thread_index, i1, i2, *blocks):
+            rows[i1:i2] = index.lookup(blocks)
+            return 0
+        self.map_reduce(map, lambda a, b: a, expressions, info=True, progress=progress, name='hash lookup')
+        return rows
+
+    def _join_index(self, left_on, right, right_on, progress=None):
+        """Returns for each row of self, the matching row number of right (or -1), for a many to one join"""
+        left_on = _ensure_list(left_on)
+        right_on = _ensure_list(right_on)
+        if len(left_on) != len(right_on):
+            raise ValueError('left_on (%r) and right_on (%r) should have the same number of expressions' % (left_on, right_on))
+        index = right._hash_index(right_on, progress=progress)
+        if not index.unique:
+            raise ValueError('the keys %r of the right DataFrame are not unique, only many to one joins are supported' % (right_on,))
+        return self._hash_lookup(index, left_on, progress=progress)
+
     def _join(self, key, other, key_other, column_names=None, prefix=None):
         """Experimental joining of tables, (equivalent to SQL left join)
 
+        Like :meth:`join`, the keys of other should be unique, and rows without a match get missing (masked) values.
 
         Example:
 
@@ -4728,49 +4942,21 @@ class DataFrameLocal(DataFrame):
         :param prefix: add a prefix to the new column (or not when None)
         :return:
         """
-        N = len(self)
-        N_other = len(other)
         if column_names is None:
             column_names = other.get_column_names(virtual=False)
         for column_name in column_names:
             if prefix is None and column_name in self:
                 raise ValueError("column %s already exists" % column_name)
-        key = self.evaluate(key)
-        key_other = other.evaluate(key_other)
-        index = dict(zip(key, range(N)))
-        index_other = dict(zip(key_other, range(N_other)))
-
-        from_indices = np.zeros(N_other, dtype=np.int64)
-        to_indices = np.zeros(N_other, dtype=np.int64)
-        for i in range(N_other):
-            if key_other[i] in index:
-                to_indices[i] = index[key_other[i]]
-                from_indices[i] = index_other[key_other[i]]
-            else:
-                to_indices[i] = -1
-                from_indices[i] = -1
-        mask = to_indices != -1
-        to_indices = to_indices[mask]
-        from_indices = from_indices[mask]
-
+        other = other.extract()
+        to_other = self._join_index(key, other, key_other)
+        missing = to_other == -1
+        lookup = np.ma.array(to_other, mask=missing) if missing.any() else to_other  # only masked when needed
         for column_name in column_names:
-            dtype = other.dtype(column_name)
-            if dtype.kind == "f":
-                data = np.zeros(N, dtype=dtype)
-                data[:] = np.nan
-                data[to_indices] = other.evaluate(column_name)[from_indices]
-            else:
-                data = np.ma.masked_all(N, dtype=dtype)
-                values = other.evaluate(column_name)[from_indices]
-                data[to_indices] = values
-                data.mask[to_indices] = np.ma.masked
-                if not np.ma.is_masked(data):  # forget the mask if we do not need it
-                    data = data.data
             if prefix:
                 new_name = prefix + column_name
             else:
                 new_name = column_name
-            self.add_column(new_name, data)
+            self.add_column(new_name, _column_indexed(other, lookup, column_name))
 
     @docsubst
     def join(self, other, on=None, left_on=None, right_on=None, lsuffix='', rsuffix='', how='left', inplace=False):
@@ -4783,6 +4969,10 @@ class DataFrameLocal(DataFrame):
         change). If either DataFrame is heavily filtered (contains just a small number of rows) consider running
         :func:`DataFrame.extract` first.
 
+        The keys of the right DataFrame should be unique (many to one join). The matching is done using a hash
+        index that is built in a single pass over the right DataFrame, and the joined columns are not copied,
+        but refer to the rows of the right DataFrame.
+
         Example:
 
         >>> a = np.array(['a', 'b', 'c'])
@@ -4794,27 +4984,27 @@ class DataFrameLocal(DataFrame):
         >>> ds1.join(ds2, left_on='a', right_on='b')
 
         :param other: Other DataFrame to join with (the right side)
-        :param on: default key for the left table (self)
+        :param on: default key for the left table (self), or a list of keys for joining on multiple columns
         :param left_on: key for the left table (self), overrides on
         :param right_on: default key for the right table (other), overrides on
         :param lsuffix: suffix to add to the left column names in case of a name collision
         :param rsuffix: similar for the right
         :param how: how to join, 'left' keeps all rows on the left, and adds columns (with possible missing values)
-                'right' is similar with self and other swapped.
+                'right' is similar with self and other swapped, 'inner' only keeps the rows that match.
         :param inplace: {inplace}
         :return:
         """
         ds = self if inplace else self.copy()
-        if how == 'left':
+        if how in ['left', 'inner']:
             left = ds
             right = other
         elif how == 'right':
-            left = other
+            left = other.copy()  # we modify left, so never work on other directly
             right = ds
             lsuffix, rsuffix = rsuffix, lsuffix
             left_on, right_on = right_on, left_on
         else:
-            raise ValueError('join type not supported: {}, only left and right'.format(how))
+            raise ValueError('join type not supported: {}, only left, right and inner'.format(how))
 
         for name in right:
             if name in left and name + rsuffix == name + lsuffix:
@@ -4823,11 +5013,11 @@ class DataFrameLocal(DataFrame):
 
         right = right.extract()  # get rid of filters and active_range
         assert left.length_unfiltered() == left.length_original()
-        N = left.length_unfiltered()
-        N_other = len(right)
-        left_on = left_on or on
-        right_on = right_on or on
+        left_on = _ensure_strings_from_expressions(left_on or on)
+        right_on = _ensure_strings_from_expressions(right_on or on)
         if left_on is None and right_on is None:
+            if how == 'inner':
+                raise ValueError('an inner join requires keys to join on')
             for name in right:
                 right_name = name
                 if name in left:
@@ -4838,40 +5028,17 @@ class DataFrameLocal(DataFrame):
                 else:
                     left.add_column(right_name, right.columns[name])
         else:
-            left_values = left.evaluate(left_on, filtered=False)
-            right_values = right.evaluate(right_on)
-            # maps from the left_values to row #
-            if np.ma.isMaskedArray(left_values):
-                mask = ~left_values.mask
-                left_values = left_values.data
-                index_left = dict(zip(left_values[mask], np.arange(N)[mask]))
-            else:
-                index_left = dict(zip(left_values, np.arange(N)))
-            # idem for right
-            if np.ma.isMaskedArray(right_values):
-                mask = ~right_values.mask
-                right_values = right_values.data
-                index_other = dict(zip(right_values[mask], np.arange(N_other)[mask]))
+            # for each row on the left, the matching row on the right (or -1)
+            left_row_to_right = left._join_index(left_on, right, right_on)
+            if how == 'inner':
+                if inplace:
+                    raise ValueError('inplace is not supported for inner joins')
+                matched = np.flatnonzero(left_row_to_right != -1)
+                left = left.take(matched)
+                lookup = left_row_to_right[matched]
             else:
-                index_other = dict(zip(right_values, np.arange(N_other)))
-
-            # we do a left join, find all rows of the right DataFrame
-            # that has an entry on the left
-            # for each row in the right
-            # find which row it needs to go to in the right
-            # from_indices = np.zeros(N_other, dtype=np.int64)  # row # of right
-            # to_indices = np.zeros(N_other, dtype=np.int64)    # goes to row # on the left
-            # keep a boolean mask of which rows are found
-            left_mask = np.ones(N, dtype=np.bool)
-            # and which row they point to in the right
-            left_row_to_right = np.zeros(N, dtype=np.int64) - 1
-            for i in range(N_other):
-                left_row = index_left.get(right_values[i])
-                if left_row is not None:
-                    left_mask[left_row] = False  # unmask, it exists
-                    left_row_to_right[left_row] = i
-
-            lookup = np.ma.array(left_row_to_right, mask=left_mask)
+                missing = left_row_to_right == -1
+                lookup = np.ma.array(left_row_to_right, mask=missing) if missing.any() else left_row_to_right
             for name in right:
                 right_name = name
                 if name in left:
@@ -4880,7 +5047,7 @@ class DataFrameLocal(DataFrame):
                 if name in right.virtual_columns:
                     left.add_virtual_column(right_name, right.virtual_columns[name])
                 else:
-                    left.add_column(right_name, ColumnIndexed(right, lookup, name))
+                    left.add_column(right_name, _column_indexed(right, lookup, name))
         return left
 
     def export(self, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=False, sort=None, ascending=True):
@@ -4925,7 +5092,7 @@ class DataFrameLocal(DataFrame):
         import vaex_arrow.export
         vaex_arrow.export.export(self, path, column_names, byteorder, shuffle, selection, progress=progress, virtual=virtual, sort=sort, ascending=ascending)
 
-    def export_hdf5(self, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=False, sort=None, ascending=True):
+    def export_hdf5(self, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=False, sort=None, ascending=True, compression=None, zone_maps=False):
         """Exports the DataFrame to a vaex hdf5 file
 
         :param DataFrameLocal df: DataFrame to export
@@ -4939,10 +5106,16 @@ class DataFrameLocal(DataFrame):
         :param: bool virtual: When True, export virtual columns
         :param str sort: expression used for sorting the output
         :param bool ascending: sort ascending (True) or descending
+        :param str compression: store the columns chunked and compressed, using 'gzip', 'lzf', 'blosc' or 'lz4' (the last
+                two require the hdf5plugin package), which saves disk space, but the columns need to be decompressed
+                when used (see :class:`vaex.hdf5.dataset.ColumnHdf5Chunked`)
+        :param zone_maps: store the minimum, maximum and number of missing values for each block of rows of the numerical
+                columns (see :mod:`vaex.zonemaps`), such that selections can skip blocks, and counts and minmax can be
+                computed without reading the data. When True, blocks are 65536 rows, an int gives the number of rows.
         :return:
         """
         import vaex.export
-        vaex.export.export_hdf5(self, path, column_names, byteorder, shuffle, selection, progress=progress, virtual=virtual, sort=sort, ascending=ascending)
+        vaex.export.export_hdf5(self, path, column_names, byteorder, shuffle, selection, progress=progress, virtual=virtual, sort=sort, ascending=ascending, compression=compression, zone_maps=zone_maps)
 
     def export_fits(self, path, column_names=None, shuffle=False, selection=False, progress=None, virtual=False, sort=None, ascending=True):
         """Exports the DataFrame to a fits file that is compatible with TOPCAT colfits format
@@ -4985,22 +5158,122 @@ class DataFrameLocal(DataFrame):
         self.signal_selection_changed.emit(self)
 
     def groupby(self, by=None):
+        """Return a :class:`GroupBy` object, grouping the rows by the values of one or more expressions.
+
+        Example:
+
+        >>> df = vaex.from_arrays(name=['a', 'b', 'a'], x=[1, 2, 3])
+        >>> df.groupby('name').agg({'x': ['sum', 'mean']})
+          #  name      x_sum    x_mean
+          0  b'a'          4         2
+          1  b'b'          2         2
+
+        :param by: expression or list of expressions to group by
+        :rtype: GroupBy
+        """
         return GroupBy(self, by=by)
 
+
 class GroupBy(object):
+    """Groups the rows of a DataFrame by the values of one or more expressions (ints, floats or strings).
+
+    The groups are found using hash tables (one per thread) in a single pass over the data, together with
+    the aggregations, so the columns do not need to be categorical, or encoded using
+    :meth:`DataFrameLocal.ordinal_encode` first.
+    """
     def __init__(self, df, by):
         self.df = df
-        self.by = by
         self._waslist, [self.by, ] = vaex.utils.listify(by)
+        self.by = _ensure_strings_from_expressions(self.by)
+
+    def _aggregations(self, what):
+        """Normalizes what into a list of (expression, aggregator name, output name)"""
+        if _is_string(what):
+            what = [what]
+        if isinstance(what, dict):
+            items = []
+            for expression, names in what.items():
+                for name in ([names] if _is_string(names) else names):
+                    items.append((expression, name))
+        else:
+            items = [(None, name) if _is_string(name) else tuple(name) for name in what]
+        aggregations = []
+        for expression, name in items:
+            expression = _ensure_string_from_expression(expression)
+            if expression in [None, '*']:
+                expression = None
+                output_name = name
+            else:
+                output_name = vaex.utils.find_valid_name('%s_%s' % (expression, name))
+            aggregations.append((expression, name, output_name))
+        return aggregations
+
+    def _calculate(self, aggregations, selection, sort, progress):
+        task = tasks.TaskGroupby(self.df, self.by, [(expression, name) for expression, name, output_name in aggregations], selection=selection, sort=sort)
+        self.df.executor.schedule(task)
+        progressbar = vaex.utils.progressbars(progress)
+        progressbar.add_task(task, "groupby by %r" % (self.by,))
+        return task
+
+    @docsubst
+    def agg(self, what, selection=None, sort=True, delay=False, progress=None):
+        """Calculate aggregations for each group, and return them as a new DataFrame.
+
+        Supported aggregations are: count, sum, mean, var, std, min, max and first (the value of the first row of
+        each group). Missing values (masked or NaN) are ignored, and missing values in the keys form their own group.
+
+        Example:
 
-    def size(self):
+        >>> df.groupby(['name', 'id']).agg({{'x': 'sum', 'y': ['mean', 'std']}})
+        >>> df.groupby('name').agg('count')  # counts the rows
+        >>> df.groupby('name').agg([('x', 'max'), 'count'])
+
+        :param what: a dict mapping expressions to aggregation names (or a list of names), a list of (expression, name)
+                tuples or names (which count the rows when the name is 'count'), or a single name
+        :param selection: {selection}
+        :param sort: sort the groups by key value
+        :param delay: {delay}
+        :param progress: {progress}
+        :return: DataFrame with the keys as first columns, followed by one column per aggregation
+        """
+        aggregations = self._aggregations(what)
+        task = self._calculate(aggregations, selection, sort, progress)
+
+        @delayed
+        def finish(result):
+            keys, values = result
+            names = [vaex.utils.find_valid_name(name) for name in self.by]
+            names += [output_name for expression, name, output_name in aggregations]
+            return vaex.from_items(*zip(names, list(keys) + list(values)))
+        return self.df._delay(delay, finish(task))
+
+    def size(self, selection=None, delay=False, progress=None):
+        """Return a pandas Series with the number of rows for each group.
+
+        For a single categorical column, all categories are included (also when they have no rows), and the labels
+        are used as index.
+        """
         import pandas as pd
-        result = self.df.count(binby=self.by, shape=[10000] * len(self.by)).astype(np.int64)
-        #values = vaex.utils.unlistify(self._waslist, result)
-        values = result
-        series = pd.Series(values, index=self.df.category_labels(self.by[0]))
-        return series
+        aggregations = [(None, 'count', 'count')]
+        task = self._calculate(aggregations, selection, True, progress)
 
+        @delayed
+        def finish(result):
+            keys, (counts, ) = result
+            if len(self.by) == 1 and self.df.is_category(self.by[0]):
+                labels = self.df.category_labels(self.by[0])
+                values = np.zeros(len(labels), dtype=np.int64)
+                codes = keys[0]
+                found = ~np.ma.getmaskarray(codes)
+                values[np.asarray(codes)[found].astype(np.int64)] = counts[found]
+                return pd.Series(values, index=labels)
+            keys = [key.tolist() if np.ma.isMaskedArray(key) else key for key in keys]
+            if len(keys) == 1:
+                index = pd.Index(keys[0], name=self.by[0])
+            else:
+                index = pd.MultiIndex.from_arrays(keys, names=self.by)
+            return pd.Series(counts, index=index)
+        return self.df._delay(delay, finish(task))
 
 
 class Column(object):
@@ -5048,10 +5321,34 @@ class ColumnIndexed(Column):
             return ar
 
 
+def _column_indexed(df, indices, name):
+    """Returns a ColumnIndexed, avoiding multiple levels of indirection when the column is already a ColumnIndexed"""
+    column = df.columns[name]
+    if isinstance(column, ColumnIndexed):
+        mask = np.ma.getmaskarray(indices)
+        direct_indices = column.indices[np.ma.getdata(indices)]
+        if mask.any() or np.ma.isMaskedArray(direct_indices):
+            direct_indices = np.ma.array(direct_indices, mask=mask | np.ma.getmaskarray(direct_indices))
+        return ColumnIndexed(column.df, direct_indices, column.name)
+    return ColumnIndexed(df, indices, name)
+
+
 class _ColumnConcatenatedLazy(Column):
+    """Column of concatenated DataFrames, which finds the DataFrames of a slice by a binary search in the (cumulative)
+    offsets of the DataFrames. Slices within one DataFrame are views (e.g. on the memory mapped file), only slices
+    spanning multiple DataFrames are copied, which the executor avoids when it splits the parts at the
+    :attr:`chunk_offsets` (see :attr:`vaex.execution.Executor.split_chunks`).
+    """
     def __init__(self, dfs, column_name):
         self.dfs = dfs
         self.column_name = column_name
+        self.offsets = np.concatenate([[0], np.cumsum([len(df) for df in dfs])]).astype(np.int64)
+        boundaries = [self.offsets]
+        for df, offset in zip(dfs, self.offsets):
+            chunk_offsets = getattr(df.columns.get(column_name), 'chunk_offsets', None)
+            if chunk_offsets is not None:  # e.g. arrow record batches, or nested concatenated DataFrames
+                boundaries.append(offset + np.clip(chunk_offsets - df._index_start, 0, len(df)))
+        self.chunk_offsets = np.unique(np.concatenate(boundaries))
         dtypes = [df.dtype(column_name) for df in dfs]
         self.is_masked = any([df.is_masked(column_name) for df in dfs])
         if self.is_masked:
@@ -5079,26 +5376,17 @@ class _ColumnConcatenatedLazy(Column):
                 raise ValueError("shape of of column %s, array index 0, is %r and is incompatible with the shape of the same column of array index %d, %r" % (self.column_name, self.shape, i, shape_i))
 
     def __len__(self):
-        return sum(len(ds) for ds in self.dfs)
+        return int(self.offsets[-1])
 
     def __getitem__(self, slice):
         start, stop, step = slice.start, slice.stop, slice.step
         start = start or 0
         stop = stop or len(self)
         assert step in [None, 1]
-        dfs = iter(self.dfs)
+        index = min(np.searchsorted(self.offsets, start, side='right') - 1, len(self.dfs) - 1)
+        dfs = iter(self.dfs[index:])
         current_df = next(dfs)
-        offset = 0
-        # print "#@!", start, stop, [len(df) for df in self.dfs]
-        while start >= offset + len(current_df):
-            # print offset
-            offset += len(current_df)
-            # try:
-            current_df = next(dfs)
-            # except StopIteration:
-            # logger.exception("requested start:stop %d:%d when max was %d, offset=%d" % (start, stop, offset+len(current_df), offset))
-            # raise
-            #   break
+        offset = int(self.offsets[index])
         # this is the fast path, no copy needed
         if stop <= offset + len(current_df):
             if current_df.filtered:  # TODO this may get slow! we're evaluating everything
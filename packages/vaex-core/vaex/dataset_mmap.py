@@ -6,6 +6,7 @@ import itertools
 import functools
 import collections
 import logging
+import weakref
 import numpy as np
 import numpy.ma
 import vaex
@@ -15,9 +16,11 @@ from vaex.utils import ensure_string
 import astropy.io.fits as fits
 import re
 import six
+import threading
+import concurrent.futures
 from vaex.dataset import DatasetLocal, DatasetArrays
+import vaex.cache
 import vaex.dataset
-import vaex.file
 from vaex.expression import Expression
 import struct
 
@@ -25,6 +28,67 @@ logger = logging.getLogger("vaex.file")
 
 dataset_type_map = {}
 
+# maps id(mapping) to (weakref(mapping), path), so a memory mapped column can be mapped again (e.g. in another process)
+_mapping_paths = {}
+
+
+def _register_mapping(mapping, path):
+    key = id(mapping)
+    _mapping_paths[key] = (weakref.ref(mapping, lambda ref: _mapping_paths.pop(key, None)), os.path.abspath(path))
+
+
+def mapping_path(mapping):
+    """Returns the path of the file that the mmap object maps, or None when unknown"""
+    ref, path = _mapping_paths.get(id(mapping), (None, None))
+    if ref is not None and ref() is mapping:
+        return path
+
+
+def mapped_array(ar, readonly=False):
+    """Returns (path, offset, dtype, shape, strides) when ar is a view on a memory mapped file, or None
+
+    :param bool readonly: if True, also return None when the array or the mapping is writable (e.g. a file opened with
+        write=True), since the file can then be modified in place without changing its modification time
+    """
+    if readonly and ar.flags.writeable:
+        return None
+    base = ar
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, 'base', None)
+    path = mapping_path(base) if base is not None else None
+    if path is None:
+        return None
+    start_array = np.frombuffer(base, dtype=np.uint8, count=1)
+    if readonly and start_array.flags.writeable:
+        return None
+    start = start_array.__array_interface__['data'][0]
+    offset = ar.__array_interface__['data'][0] - start
+    return path, offset, ar.dtype.str, ar.shape, ar.strides
+
+
+def mapped_columns(df, readonly=False):
+    """Returns a dict describing all columns of the DataFrame, or None when not all columns are memory mapped
+
+    :param bool readonly: if True, also return None when not all columns are mapped read only, see :func:`mapped_array`
+    """
+    columns = {}
+    for name, column in df.columns.items():
+        if not isinstance(column, np.ndarray):  # e.g. indexed or concatenated columns
+            return None
+        if np.ma.isMaskedArray(column):
+            data = mapped_array(column.data, readonly)
+            mask = np.ma.nomask if column.mask is np.ma.nomask else mapped_array(column.mask, readonly)
+            if data is None or mask is None:
+                return None
+            columns[name] = (data, mask)
+        else:
+            data = mapped_array(column, readonly)
+            if data is None:
+                return None
+            columns[name] = (data, None)
+    return columns
+
+
 # h5py doesn't want to build at readthedocs
 on_rtd = os.environ.get('READTHEDOCS', None) == 'True'
 try:
@@ -34,138 +98,201 @@ except:
         raise
 
 osname = vaex.utils.osname
-no_mmap = os.environ.get('VAEX_NO_MMAP', False)
-
-if no_mmap:
-    from ctypes import *
-    libc = cdll.LoadLibrary("libc.dylib")
-    import ctypes
-    import io
-
-    from cachetools import LRUCache
-    import threading
-    import fcntl
-    GB = 1024**3
-    def getsizeof(ar):
-        return ar.nbytes
-    cache = LRUCache(maxsize=10*GB, getsizeof=getsizeof)
-    cache_lock = threading.RLock()
-    F_NOCACHE = 48
-
-
-    class ColumnReader(vaex.dataset.Column):
-        def __init__(self, dataset, file, byte_offset, length, dtype):
-            self.dataset = dataset
-            self.file = file
-            fcntl.fcntl(self.file.fileno(), F_NOCACHE, 1)
-            #libc.fcntl(self.file.fileno(), fcntl.F_NOCACHE, 1)
-            #libc.fcntl(c_int(self.file.fileno()), c_int(fcntl.F_NOCACHE), c_int(1))
-            self.byte_offset = byte_offset
-            self.length = length
-            self.dtype = np.dtype(dtype)
-            self.shape = (length,)
-
-        def __len__(self):
-            return self.length# // self.dtype.itemsize
-
-        # def trim(self, i1, i2):
-        #     return ColumnIndexed(self.dataset, self.indices[i1:i2], self.name)
-
-        def trim(self, i1, i2):
-            itemsize = self.dtype.itemsize
-            byte_offset = self.byte_offset * i1 * itemsize
-            length = i2 - i1
-            return ColumnReader(self.dataset, io.FileIO(self.file.fileno(), 'rb'), byte_offset, length, self.dtype)
-
-        def __setitem__(self, slice, values):
-            start, stop, step = slice.start, slice.stop, slice.step
-            start = start or 0
-            stop = stop or len(self)
-            assert step in [None, 1]
-            itemsize = self.dtype.itemsize
-            N = stop - start
-
-            page_size = 1024*4
-            page_mask = page_size-1
-            ar_bytes = values.tobytes() #np.frombuffer(values.tobytes(), np.uint8)
-            assert len(ar_bytes) == N * itemsize
-            #print(ar_ptr, N, itemsize, start)
-            # we want to read at a page boundary
-            offset = self.byte_offset + start * itemsize
-            
-
-            #print(values[:2])
-            # make sure we write at a multiple of the page size, if the content is smaller than
-            if N * itemsize >= page_size:
-                offset_optimal = math.ceil(offset/page_size) * page_size
-                padding = offset_optimal - offset
-                #ar_ptr_pad = ar_bytes[:padding].ctypes.data_as(ctypes.POINTER(ctypes.c_byte))
-                #ar_ptr_opt = ar_bytes[padding:].ctypes.data_as(ctypes.POINTER(ctypes.c_byte))
-                ar_ptr_pad = ctypes.c_char_p(ar_bytes[:padding])
-                ar_ptr_opt = ctypes.c_char_p(ar_bytes[padding:])
-                if offset != offset_optimal:
-                    bytes_write = libc.pwrite(ctypes.c_int32(self.file.fileno()), ar_ptr_pad, ctypes.c_uint64(padding), ctypes.c_uint64(offset))
-                    if (bytes_write) != padding:
-                        raise IOError('write error: expected %d bytes, wrote %d, padding: %d' % (N * itemsize, bytes_write, padding))
-                bytes_write = libc.pwrite(ctypes.c_int32(self.file.fileno()), ar_ptr_opt, ctypes.c_uint64(N * itemsize - padding), ctypes.c_uint64(offset_optimal))
-                if (bytes_write) != N * itemsize - padding:
-                    raise IOError('write error: expected %d bytes, wrote %d, padding: %d' % (N * itemsize, bytes_write, padding))
-                #print(offset, offset_optimal, bytes_write, bytes_read+padding, padding, start, stop, N)
-            else:
-                #ar_ptr = ar_bytes.ctypes.data_as(ctypes.POINTER(ctypes.c_byte))
-                ar_ptr = ctypes.c_char_p(ar_bytes)
-                bytes_write = libc.pwrite(ctypes.c_int32(self.file.fileno()), ar_ptr, ctypes.c_uint64(N * itemsize), ctypes.c_uint64(offset))
-                if (bytes_write) != N * itemsize:
-                    raise IOError('write error: expected %d bytes, wrote %d, padding: %d' % (N * itemsize, bytes_write, padding))
-            #ar = np.frombuffer(ar_bytes[padding:padding + N*itemsize], self.dtype)
-            # ar = np.frombuffer(ar_bytes, self.dtype, offset=padding, count=N)
-
-
-        def __getitem__(self, slice):
-            start, stop, step = slice.start, slice.stop, slice.step
-            start = start or 0
-            stop = stop or len(self)
-            while start < 0:
-                start += len(self)
-            while stop < 0:
-                stop += len(self)
-            assert step in [None, 1]
-            itemsize = self.dtype.itemsize
-            #self.file.seek(self.byte_offset + start*itemsize)
-            items = stop - start
-            key = (self.dataset.path, self.byte_offset, start, stop)
-            with cache_lock:
-                ar = cache.get(key)
-            if ar is None:
-                fcntl.fcntl(self.file.fileno(), fcntl.F_NOCACHE, 1)
-                #raw_data = self.file.read(items * itemsize)
-                N = items
-                page_size = 1024*4
-                page_mask = page_size-1
-                ar_bytes = np.zeros(N*itemsize + page_size, np.uint8)
-                ar_ptr = ar_bytes.ctypes.data_as(ctypes.POINTER(ctypes.c_byte))
-                #print(ar_ptr, N, itemsize, start)
-                # we want to read at a page boundary
-                offset = self.byte_offset + start * itemsize
-                offset_optimal = offset & ~page_mask
-                padding = offset - offset_optimal
-                bytes_read = libc.pread(ctypes.c_int32(self.file.fileno()), ar_ptr, ctypes.c_uint64(N * itemsize + padding), ctypes.c_uint64(offset_optimal))
-                #libc.lseek(ctypes.c_int32(self.file.fileno()), ctypes.c_uint64(offset)
-                #bytes_read = libc.read(ctypes.c_int32(self.file.fileno()), ar_ptr, ctypes.c_uint64(N * itemsize))
-                #print((bytes_read-padding), N * itemsize, N, itemsize, start, stop)
-                if (bytes_read-padding) != N * itemsize:
-                    raise IOError('read error: expected %d bytes, read %d, padding: %d' % (N * itemsize, bytes_read, padding))
-                #ar = np.frombuffer(ar_bytes[padding:padding + N*itemsize], self.dtype)
-                ar = np.frombuffer(ar_bytes, self.dtype, offset=padding, count=N)
-                #print(bytes_read)
-                #libc.pread(ctypes.c_int32(self.file.fileno()), ar_ptr,N * itemsize, self.byte_offset + start * itemsize)
-                with cache_lock:
-                    cache[key] = ar
-            #else:
-            #    print('.', end='')
-            return ar
-else:
-    ColumnReader = False
+# when set, columns are read using pread instead of being memory mapped, 'direct' bypasses the page cache (O_DIRECT)
+no_mmap = os.environ.get('VAEX_NO_MMAP', '0')
+no_mmap = 'direct' if no_mmap == 'direct' else no_mmap not in ('', '0', 'false', 'False')
+# maximum number of bytes of the buffers (read by the ColumnReaders) that are kept around
+read_buffer_size = int(os.environ.get('VAEX_READ_BUFFER_SIZE', 1024**3))
+page_size = 4096  # O_DIRECT requires the offsets, sizes and buffers to be aligned
+F_NOCACHE = 48  # osx
+
+buffer_pool = vaex.cache.Cache(read_buffer_size, copy=False)
+_pending = {}  # maps the keys of the buffers that are being read to a Future
+_pending_lock = threading.Lock()
+_read_ahead = concurrent.futures.ThreadPoolExecutor(1)
+
+
+def _aligned_empty(nbytes, alignment=page_size):
+    """Returns an uninitialized uint8 array, which starts at a multiple of alignment in memory"""
+    raw = np.empty(nbytes + alignment, np.uint8)
+    shift = (-raw.ctypes.data) % alignment
+    return raw[shift:shift + nbytes]
+
+
+def _pread_into(fd, buffer, offset):
+    """Reads into the (uint8) buffer, starting at offset in the file, returns the number of bytes read"""
+    done = 0
+    while done < len(buffer):
+        if hasattr(os, 'preadv'):
+            count = os.preadv(fd, [buffer[done:]], offset + done)
+        else:
+            data = os.pread(fd, len(buffer) - done, offset + done)
+            count = len(data)
+            buffer[done:done + count] = np.frombuffer(data, np.uint8)
+        if count == 0:  # end of file
+            break
+        done += count
+    return done
+
+
+def open_direct(path):
+    """Opens a file for reading, bypassing the page cache (O_DIRECT on Linux, F_NOCACHE on osx), returns a file descriptor"""
+    if hasattr(os, 'O_DIRECT'):
+        return os.open(path, os.O_RDONLY | os.O_DIRECT)
+    fd = os.open(path, os.O_RDONLY)
+    if osname == "osx":
+        import fcntl
+        fcntl.fcntl(fd, F_NOCACHE, 1)
+    return fd
+
+
+class ColumnReader(vaex.dataset.Column):
+    """A column that reads the data from a file using pread, as alternative to memory mapping.
+
+    The buffers are kept in :data:`buffer_pool` (bounded by the number of bytes, see ``VAEX_READ_BUFFER_SIZE``), and
+    while a part of the column is being processed, the next part (in the direction the executor moves) is read
+    by a background thread.
+
+    :param dataset: DataFrame the column belongs to
+    :param file: file object, used for writing
+    :param int byte_offset: offset of the first row in the file
+    :param int length: number of rows
+    :param dtype: dtype of the column
+    :param int fd: file descriptor used for reading (e.g. opened using :func:`open_direct`), or None to use file
+    :param bool direct: fd was opened using O_DIRECT, so the reads have to be aligned
+    :param mask: mask of the column, an array or another column (e.g. a ColumnReader) of the same rows
+    """
+    def __init__(self, dataset, file, byte_offset, length, dtype, fd=None, direct=False, mask=None):
+        self.dataset = dataset
+        self.file = file
+        self.fd = file.fileno() if fd is None else fd
+        self.direct = direct
+        self.byte_offset = byte_offset
+        self.length = length
+        self.dtype = np.dtype(dtype)
+        self.shape = (length,)
+        self.mask = mask
+        self.is_masked = mask is not None
+        self._previous = None
+        stat = os.fstat(self.fd)  # such that buffers of a rewritten file are not used
+        self._stamp = stat.st_ino, stat.st_mtime, stat.st_size
+        if hasattr(os, 'posix_fadvise') and not direct:
+            os.posix_fadvise(self.fd, byte_offset, length * self.dtype.itemsize, os.POSIX_FADV_SEQUENTIAL)
+
+    def __len__(self):
+        return self.length
+
+    def trim(self, i1, i2):
+        byte_offset = self.byte_offset + i1 * self.dtype.itemsize
+        mask = self.mask
+        if mask is not None:
+            mask = mask[i1:i2] if isinstance(mask, np.ndarray) else mask.trim(i1, i2)
+        return ColumnReader(self.dataset, self.file, byte_offset, i2 - i1, self.dtype, self.fd, self.direct, mask)
+
+    def masked(self, mask):
+        """Returns the column with a mask (an array or another column of the same rows)"""
+        return ColumnReader(self.dataset, self.file, self.byte_offset, self.length, self.dtype, self.fd, self.direct, mask)
+
+    def __setitem__(self, slice, values):
+        start, stop, step = slice.start, slice.stop, slice.step
+        start = start or 0
+        stop = stop or len(self)
+        assert step in [None, 1]
+        data = np.ascontiguousarray(values, dtype=self.dtype).tobytes()
+        offset = self.byte_offset + start * self.dtype.itemsize
+        done = 0
+        while done < len(data):
+            count = os.pwrite(self.file.fileno(), data[done:], offset + done)
+            if count == 0:
+                raise IOError('write error: expected to write %d bytes, wrote %d' % (len(data), done))
+            done += count
+
+    def __getitem__(self, slice):
+        if isinstance(slice, (int, np.integer)):
+            index = slice + len(self) if slice < 0 else slice
+            if not 0 <= index < len(self):
+                raise IndexError('index %d is out of bounds for a column of length %d' % (slice, len(self)))
+            array = self._get(index, index + 1)
+            if self.mask is not None:
+                array = np.ma.array(array, mask=self.mask[index:index + 1])
+            return array[0]
+        start, stop, step = slice.start, slice.stop, slice.step
+        start = start or 0
+        stop = len(self) if stop is None else stop
+        while start < 0:
+            start += len(self)
+        while stop < 0:
+            stop += len(self)
+        assert step in [None, 1]
+        array = self._get(start, stop)
+        if self.mask is not None:
+            array = np.ma.array(array, mask=self.mask[start:stop], shrink=False)
+        # guess the next part, the executor moves forward or backward (zigzag)
+        backward = self._previous is not None and stop == self._previous[0]
+        self._previous = start, stop
+        length = stop - start
+        if backward and start > 0:
+            self._read_ahead(max(0, start - length), start)
+        elif not backward and stop < len(self):
+            self._read_ahead(stop, min(len(self), stop + length))
+        return array
+
+    def prefetch(self, i1, i2):
+        """Reads the rows into the buffer pool (see :class:`vaex.execution.Prefetcher`)"""
+        self._get(i1, i2)
+
+    def _key(self, start, stop):
+        return (self.dataset.path,) + self._stamp + (self.byte_offset, self.dtype.str, start, stop)
+
+    def _read_ahead(self, start, stop):
+        key = self._key(start, stop)
+        with _pending_lock:
+            if key in _pending or key in buffer_pool:
+                return
+        _read_ahead.submit(self._get, start, stop)
+
+    def _get(self, start, stop):
+        """Returns the (read only) rows from the buffer pool, or reads them, when not already being read"""
+        key = self._key(start, stop)
+        with _pending_lock:
+            array = buffer_pool.get(key)
+            if array is not None:
+                return array
+            future = _pending.get(key)
+            reader = future is None
+            if reader:
+                future = _pending[key] = concurrent.futures.Future()
+        if reader:
+            try:
+                array = self._read(start, stop)
+                buffer_pool.set(key, array)
+                future.set_result(array)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with _pending_lock:
+                    del _pending[key]
+        return future.result()
+
+    def _read(self, start, stop):
+        itemsize = self.dtype.itemsize
+        nbytes = (stop - start) * itemsize
+        offset = self.byte_offset + start * itemsize
+        if self.direct:
+            offset_aligned = offset - offset % page_size
+            padding = offset - offset_aligned
+            size = -(-(padding + nbytes) // page_size) * page_size
+            buffer = _aligned_empty(size)
+        else:
+            offset_aligned, padding = offset, 0
+            buffer = np.empty(nbytes, np.uint8)
+        bytes_read = _pread_into(self.fd, buffer, offset_aligned)
+        if bytes_read - padding < nbytes:
+            raise IOError('read error: expected %d bytes, read %d, padding: %d' % (nbytes, bytes_read, padding))
+        array = buffer[padding:padding + nbytes].view(self.dtype)
+        array.setflags(write=False)
+        return array
+
 
 class DatasetMemoryMapped(DatasetLocal):
     """Represents a dataset where the data is memory mapped for efficient reading"""
@@ -187,6 +314,7 @@ class DatasetMemoryMapped(DatasetLocal):
             else:
                 kwargs["prot"] = mmap.PROT_READ | 0 if not write else mmap.PROT_WRITE
             self.mapping = mmap.mmap(self.fileno, 0, **kwargs)
+            _register_mapping(self.mapping, self.filename)
             self.file_map = {filename: self.file}
             self.fileno_map = {filename: self.fileno}
             self.mapping_map = {filename: self.mapping}
@@ -194,6 +322,7 @@ class DatasetMemoryMapped(DatasetLocal):
             self.file_map = {}
             self.fileno_map = {}
             self.mapping_map = {}
+        self.direct_fd_map = {}
         self._length_original = None
         # self._fraction_length = None
         self.nColumns = 0
@@ -231,6 +360,8 @@ class DatasetMemoryMapped(DatasetLocal):
     def close_files(self):
         for name, file in self.file_map.items():
             file.close()
+        for name, fd in self.direct_fd_map.items():
+            os.close(fd)
         # on osx and linux this will give random bus errors (osx) or segfaults (linux)
         # on win32 however, we'll run out of file handles
         if vaex.utils.osname not in ["osx", "linux"]:
@@ -247,6 +378,7 @@ class DatasetMemoryMapped(DatasetLocal):
         self.file_map[filename] = open(filename, "rb+" if write else "rb")
         self.fileno_map[filename] = self.file_map[filename].fileno()
         self.mapping_map[filename] = mmap.mmap(self.fileno_map[filename], 0, prot=mmap.PROT_READ | 0 if not write else mmap.PROT_WRITE)
+        _register_mapping(self.mapping_map[filename], filename)
 
     def selectSerieIndex(self, serie_index):
         self.selected_serie_index = serie_index
@@ -312,10 +444,13 @@ class DatasetMemoryMapped(DatasetLocal):
 
                 #file = open(filename, 'rb') #self.file_map[filename]
                 file = self.file_map[filename]
-                if ColumnReader:
-                    import io
-                    column = ColumnReader(self, io.FileIO(file.fileno(), 'rb'), offset, length, dtype)
-                    #column = ColumnReader(self, file, offset, length, dtype)
+                if no_mmap and stride in [None, 1]:
+                    fd = None
+                    if no_mmap == 'direct':
+                        if filename not in self.direct_fd_map:
+                            self.direct_fd_map[filename] = open_direct(filename)
+                        fd = self.direct_fd_map[filename]
+                    column = ColumnReader(self, file, offset, length, dtype, fd=fd, direct=no_mmap == 'direct')
                 else:
                     column = np.frombuffer(mapping, dtype=dtype, count=length if stride is None else length * stride, offset=offset)
                     if stride and stride != 1:
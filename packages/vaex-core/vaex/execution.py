@@ -1,4 +1,10 @@
+import ast
+import copy
 import functools
+import glob
+import json
+import os
+import six
 import vaex.vaexfast
 import numpy as np
 from vaex.utils import Timer
@@ -15,12 +21,24 @@ import multiprocessing
 import sys
 import collections
 import vaex.multithreading
+import vaex.expresso
+import vaex.cache
+import vaex.zonemaps
+import concurrent.futures
+from .functions import expression_namespace
 import logging
 
 __author__ = 'breddels'
 
-buffer_size_default = 1024 * 1024  # TODO: this should not be fixed, larger means faster but also large memory usage
+buffer_size_default = 1024 * 1024  # in adaptive mode, this is the maximum chunk size
 # buffer_size_default = 1e4
+adaptive_default = bool(os.environ.get('VAEX_ADAPTIVE_CHUNKS', False))
+# split the parts at the chunk boundaries (e.g. the files of concatenated DataFrames) such that slices are views
+split_chunks_default = bool(os.environ.get('VAEX_SPLIT_CHUNKS', False))
+# number of parts (per thread) the prefetcher reads ahead, 0 disables prefetching
+prefetch_default = int(os.environ.get('VAEX_PREFETCH', 1))
+page_size = 4096
+_missing = object()  # sentinel for values not in the cache
 
 lock = threading.Lock()
 
@@ -46,6 +64,392 @@ class Column(collections.namedtuple('Column', ['df', 'expression'])):
         # and False:
 
 
+# node types that are not worth sharing (they are cheap, or do not produce a new array)
+_leaf_nodes = tuple(getattr(ast, name) for name in ['Name', 'Num', 'Str', 'Bytes', 'NameConstant', 'Constant', 'Attribute', 'Ellipsis'] if hasattr(ast, name))
+# node types that introduce new variables, we do not plan expressions that contain them
+_scope_nodes = (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _subexpressions(node):
+    """Yields the direct (non-leaf) subexpressions of node"""
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, ast.expr):
+            if not isinstance(child, _leaf_nodes):
+                yield child
+        elif not isinstance(child, (ast.expr_context, ast.operator, ast.unaryop, ast.cmpop, ast.boolop)):
+            for sub in _subexpressions(child):  # e.g. keywords
+                yield sub
+
+
+class _ExpandVirtual(ast.NodeTransformer):
+    """Replaces references to (string) virtual columns by their expression, so shared sub-trees can be found"""
+    def __init__(self, df):
+        self.df = df
+        self.expanding = set()
+
+    def visit_Call(self, node):
+        # we skip node.func, function names are not virtual columns
+        node.args = [self.visit(k) for k in node.args]
+        node.keywords = [self.visit(k) for k in node.keywords]
+        return node
+
+    def visit_Name(self, node):
+        expression = self.df.virtual_columns.get(node.id)
+        if isinstance(node.ctx, ast.Load) and isinstance(expression, six.string_types) and\
+                node.id not in self.df.columns and node.id not in self.expanding:
+            self.expanding.add(node.id)
+            try:
+                return self.visit(vaex.expresso.parse_expression(expression))
+            finally:
+                self.expanding.remove(node.id)
+        return node
+
+
+class _ReplaceShared(ast.NodeTransformer):
+    def __init__(self, names, root):
+        self.names = names
+        self.root = root
+
+    def visit(self, node):
+        key = ast.dump(node)
+        if node is not self.root and key in self.names:
+            return ast.Name(id=self.names[key], ctx=ast.Load())
+        return self.generic_visit(node)
+
+
+class ExpressionPlan(object):
+    """Evaluates a set of expressions for a chunk, computing shared subexpressions only once.
+
+    All expressions are parsed, and (string) virtual columns are expanded, to build a DAG of subexpressions.
+    Every subexpression that is used more than once (by different expressions, or within an expression) is
+    evaluated once per chunk, and stored in the block scope under a temporary name, before the expressions
+    that depend on it are evaluated. Expressions that cannot be parsed are evaluated by the block scope as before.
+
+    :param DataFrameLocal df: the DataFrame the expressions belong to
+    :param expressions: list of expressions (strings)
+    """
+    def __init__(self, df, expressions):
+        self.df = df
+        self.expressions = list(expressions)
+        self.nodes = []  # list of (name, code) in evaluation order
+        self.codes = {}  # expression -> code, or None when the block scope should evaluate it
+        dag = collections.OrderedDict()  # key -> list of child keys, ordered such that children come first
+        roots = {}
+
+        def add(node):
+            key = ast.dump(node)
+            if key not in dag:
+                children = [add(child) for child in _subexpressions(node)]
+                dag[key] = (node, children)
+            return key
+        for expression in self.expressions:
+            try:
+                tree = vaex.expresso.parse_expression(expression)
+                tree = _ExpandVirtual(df).visit(tree)
+            except Exception:
+                logger.debug("cannot plan expression: %r", expression)
+                tree = None
+            if tree is None or isinstance(tree, _leaf_nodes) or any(isinstance(node, _scope_nodes) for node in ast.walk(tree)):
+                self.codes[expression] = None
+            else:
+                roots[expression] = add(tree)
+        uses = collections.Counter(roots.values())
+        for node, children in dag.values():
+            uses.update(children)
+        names = collections.OrderedDict()
+        for key in dag:
+            if uses[key] > 1:
+                names[key] = '__shared_%d' % len(names)
+        for key, name in names.items():
+            node = dag[key][0]
+            self.nodes.append((name, self._compile(node, names)))
+        for expression, key in roots.items():
+            if key in names:
+                self.codes[expression] = compile(names[key], '<plan>', 'eval')
+            else:
+                self.codes[expression] = self._compile(dag[key][0], names)
+        logger.debug("planned %d expressions, with %d shared subexpressions", len(self.expressions), len(self.nodes))
+
+    def _compile(self, node, names):
+        node = copy.deepcopy(node)
+        node = _ReplaceShared(names, node).visit(node)
+        tree = ast.fix_missing_locations(ast.Expression(body=node))
+        return compile(tree, '<plan>', 'eval')
+
+    def evaluate(self, block_scope):
+        """Returns a dict mapping each expression to its values for the chunk the block scope points to"""
+        for name, code in self.nodes:
+            block_scope.values[name] = eval(code, expression_namespace, block_scope)
+        values = {}
+        for expression in self.expressions:
+            code = self.codes[expression]
+            if code is None:
+                values[expression] = block_scope.evaluate(expression)
+            else:
+                values[expression] = block_scope.values[expression] = eval(code, expression_namespace, block_scope)
+        return values
+
+
+class SharedChunk(object):
+    """Values derived from a single chunk of data (e.g. selection masks, casted arrays), that are shared
+    by all tasks in a pass over the data, so they are computed only once per chunk.
+
+    A chunk is processed by a single thread, so no locking is needed.
+    """
+    def __init__(self, df, i1, i2):
+        self.df = df
+        self.i1 = i1
+        self.i2 = i2
+        self.values = {}
+
+    def get(self, key, f, *args):
+        """Returns the value for key, calling f(*args) to compute it when it is not present yet"""
+        if key not in self.values:
+            self.values[key] = f(*args)
+        return self.values[key]
+
+    def selection_mask(self, selection):
+        """Returns the selection mask (combined with the filter), see :meth:`DataFrame.evaluate_selection_mask`"""
+        return self.get(('selection', type(selection), str(selection)), self.df.evaluate_selection_mask,
+                        selection, self.i1, self.i2, None, True)
+
+    def zone_state(self, selection):
+        """Returns whether no rows, all rows or some rows match the selection (combined with the filter) according to the
+        zone maps, see :func:`vaex.zonemaps.selection_state`"""
+        return self.get(('zone state', type(selection), str(selection)), vaex.zonemaps.selection_state,
+                        self.df, selection, self.i1, self.i2)
+
+
+def _cache_size():
+    """Returns the size in bytes of the largest cpu cache (only supported on Linux), or None"""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    sizes = []
+    for path in glob.glob('/sys/devices/system/cpu/cpu0/cache/index*/size'):
+        try:
+            with open(path) as f:
+                text = f.read().strip()
+            sizes.append(int(text[:-1]) * units[text[-1]] if text[-1] in units else int(text))
+        except (IOError, ValueError):
+            pass
+    return max(sizes) if sizes else None
+
+
+def _align_parts(parts, boundaries, split=False):
+    """Moves the edges between the parts (list of consecutive (i1, i2) tuples) back to the last boundary inside the
+    part (if any), such that a part only spans a boundary when it covers more than one chunk, and each chunk is read
+    (e.g. decompressed) by a single part.
+
+    Parts are not split by default, so small chunks (e.g. of a compressed hdf5 file) do not lead to many small parts.
+    When split is True, parts are also split at the boundaries, such that no part spans a boundary, and slices of
+    chunked columns (e.g. concatenated DataFrames) are always views.
+    """
+    parts = list(parts)
+    if boundaries is None or len(boundaries) == 0 or not parts:
+        return parts
+    reverse = parts[0][0] > parts[-1][0]  # zigzag
+    ordered = sorted(parts)
+    if split:
+        inside = boundaries[(boundaries > ordered[0][0]) & (boundaries < ordered[-1][1])]
+        edges = sorted(set(inside.tolist()) | set(i for part in ordered for i in part))
+    else:
+        edges = [ordered[0][0]]
+        for i1, i2 in ordered[:-1]:
+            index = np.searchsorted(boundaries, i2, side='right') - 1
+            if index >= 0 and boundaries[index] > edges[-1]:
+                edges.append(int(boundaries[index]))
+            else:
+                edges.append(i2)
+        edges.append(ordered[-1][1])
+    aligned = list(zip(edges[:-1], edges[1:]))
+    return aligned[::-1] if reverse else aligned
+
+
+def _needed_columns(df, task_queue, expressions, strict=False):
+    """Returns the names of the (real) columns that are read for the expressions, selections and filter
+
+    :param bool strict: if True, raise when the columns of an expression cannot be found, instead of leaving them out
+    """
+    names = set()
+    for expression in expressions:
+        try:
+            names |= df._expr(expression).variables()
+        except Exception:
+            if strict:
+                raise
+            logger.debug("cannot find the columns of expression: %r", expression)
+    selections = set(['__filter__'] if df.filtered else [])
+    for task in task_queue:
+        for selection in [getattr(task, 'selection', None)] + list(getattr(task, 'selections', None) or []):
+            if selection not in [None, False] and isinstance(selection, (six.string_types, bool)):
+                selections.add(selection)
+    for name in selections:
+        selection = df.get_selection(name)
+        if selection is not None:
+            names |= selection._depending_columns(df)
+    return [name for name in names if name in df.columns]
+
+
+def _pass_key(df, row_start):
+    """DataFrames that have the same columns and active range (e.g. the copies of a DataFrame that the server makes
+    for each request) can share a single pass over the data, the tasks of DataFrames with an equal key do"""
+    return (row_start, df._index_start, df._index_end, df.length_unfiltered(), frozenset(id(column) for column in df.columns.values()))
+
+
+def _touch(array):
+    """Reads a byte of every page of the array, such that the pages are in memory"""
+    if array.flags.c_contiguous and array.size:
+        np.add.reduce(array.reshape(-1).view(np.uint8)[::page_size], dtype=np.uint64)
+
+
+class Prefetcher(object):
+    """Reads the data of the columns for the parts ahead of the parts that are being processed, in a separate (I/O)
+    thread, such that disk reads overlap computation.
+
+    For memory mapped columns, the kernel is asked to read the pages (posix_fadvise with POSIX_FADV_WILLNEED), which
+    are then touched, other columns can implement a prefetch(i1, i2) method (e.g. pread or compressed hdf5 columns).
+    A part that the I/O thread did not start on yet is read by the thread that processes it, so prefetching never
+    makes a thread wait for more than the part it needs.
+
+    :param int depth: number of parts to read ahead
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self.thread = concurrent.futures.ThreadPoolExecutor(1)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def can_prefetch(column):
+        if hasattr(column, 'prefetch'):
+            return True
+        import vaex.dataset_mmap
+        data = column.data if np.ma.isMaskedArray(column) else column
+        return isinstance(data, np.ndarray) and vaex.dataset_mmap.mapped_array(data) is not None
+
+    def start(self, df, columns, parts):
+        self.offset = df._index_start
+        self.columns = columns
+        self.parts = list(parts)
+        self.index = {part: k for k, part in enumerate(self.parts)}
+        self.futures = {}
+        self.fds = {}
+        self._schedule(0)
+
+    def wait(self, i1, i2):
+        """Called before a part is processed, schedules the parts ahead of it, and waits when the part is being
+        read, returns the number of seconds waited"""
+        k = self.index.get((i1, i2))
+        if k is None:
+            return 0
+        self._schedule(k + 1)
+        future = self.futures.get(k)
+        if future is None or future.cancel():
+            return 0
+        t0 = time.time()
+        future.result()
+        return time.time() - t0
+
+    def stop(self):
+        for future in self.futures.values():
+            future.cancel()
+        for future in self.futures.values():
+            if not future.cancelled():
+                future.exception()  # wait for it, since it uses the file descriptors
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+    def _schedule(self, k):
+        with self.lock:
+            for index in range(k, min(k + self.depth, len(self.parts))):
+                if index not in self.futures:
+                    self.futures[index] = self.thread.submit(self._read, *self.parts[index])
+
+    def _read(self, i1, i2):
+        i1, i2 = i1 + self.offset, i2 + self.offset
+        try:
+            for column in self.columns:
+                if hasattr(column, 'prefetch'):
+                    column.prefetch(i1, i2)
+                elif np.ma.isMaskedArray(column):
+                    self._read_mapped(column.data, i1, i2)
+                    if column.mask is not np.ma.nomask:
+                        self._read_mapped(column.mask, i1, i2)
+                else:
+                    self._read_mapped(column, i1, i2)
+        except Exception:
+            logger.exception("error prefetching rows %d-%d", i1, i2)
+
+    def _read_mapped(self, array, i1, i2):
+        import vaex.dataset_mmap
+        mapped = vaex.dataset_mmap.mapped_array(array)
+        if mapped is None:
+            return
+        path, offset = mapped[:2]
+        stride = array.strides[0]
+        if hasattr(os, 'posix_fadvise') and stride > 0:
+            if path not in self.fds:
+                self.fds[path] = os.open(path, os.O_RDONLY)
+            os.posix_fadvise(self.fds[path], offset + i1 * stride, (i2 - i1) * stride, os.POSIX_FADV_WILLNEED)
+        _touch(array[i1:i2])
+
+
+class ChunkPlanner(object):
+    """Decides how a pass over the data is split into chunks, used by the :class:`Executor` in adaptive mode.
+
+    The chunk size is chosen such that the data of the chunks that are processed at the same time fits into the
+    cpu cache, and such that a chunk takes about target_time seconds, based on the throughput measured in previous
+    passes with the same expressions. Towards the end of a pass the chunks become smaller (guided scheduling). Since
+    idle threads take the next chunk, this rebalances the work when some chunks are more expensive than others (e.g.
+    due to selections or string columns), instead of leaving threads idle while others finish a large chunk.
+
+    :param int nthreads: number of threads that process the chunks
+    :param int min_size: minimum number of rows per chunk (unless the maximum is smaller)
+    :param float target_time: desired time in seconds to process a chunk
+    :param int cache_size: cache size in bytes, when None it is detected, or 8MB is assumed
+    """
+    max_history = 1000
+
+    def __init__(self, nthreads, min_size=1024 * 64, target_time=0.1, cache_size=None):
+        self.nthreads = nthreads
+        self.min_size = min_size
+        self.target_time = target_time
+        self.cache_size = cache_size or _cache_size() or 8 * 1024**2
+        self.throughput = collections.OrderedDict()  # key -> rows per second for a single thread
+
+    def chunk_size(self, key, bytes_per_row, max_size):
+        """Returns the chunk size for a pass, identified by key, that uses bytes_per_row bytes per row"""
+        size = self.cache_size // max(1, bytes_per_row * self.nthreads)
+        if key in self.throughput:
+            size = min(size, int(self.throughput[key] * self.target_time))
+        return int(min(max_size, max(self.min_size, size)))
+
+    def parts(self, length, size, reverse=False):
+        """Returns a list of (i1, i2) tuples, with at most size rows, becoming smaller towards the end of the pass"""
+        parts = []
+        i1 = 0
+        while i1 < length:
+            chunk = size
+            if self.nthreads > 1:
+                chunk = min(size, max(min(self.min_size, size), (length - i1) // (2 * self.nthreads)))
+            i2 = min(length, i1 + chunk)
+            parts.append((i1, i2))
+            i1 = i2
+        if reverse:  # go over the data from the end to the start, but still with decreasing chunk sizes
+            parts = [(length - i2, length - i1) for i1, i2 in parts]
+        return parts
+
+    def record(self, key, rows, seconds):
+        """Updates the throughput estimate for key, when a thread processed rows in the given number of seconds"""
+        if rows == 0 or seconds <= 0:
+            return
+        throughput = rows / seconds
+        if key in self.throughput:
+            throughput = (self.throughput.pop(key) + throughput) / 2
+        self.throughput[key] = throughput
+        while len(self.throughput) > self.max_history:
+            self.throughput.popitem(last=False)
+
+
 class Job(object):
     def __init__(self, task, order):
         self.task = task
@@ -57,10 +461,17 @@ ne_lock = threading.Lock()
 
 
 class Executor(object):
-    def __init__(self, thread_pool=None, buffer_size=None, thread_mover=None, zigzag=True):
+    def __init__(self, thread_pool=None, buffer_size=None, thread_mover=None, zigzag=True, adaptive=None, cache=None, resume=None):
         self.thread_pool = thread_pool or vaex.multithreading.ThreadPoolIndex()
+        # results of tasks are cached (see vaex.cache), pass False to disable
+        self.cache = vaex.cache.get_default() if cache is None else (None if cache is False else cache)
+        # statistics over files that grow by appending rows resume from the cached state of an earlier pass
+        self.resume = vaex.cache.resume_default if resume is None else resume
         self.task_queue = []
         self.buffer_size = buffer_size or buffer_size_default
+        # in adaptive mode, the chunk size (at most buffer_size) is decided by the chunk planner
+        self.adaptive = adaptive_default if adaptive is None else adaptive
+        self.chunk_planner = ChunkPlanner(self.thread_pool.nthreads)
         self.signal_begin = vaex.events.Signal("begin")
         self.signal_progress = vaex.events.Signal("progress")
         self.signal_end = vaex.events.Signal("end")
@@ -70,8 +481,85 @@ class Executor(object):
         self.lock = threading.Lock()
         self.thread = None
         self.passes = 0  # how many times we passed over the data
+        self._digests = {}  # digests of the rows of earlier passes, shared by the tasks of an execute, see _rows_digests
         self.zig = True # zig or zag
         self.zigzag = zigzag
+        # parts (per thread) to read ahead (see Prefetcher), and the I/O wait and compute time of the last pass
+        self.prefetch = prefetch_default
+        # split the parts at the chunk boundaries, instead of moving the edges between parts (see _align_parts)
+        self.split_chunks = split_chunks_default
+        self._prefetcher = None
+        self.pass_stats = None
+
+    def _bytes_per_row(self, df, expressions):
+        """Estimates the number of bytes per row needed to evaluate the expressions (without evaluating them,
+        since that may require a pass over the data)"""
+        names = set()
+        total = 0
+        for expression in expressions:
+            if expression not in df.columns:
+                total += 8  # for the result
+                try:
+                    tree = vaex.expresso.parse_expression(expression)
+                    names.update(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+                except Exception:
+                    pass
+            names.add(expression)
+        for name in names:
+            dtype = getattr(df.columns.get(name), 'dtype', None)
+            if dtype is not None:
+                total += 64 if dtype.kind == 'O' else dtype.itemsize
+        return max(total, 1)
+
+    def _fulfill_cached(self, tasks):
+        """Fulfills the tasks of which the result is in the cache, resumes the tasks of which the state of a pass
+        over fewer rows is in the cache, and returns the tasks that need a pass over the data"""
+        remaining = []
+        for task in tasks:
+            task._cache_key = task._resume_key = None
+            task._resume_digests = ()
+            if self.cache is not None:
+                task._cache_key = vaex.cache.key(task)
+                if self.resume:
+                    task._resume_key = vaex.cache.key(task, prefix=True)
+            value = self.cache.get(task._cache_key, _missing) if task._cache_key is not None else _missing
+            if value is _missing:
+                state = self.cache.get(task._resume_key) if task._resume_key is not None else None
+                # only resume when none of the rows of the earlier pass were modified
+                if state is not None and state['rows'] <= task.df.active_length() and \
+                        state['digests'] == self._rows_digests(task, state['rows']):
+                    logger.debug("resume task from row %d: %r", state['rows'], task)
+                    task.resume(state['state'], state['rows'])
+                    task._resume_digests = state['digests']
+                remaining.append(task)
+            else:
+                logger.debug("fulfill task from cache: %r", task)
+                task.signal_progress.emit(1.)
+                task.fulfill(value)
+        return remaining
+
+    def _cache_result(self, task, result):
+        if getattr(task, '_cache_key', None) is not None:
+            self.cache.set(task._cache_key, result)
+        if getattr(task, '_resume_key', None) is not None:
+            rows = task.df.active_length()
+            digests = self._rows_digests(task, rows, task._resume_digests, task.row_start)
+            self.cache.set(task._resume_key, dict(rows=rows, state=task.merged_state(), digests=digests))
+
+    def _rows_digests(self, task, rows, digests=(), digests_rows=0):
+        """Returns the digests (see :func:`vaex.cache.rows_digests`) of the first rows of the columns the task depends
+        on, which are computed once per execute for all tasks that depend on the same columns, using the thread pool"""
+        df = task.df
+        try:
+            names = sorted(_needed_columns(df, [task], task.expressions_all, strict=True))
+        except Exception:
+            names = sorted(df.columns)
+        key = (tuple(id(df.columns[name]) for name in names), rows)
+        if key not in self._digests:
+            def map(f, values):
+                return concurrent.futures.ThreadPoolExecutor.map(self.thread_pool, f, values)
+            self._digests[key] = vaex.cache.rows_digests(df, rows, digests, digests_rows, columns=names, map=map)
+        return self._digests[key]
 
     def schedule(self, task):
         self.task_queue.append(task)
@@ -138,11 +626,17 @@ class Executor(object):
                 self.task_queue.remove(task)
             logger.info("left in queue: %r", self.task_queue)
             task_queue_all = [task for task in task_queue_all if not task.cancelled]
+            task_queue_all = self._fulfill_cached(task_queue_all)
             # logger.debug("executing queue: %r" % (task_queue_all))
 
             # for task in self.task_queue:
             # print task, task.expressions_all
-            dfs = set(task.df for task in task_queue_all)
+            # tasks resumed from an earlier pass (see vaex.cache) only need to process the rows from row_start on,
+            # and tasks of DataFrames with the same rows share a pass (see _pass_key)
+            passes = collections.OrderedDict()
+            for task in task_queue_all:
+                dfs = passes.setdefault(_pass_key(task.df, task.row_start), collections.OrderedDict())
+                dfs.setdefault(task.df, []).append(task)
             cancelled = [False]
 
             def cancel():
@@ -150,43 +644,107 @@ class Executor(object):
                 self.signal_cancel.emit()
                 cancelled[0] = True
             try:
-                # process tasks per df
+                # process tasks per pass
                 self.signal_begin.emit()
-                for df in dfs:
+                for dfs in passes.values():
                     self.passes += 1
-                    task_queue = [task for task in task_queue_all if task.df == df]
+                    scans = []  # (df, tasks, plan, block_scopes) for each DataFrame in this pass
+                    for df, task_queue in dfs.items():
+                        plan = ExpressionPlan(df, list(set(expression for task in task_queue for expression in task.expressions_all)))
+                        block_scopes = [df._block_scope(0, self.buffer_size) for i in range(self.thread_pool.nthreads)]
+                        scans.append((df, task_queue, plan, block_scopes))
+                    df = scans[0][0]  # the DataFrames share the rows, so the parts are the same for all
+                    task_queue = [task for scan in scans for task in scan[1]]
+                    row_start = task_queue[0].row_start
                     expressions = list(set(expression for task in task_queue for expression in task.expressions_all))
 
                     for task in task_queue:
                         task._results = []
                         task.signal_progress.emit(0)
-                    block_scopes = [df._block_scope(0, self.buffer_size) for i in range(self.thread_pool.nthreads)]
 
                     def process(thread_index, i1, i2):
                         if not cancelled[0]:
-                            block_scope = block_scopes[thread_index]
-                            block_scope.move(i1, i2)
-                            # with ne_lock:
-                            block_dict = {expression: block_scope.evaluate(expression) for expression in expressions}
-                            for task in task_queue:
-                                blocks = [block_dict[expression] for expression in task.expressions_all]
-                                if not cancelled[0]:
-                                    task._results.append(task.map(thread_index, i1, i2, *blocks))
+                            if prefetcher:
+                                io_waits.append(prefetcher.wait(i1, i2))
+                            t0 = time.time()
+                            read = False
+                            for df, task_queue, plan, block_scopes in scans:
+                                shared = SharedChunk(df, i1, i2)
+                                # tasks that can use metadata only (e.g. zone maps) do not need the data
+                                tasks_data = []
+                                for task in task_queue:
+                                    result = task.map_metadata(shared, thread_index, i1, i2)
+                                    if result is None:
+                                        tasks_data.append(task)
+                                    else:
+                                        task._results.append(result)
+                                if tasks_data:
+                                    read = True
+                                    block_scope = block_scopes[thread_index]
+                                    block_scope.move(i1, i2)
+                                    # with ne_lock:
+                                    block_dict = plan.evaluate(block_scope)
+                                    for task in tasks_data:
+                                        blocks = [block_dict[expression] for expression in task.expressions_all]
+                                        if not cancelled[0]:
+                                            task._results.append(task.map_shared(shared, thread_index, i1, i2, *blocks))
+                            if not read:
+                                skipped.append(i2 - i1)
+                            timings.append((i2 - i1, time.time() - t0))
                                 # don't call directly, since ui's don't like being updated from a different thread
                                 # self.thread_mover(task.signal_progress, float(i2)/length)
 # time.sleep(0.1)
 
-                    length = df.active_length()
-                    parts = vaex.utils.subdivide(length, max_length=self.buffer_size)
-                    if not self.zig:
-                        parts = list(parts)[::-1]
+                    length = df.active_length() - row_start
+                    timings = []
+                    if length <= 0:
+                        parts = []
+                    elif self.adaptive:
+                        key = (tuple(sorted(expressions)), len(task_queue))
+                        chunk_size = self.chunk_planner.chunk_size(key, self._bytes_per_row(df, expressions), self.buffer_size)
+                        parts = self.chunk_planner.parts(length, chunk_size, reverse=not self.zig)
+                        logger.debug("adaptive chunk size: %d rows, %d parts", chunk_size, len(parts))
+                    else:
+                        parts = vaex.utils.subdivide(length, max_length=self.buffer_size)
+                        if not self.zig:
+                            parts = list(parts)[::-1]
+                    if row_start:
+                        parts = [(row_start + i1, row_start + i2) for i1, i2 in parts]
+                    # such that chunked columns (e.g. arrow record batches) can give views instead of copies
+                    parts = _align_parts(parts, df._chunk_boundaries(), split=self.split_chunks)
+                    io_waits = []
+                    skipped = []
+                    prefetcher = None
+                    if self.prefetch and len(parts) > 1:
+                        columns = [scan_df.columns[name] for scan_df, scan_tasks, _, _ in scans
+                                   for name in _needed_columns(scan_df, scan_tasks, expressions)]
+                        columns = list({id(column): column for column in columns}.values())
+                        columns = [column for column in columns if Prefetcher.can_prefetch(column)]
+                        if columns:
+                            if self._prefetcher is None:
+                                self._prefetcher = Prefetcher(self.prefetch * self.thread_pool.nthreads)
+                            prefetcher = self._prefetcher
+                            prefetcher.start(df, columns, parts)
+                    t_pass = time.time()
                     if self.zigzag:
                         self.zig = not self.zig
-                    for element in self.thread_pool.map(process, parts,
-                                                        progress=lambda p: all(self.signal_progress.emit(p)) and
-                                                        all([all(task.signal_progress.emit(p)) for task in task_queue]),
-                                                        cancel=cancel, unpack=True):
-                        pass  # just eat all element
+                    try:
+                        for element in self.thread_pool.map(process, parts,
+                                                            progress=lambda p: all(self.signal_progress.emit(p)) and
+                                                            all([all(task.signal_progress.emit(p)) for task in task_queue]),
+                                                            cancel=cancel, unpack=True):
+                            pass  # just eat all element
+                    finally:
+                        if prefetcher:
+                            prefetcher.stop()
+                    self.pass_stats = dict(rows=sum(rows for rows, seconds in timings), parts=len(timings),
+                                           seconds=time.time() - t_pass, prefetch=prefetcher is not None, skipped=sum(skipped),
+                                           io_wait=sum(io_waits), compute=sum(seconds for rows, seconds in timings))
+                    logger.debug("pass over %(rows)d rows in %(parts)d parts took %(seconds)f seconds, threads waited "
+                                 "%(io_wait)f seconds for I/O, and computed for %(compute)f seconds, %(skipped)d rows "
+                                 "were not read due to zone maps", self.pass_stats)
+                    if self.adaptive and not cancelled[0]:
+                        self.chunk_planner.record(key, sum(rows for rows, seconds in timings), sum(seconds for rows, seconds in timings))
                     self._is_executing = False
             except:
                 # on any error we flush the task queue
@@ -211,6 +769,7 @@ class Executor(object):
                     logger.debug("fulfill task: %r", task)
                     if not task.cancelled:
                         task._result = task.reduce(task._results)
+                        self._cache_result(task, task._result)
                         task.fulfill(task._result)
                         # remove references
                     task._result = None
@@ -224,5 +783,63 @@ class Executor(object):
                     self.execute()
         finally:
             self._is_executing = False
+            self._digests = {}
+
+
+def _task_key(task):
+    fingerprint = task.fingerprint()
+    if fingerprint is not None:
+        return json.dumps(fingerprint, sort_keys=True, default=vaex.cache._json_default)
+
+
+class PartialExecutor(object):
+    """Executor that does not execute tasks, but fulfills them with the partial result (see :meth:`Task.partial`) of an
+    equal task (with the same fingerprint) that is being executed, see :func:`partial_result`"""
+    def __init__(self, tasks):
+        self.tasks = {_task_key(task): task for task in tasks}
+        self.tasks.pop(None, None)
+        # a single thread, such that the tasks only allocate a single grid, which is never used
+        self.thread_pool = vaex.multithreading.ThreadPoolIndex(max_workers=1)
+        self.task_queue = []
+        self.complete = True  # False when a task has no partial result
+
+    def schedule(self, task):
+        original = self.tasks.get(_task_key(task))
+        result = original.partial() if original is not None else None
+        if result is None:
+            self.complete = False
+        else:
+            task.fulfill(result)
+        return task
+
+    def execute(self):
+        pass
+
+
+def partial_result(df, tasks, call):
+    """Returns the partial result of a calculation while its tasks are executed, or None when (some of) the tasks do not
+    have a partial result (yet).
+
+    The calculation is done again on a copy of the DataFrame, where each task is fulfilled with the partial result of
+    the equal task in tasks, such that the results are post processed the same way (e.g. the mean is computed from
+    the partial sums and counts).
+
+    :param df: DataFrame that the tasks were created for
+    :param tasks: the tasks that are being executed
+    :param call: function that is called with the copy of df, and returns a promise for the result (using delay=True)
+    """
+    executor = PartialExecutor(tasks)
+    if not executor.tasks:
+        return None
+    copy = df.copy()
+    copy.variables.update(df.variables)  # not copied by copy
+    copy.executor = executor
+    try:
+        promise = call(copy)
+    except Exception:
+        logger.exception("could not compute partial result")
+        return None
+    if executor.complete and promise.isFulfilled:
+        return promise.get()
 
 # default_executor = None
@@ -77,19 +77,16 @@ def _export(dataset_input, dataset_output, random_index_column, path, column_nam
         order_array = shuffle_array
 
     if sort:
-        if selection:
-            raise ValueError("sorting selections not yet supported")
-        # these indices sort the input array, but we evaluate the input in sequential order and write it out in sorted order
-        # e.g., not b[:] = a[indices]
-        # but b[indices_r] = a
+        # the sorted DataFrame gathers the rows in sorted order, so we can write the output sequentially,
+        # without keeping a copy of each column in memory, we only sort the N rows that we export
         logger.info("sorting...")
-        indices = np.argsort(dataset_input.evaluate(sort))
-        indices_r = np.zeros_like(indices)
-        indices_r[indices] = np.arange(len(indices))
-        del indices
-        order_array = indices_r if ascending else indices_r[::-1]
+        # the selected rows (that pass the filter) are sorted by the external sort, chunk by chunk
+        dataset_input = dataset_input.trim()
+        indices = dataset_input._sort(sort, ascending, selection=selection or None, filtered=True)
+        dataset_input = dataset_input.take(indices)
+        selection = False
+        sort = None
         logger.info("sorting done")
-        # indices_target
 
     # i1, i2 = 0, N #len(dataset)
     # print "creating shuffled array"
@@ -294,7 +291,7 @@ def export_hdf5_v1(dataset, path, column_names=None, byteorder="=", shuffle=Fals
     vaex.hdf5.export.export_hdf5_v1(**kwargs)
 
 
-def export_hdf5(dataset, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=True, sort=None, ascending=True):
+def export_hdf5(dataset, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=True, sort=None, ascending=True, compression=None, zone_maps=False):
     kwargs = locals()
     import vaex.hdf5.export
     vaex.hdf5.export.export_hdf5(**kwargs)
@@ -133,8 +133,75 @@ def _try_unit(unit):
 	else:
 		return unit
 
+class ColumnFits(vaex.dataset.Column):
+	"""A column of a (row oriented) FITS binary table, which is a strided view on the memory mapped file.
+
+	Slices are converted to native byte order (and scaled, and masked) when requested, instead of converting the
+	whole column when the file is opened.
+
+	:param array: big endian, strided view on the memory mapped rows
+	:param bzero: offset (TZEROn), unsigned integers are stored as signed integers with an offset
+	:param bscale: scale factor (TSCALn)
+	:param null: value that indicates a missing value (TNULLn), or None
+	"""
+	def __init__(self, array, bzero=None, bscale=None, null=None):
+		self.array = array
+		self.bzero = bzero
+		self.bscale = bscale
+		self.null = null
+		stored = array.dtype.newbyteorder("=")
+		bits = stored.itemsize * 8
+		self.unsigned = stored.kind == "i" and bscale in [None, 1] and bzero == 2**(bits - 1)
+		self.scaled = not self.unsigned and (bzero not in [None, 0] or bscale not in [None, 1])
+		if self.unsigned:
+			self.dtype = np.dtype("u%d" % stored.itemsize)
+		elif self.scaled:
+			self.dtype = np.dtype(np.float64)
+		else:
+			self.dtype = stored
+		self.shape = array.shape
+		self.is_masked = null is not None
+
+	def __len__(self):
+		return len(self.array)
+
+	def trim(self, i1, i2):
+		return ColumnFits(self.array[i1:i2], self.bzero, self.bscale, self.null)
+
+	def __getitem__(self, slice):
+		assert slice.step in [None, 1]
+		stored = self.array[slice]
+		values = stored.astype(stored.dtype.newbyteorder("="))  # a contiguous copy in native byte order
+		if self.null is not None:
+			mask = values == self.null
+		values = self._convert(values)
+		if self.null is not None:
+			values = np.ma.array(values, mask=mask)
+		return values
+
+	@property
+	def fill_value(self):
+		"""The value of the missing values (TNULLn) after conversion, like the fill_value of a masked array"""
+		return self._convert(np.array([self.null], self.array.dtype.newbyteorder("=")))[0]
+
+	def _convert(self, values):
+		"""Converts the stored values (in native byte order) to the dtype of the column"""
+		if self.unsigned:
+			values = values.view(self.dtype) ^ self.dtype.type(2**(self.dtype.itemsize * 8 - 1))
+		elif self.scaled:
+			values = values * (1. if self.bscale is None else self.bscale) + (0. if self.bzero is None else self.bzero)
+		return values
+
+
 class FitsBinTable(DatasetMemoryMapped):
-	def __init__(self, filename, write=False):
+	"""Implements reading FITS binary tables.
+
+	Columns of row oriented tables are mapped lazily (see :class:`ColumnFits`), so opening a wide table is fast, and
+	only the used columns are read.
+
+	:param list column_names: only open these columns (all columns by default)
+	"""
+	def __init__(self, filename, write=False, column_names=None):
 		super(FitsBinTable, self).__init__(filename, write=write)
 		with fits.open(filename) as fitsfile:
 			for table in fitsfile:
@@ -192,10 +259,15 @@ class FitsBinTable(DatasetMemoryMapped):
 					else:
 						logger.debug("adding table: %r" % table)
 						for i, column in enumerate(table.columns):
+							if column_names is not None and column.name not in column_names and\
+									_python_save_name(column.name) not in column_names:
+								continue
+							if self._map_fits_column(table, column, i):
+								continue
+							# column.array is only valid once the rows are loaded, which the mapped columns do not need
+							table.data
 							array = column.array[:]
 							array = column.array[:] # 2nd time it will be a real np array
-							#import pdb
-							#pdb.set_trace()
 							if array.dtype.kind in "fiubSU":
 								column_name = _python_save_name(column.name, used=self.columns.keys())
 								self.addColumn(column_name, array=array)
@@ -207,6 +279,21 @@ class FitsBinTable(DatasetMemoryMapped):
 		self.update_virtual_meta()
 		self.selections_favorite_load()
 
+	def _map_fits_column(self, table, column, i):
+		"""Adds a lazily mapped column (see :class:`ColumnFits`) for scalar numerical columns, returns False for other
+		columns (e.g. strings, logicals, arrays), which are read by astropy"""
+		if column.format[-1] not in "BIJKED" or column.format.repeat != 1 or column.dim is not None:
+			return False
+		dtype, offset = table.columns.dtype.fields[column.name][:2]
+		dtype = dtype.newbyteorder(">")
+		length = table.header["NAXIS2"]
+		array = np.ndarray(shape=(length,), dtype=dtype, buffer=self.mapping, offset=table._data_offset + offset,
+						   strides=(table.header["NAXIS1"],))
+		column_name = _python_save_name(column.name, used=self.columns.keys())
+		self.addColumn(column_name, array=ColumnFits(array, column.bzero, column.bscale, column.null))
+		self._get_column_meta_data(table, column_name, column, i)
+		return True
+
 	def _check_null(self, table, column_name, column, i):
 		null_name = "TNULL%d" % (i+1)
 		if null_name in table.header:
@@ -472,11 +559,173 @@ class DatasetAstropyTable(DatasetArrays):
 
 import astropy.io.votable
 import string
+class _VOTableNotTabledata(Exception):
+	pass
+
+
+def _votable_dtype(field):
+	"""Returns (dtype, shape) for a VOTable FIELD, where shape is the shape of the values (for arrays), or None when
+	not supported (e.g. variable length arrays), the same as astropy (char as bytes, unicodeChar as str)"""
+	datatype, arraysize = field["datatype"], field["arraysize"]
+	if datatype in ["char", "unicodeChar"]:
+		kind = "S" if datatype == "char" else "U"
+		if arraysize is None:
+			return np.dtype(kind + "1"), ()
+		if arraysize.isdigit():
+			return np.dtype(kind + arraysize), ()
+		if "x" not in arraysize:  # variable length, e.g. * or 10*
+			return np.dtype(kind), ()
+		return None
+	dtype = {"boolean": "?", "unsignedByte": "u1", "short": "i2", "int": "i4", "long": "i8", "float": "f4", "double": "f8"}.get(datatype)
+	if dtype is None:
+		return None
+	if arraysize in [None, "1"]:
+		return np.dtype(dtype), ()
+	dims = arraysize.split("x")
+	if not all(dim.isdigit() for dim in dims):
+		return None
+	# the first dimension varies fastest, so (like astropy) the shape is in the reverse order
+	return np.dtype(dtype), tuple(int(dim) for dim in dims[::-1])
+
+
+def _votable_array(texts, dtype, shape, null):
+	"""Converts the text of the TD elements to a masked numpy array, with missing values, null values and NaN masked
+	(like astropy does)"""
+	if dtype.kind in "SU":
+		texts = [(text or "").strip() for text in texts]
+		values = np.array([text.encode("utf8") for text in texts] if dtype.kind == "S" else texts, dtype=dtype)
+		return np.ma.array(values, mask=np.zeros(len(texts), dtype=np.bool_))
+	count = int(np.prod(shape))
+	if shape:
+		tokens = []
+		for text in texts:
+			parts = text.split() if text else []
+			tokens.extend((parts + [None] * count)[:count])
+		texts = tokens
+	else:
+		texts = [None if text is None else text.strip() for text in texts]
+	if dtype.kind == "b":
+		missing = np.array([text in [None, "", "?"] for text in texts], dtype=np.bool_)
+		values = np.array([text is not None and text.lower() in ["t", "true", "1"] for text in texts], dtype=np.bool_)
+	else:
+		missing = np.array([text in [None, "", null] for text in texts], dtype=np.bool_)
+		values = np.array(["0" if text in [None, ""] else text for text in texts]).astype(dtype)
+		if dtype.kind == "f":
+			missing |= np.isnan(values)
+			values[missing] = np.nan
+	length = len(values) // count
+	return np.ma.array(values.reshape((length,) + shape), mask=missing.reshape((length,) + shape))
+
+
+def _read_votable(path, column_names=None, chunk_size=100000):
+	"""Parses the first table of a VOTable with the TABLEDATA serialization, while streaming over the file, only
+	keeping the requested columns (all by default) in memory, the rows are converted to numpy arrays in chunks.
+
+	Returns (description, fields, arrays), where fields is a list of dicts (name, datatype, arraysize, ucd, unit,
+	description, null) for all fields, and arrays a dict mapping the index of the field to the masked numpy array.
+	Fields that are variable length arrays of numbers are skipped (with a warning).
+	Raises _VOTableNotTabledata for the other serializations (BINARY, BINARY2 and FITS).
+	"""
+	import xml.etree.ElementTree as ElementTree
+	fields = []
+	description = None
+	tags = []
+	indices = None
+	texts, chunks = {}, {}
+	row = []
+	tabledata = None
+
+	def flush():
+		for index in indices:
+			dtype, shape = dtypes[index]
+			chunks[index].append(_votable_array(texts[index], dtype, shape, fields[index]["null"]))
+			texts[index] = []
+	for event, element in ElementTree.iterparse(path, events=("start", "end")):
+		tag = element.tag.rpartition("}")[2]
+		if event == "start":
+			tags.append(tag)
+			if tag in ["BINARY", "BINARY2", "FITS"]:
+				raise _VOTableNotTabledata(tag)
+			if tag == "TABLEDATA":
+				tabledata = element
+				dtypes = [_votable_dtype(field) for field in fields]
+				indices = [index for index, field in enumerate(fields) if
+						   column_names is None or field["name"] in column_names or _python_save_name(field["name"]) in column_names]
+				for index in indices:
+					if dtypes[index] is None:
+						field = fields[index]
+						logger.warning("skipping column %r, %s with arraysize %r is not supported", field["name"], field["datatype"], field["arraysize"])
+				indices = [index for index in indices if dtypes[index] is not None]
+				for index in indices:
+					texts[index], chunks[index] = [], []
+			continue
+		tags.pop()
+		if tag == "TD":
+			row.append(element.text)
+		elif tag == "TR":
+			for index in indices:
+				texts[index].append(row[index] if index < len(row) else None)
+			row = []
+			tabledata.clear()  # such that the parsed rows do not stay in memory
+			if indices and len(texts[indices[0]]) >= chunk_size:
+				flush()
+		elif tag == "FIELD" and tags[-1:] == ["TABLE"]:
+			field = dict(name=element.get("name"), datatype=element.get("datatype"), arraysize=element.get("arraysize"),
+						 ucd=element.get("ucd"), unit=element.get("unit"), description=None, null=None)
+			for child in element:
+				child_tag = child.tag.rpartition("}")[2]
+				if child_tag == "DESCRIPTION":
+					field["description"] = child.text
+				elif child_tag == "VALUES":
+					field["null"] = child.get("null")
+			fields.append(field)
+		elif tag == "DESCRIPTION" and tags[-1:] == ["TABLE"]:
+			description = element.text
+		elif tag == "TABLE":
+			break  # we only read the first table
+	arrays = {}
+	if indices is not None:
+		flush()
+		for index in indices:
+			array = np.ma.concatenate(chunks[index])
+			arrays[index] = np.ma.array(array.data, mask=np.ma.getmaskarray(array))  # keep a full mask, like astropy
+	return description, fields, arrays
+
+
 class VOTable(DatasetArrays):
-	def __init__(self, filename):
+	"""Implements reading VOTables.
+
+	Tables with the TABLEDATA serialization are parsed while streaming over the file, only keeping the requested
+	columns in memory, the other serializations are read using astropy.
+
+	:param list column_names: only read these columns (all columns by default)
+	"""
+	def __init__(self, filename, column_names=None):
 		DatasetArrays.__init__(self, filename)
 		self.filename = filename
 		self.path = filename
+		try:
+			self.description, fields, arrays = _read_votable(self.filename, column_names)
+		except _VOTableNotTabledata:
+			self._load_astropy(column_names)
+			return
+		for index, field in enumerate(fields):
+			if index in arrays:
+				clean_name = _python_save_name(field["name"], self.columns.keys())
+				self._add_meta(clean_name, field["ucd"], field["unit"], field["description"])
+				self.add_column(clean_name, arrays[index])
+
+	def _add_meta(self, clean_name, ucd, unit, description):
+		if ucd:
+			self.ucds[clean_name] = ucd
+		if unit:
+			unit = _try_unit(unit)
+			if unit:
+				self.units[clean_name] = unit
+		if description:
+			self.descriptions[clean_name] = description
+
+	def _load_astropy(self, column_names):
 		votable = astropy.io.votable.parse(self.filename)
 
 		self.first_table = votable.get_first_table()
@@ -484,17 +733,12 @@ class VOTable(DatasetArrays):
 
 		for field in self.first_table.fields:
 			name = field.name
+			if column_names is not None and name not in column_names and _python_save_name(name) not in column_names:
+				continue
 			data = self.first_table.array[name]
 			type = self.first_table.array[name].dtype
 			clean_name = _python_save_name(name, self.columns.keys())
-			if field.ucd:
-				self.ucds[clean_name] = field.ucd
-			if field.unit:
-				unit = _try_unit(field.unit)
-				if unit:
-					self.units[clean_name] = unit
-			if field.description:
-				self.descriptions[clean_name] = field.description
+			self._add_meta(clean_name, field.ucd, field.unit, field.description)
 			if type.kind in "fiubSU": # only store float and int and boolean
 				self.add_column(clean_name, data) #self.first_table.array[name].data)
 			if type.kind == "O":
@@ -0,0 +1,352 @@
+"""Array backed open addressing hash tables.
+
+The tables in this module store every distinct key only once (in insertion order), so memory
+usage scales with the cardinality of the keys, not with the number of rows. All operations are
+vectorized using numpy, and work on chunks of data, which makes them suitable to be used in a
+map/reduce fashion by the :class:`vaex.execution.Executor`: each thread fills its own table, and
+in the reduce step the tables are merged using :meth:`HashTable.merge`.
+
+Example:
+
+>>> table = HashTable()
+>>> table.update([np.array([3, 1, 3, 2])])
+array([0, 1, 0, 2])
+>>> table.update([np.array([2, 4])])
+array([2, 3])
+>>> table.keys()
+[array([3, 1, 2, 4])]
+>>> table.lookup([np.array([4, 5])])
+array([ 3, -1])
+"""
+from __future__ import division, print_function
+import logging
+import numpy as np
+
+logger = logging.getLogger("vaex.hash")
+
+_EMPTY = -1
+_NULL_HASH = np.uint64(0x9e3779b97f4a7c15)
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def _mix(h):
+    """splitmix64 finalizer, makes sure that all bits of the hash are used when we mask it"""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xbf58476d1ce4e5b9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94d049bb133111eb)
+    h = h ^ (h >> np.uint64(31))
+    return h
+
+
+def hash_array(ar):
+    """Returns a uint64 hash for each element of a (non masked) numpy array.
+
+    Strings are hashed independent of their width, so 'S3' and 'S10' arrays containing the
+    same values give the same hashes.
+    """
+    ar = np.asarray(ar)
+    kind = ar.dtype.kind
+    with np.errstate(over='ignore'):
+        if kind == 'f':
+            values = ar.astype(np.float64) + 0.  # normalizes -0. to 0.
+            values[values != values] = np.nan  # all nan's hash the same
+            h = values.view(np.uint64)
+        elif kind in 'iub':
+            h = ar.astype(np.int64).view(np.uint64)
+        elif kind in 'mM':
+            h = ar.view(np.int64).view(np.uint64)
+        elif kind in 'SU':
+            # strings are hashed as FNV-1a over the characters, ignoring the trailing zeros
+            ar = np.ascontiguousarray(ar)
+            word_type = np.uint8 if kind == 'S' else np.uint32
+            length = ar.dtype.itemsize // np.dtype(word_type).itemsize
+            words = ar.view(word_type).reshape(len(ar), length)
+            h = np.zeros(len(ar), dtype=np.uint64)
+            h[:] = _FNV_OFFSET
+            for i in range(length):
+                word = words[:, i].astype(np.uint64)
+                h = np.where(word != 0, (h ^ word) * _FNV_PRIME, h)
+        else:
+            h = np.array([hash(k) for k in ar], dtype=np.int64).view(np.uint64)
+        return _mix(h)
+
+
+def hash_keys(datas, nulls):
+    """Combines the hashes of multiple keys (with their null masks) into a single uint64 hash"""
+    h = None
+    with np.errstate(over='ignore'):
+        for data, null in zip(datas, nulls):
+            hk = hash_array(data)
+            hk[null] = _NULL_HASH
+            if h is None:
+                h = hk
+            else:
+                h = _mix(h ^ (hk + _NULL_HASH + (h << np.uint64(6)) + (h >> np.uint64(2))))
+    return h
+
+
+def split_masks(keys):
+    """Splits a list of (possibly masked) arrays into a list of data arrays, and a list of boolean masks"""
+    datas = []
+    nulls = []
+    for key in keys:
+        key = np.asanyarray(key)
+        if np.ma.isMaskedArray(key):
+            null = np.ma.getmaskarray(key)
+            data = key.data
+        else:
+            null = np.zeros(len(key), dtype=np.bool_)
+            data = key
+        datas.append(data)
+        nulls.append(null)
+    return datas, nulls
+
+
+def _grow(ar, size):
+    new = np.zeros(size, dtype=ar.dtype)
+    new[:len(ar)] = ar
+    return new
+
+
+class HashTable(object):
+    """Maps (multi column) keys to a dense group index (between 0 and len(table)-1).
+
+    Missing values (masked values) are supported and form their own group, NaN values
+    are considered equal to each other.
+
+    :param int capacity: initial number of slots (rounded up to a power of 2)
+    :param float max_load: maximum fill fraction of the slots before the table is resized
+    """
+
+    def __init__(self, capacity=1024, max_load=0.5):
+        self.max_load = max_load
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.count = 0
+        self._slots = np.full(self.capacity, _EMPTY, dtype=np.int64)
+        self._owner = np.zeros(self.capacity, dtype=np.int64)
+        self._keys = None
+        self._nulls = None
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "<%s(count=%r, capacity=%r)> instance at 0x%x" % (self.__class__.__name__, self.count, self.capacity, id(self))
+
+    @property
+    def nbytes(self):
+        keys = sum(k.nbytes + n.nbytes for k, n in zip(self._keys or [], self._nulls or []))
+        return self._slots.nbytes + self._owner.nbytes + keys
+
+    def keys(self, masked=True):
+        """Returns the distinct keys as a list of arrays, ordered by group index.
+
+        :param bool masked: return masked arrays when missing values are present
+        """
+        if self._keys is None:
+            return []
+        result = []
+        for key, null in zip(self._keys, self._nulls):
+            key = key[:self.count]
+            null = null[:self.count]
+            if masked and null.any():
+                key = np.ma.array(key, mask=null)
+            result.append(key)
+        return result
+
+    def update(self, keys):
+        """Adds the keys (a list of arrays, one for each key column) to the table, and returns for each row its group index"""
+        datas, nulls = self._prepare(*split_masks(keys))
+        return self._find(datas, nulls, insert=True)
+
+    def lookup(self, keys):
+        """Like :meth:`update`, but does not insert new keys, rows that are not found get a group index of -1.
+
+        This does not modify the table, so multiple threads can do lookups at the same time.
+        """
+        if self._keys is None:
+            return np.full(len(keys[0]), _EMPTY, dtype=np.int64)
+        datas, nulls = split_masks(keys)
+        if len(datas) != len(self._keys):
+            raise ValueError("expected %d key(s), not %d" % (len(self._keys), len(datas)))
+        # instead of changing our storage, we cast to our dtypes, and mark the values that cannot be represented
+        unmatched = np.zeros(len(datas[0]), dtype=np.bool_)
+        for i, data in enumerate(datas):
+            stored = self._keys[i].dtype
+            if data.dtype == stored or (data.dtype.kind == stored.kind and stored.kind in 'SU'):
+                continue
+            try:
+                cast = data.astype(stored)
+                unmatched |= cast.astype(data.dtype) != data
+            except (UnicodeEncodeError, ValueError, TypeError):
+                cast = np.zeros(len(data), dtype=stored)
+                unmatched[:] = True
+            datas[i] = cast
+        codes = self._find(datas, nulls, insert=False)
+        codes[unmatched] = _EMPTY
+        return codes
+
+    def merge(self, other):
+        """Adds all keys of other to this table, returns an array which maps other's group indices to ours"""
+        if other._keys is None:
+            return np.zeros(0, dtype=np.int64)
+        datas = [k[:other.count] for k in other._keys]
+        nulls = [n[:other.count] for n in other._nulls]
+        datas, nulls = self._prepare(datas, nulls)
+        return self._find(datas, nulls, insert=True)
+
+    def _prepare(self, datas, nulls):
+        if self._keys is None:
+            self._keys = [np.zeros(0, dtype=data.dtype) for data in datas]
+            self._nulls = [np.zeros(0, dtype=np.bool_) for data in datas]
+        if len(datas) != len(self._keys):
+            raise ValueError("expected %d key(s), not %d" % (len(self._keys), len(datas)))
+        rehash = False
+        for i, data in enumerate(datas):
+            stored = self._keys[i].dtype
+            if data.dtype == stored:
+                continue
+            if data.dtype.kind == stored.kind and stored.kind in 'SU':
+                # strings hash independent of their length, we only need to widen the storage
+                if data.dtype.itemsize > stored.itemsize:
+                    self._keys[i] = self._keys[i].astype(data.dtype)
+            else:
+                common = np.promote_types(stored, data.dtype)
+                if common != stored:
+                    self._keys[i] = self._keys[i].astype(common)
+                    rehash = True
+                datas[i] = data.astype(common)
+        if rehash:
+            self._resize(self.capacity)
+        return datas, nulls
+
+    def _equal(self, datas, nulls, rows, groups):
+        equal = np.ones(len(rows), dtype=np.bool_)
+        for data, null, key, key_null in zip(datas, nulls, self._keys, self._nulls):
+            a = data[rows]
+            b = key[groups]
+            if a.dtype.kind == 'f':
+                same = (a == b) | ((a != a) & (b != b))
+            else:
+                same = a == b
+            null_a = null[rows]
+            equal &= (null_a == key_null[groups]) & (null_a | same)
+        return equal
+
+    def _append(self, datas, nulls, rows):
+        count_new = self.count + len(rows)
+        if count_new > len(self._keys[0]):
+            size = max(count_new, 2 * len(self._keys[0]), 16)
+            self._keys = [_grow(k, size) for k in self._keys]
+            self._nulls = [_grow(n, size) for n in self._nulls]
+        for key, key_null, data, null in zip(self._keys, self._nulls, datas, nulls):
+            key[self.count:count_new] = data[rows]
+            key_null[self.count:count_new] = null[rows]
+        groups = np.arange(self.count, count_new, dtype=np.int64)
+        self.count = count_new
+        return groups
+
+    def _resize(self, capacity):
+        """Rebuilds the slots, all keys are distinct, so we do not need to compare them"""
+        self.capacity = capacity
+        self._slots = np.full(self.capacity, _EMPTY, dtype=np.int64)
+        self._owner = np.zeros(self.capacity, dtype=np.int64)
+        if not self.count:
+            return
+        mask = np.uint64(self.capacity - 1)
+        datas = [k[:self.count] for k in self._keys]
+        nulls = [n[:self.count] for n in self._nulls]
+        pending = np.arange(self.count, dtype=np.int64)
+        slots = (hash_keys(datas, nulls) & mask).astype(np.int64)
+        while len(pending):
+            empty = self._slots[slots] == _EMPTY
+            self._owner[slots[empty]] = pending[empty]
+            placed = np.zeros(len(pending), dtype=np.bool_)
+            placed[empty] = self._owner[slots[empty]] == pending[empty]
+            self._slots[slots[placed]] = pending[placed]
+            probe = ~placed & ~empty
+            slots[probe] = (slots[probe] + 1) & (self.capacity - 1)
+            pending = pending[~placed]
+            slots = slots[~placed]
+
+    def _find(self, datas, nulls, insert):
+        N = len(datas[0])
+        codes = np.full(N, _EMPTY, dtype=np.int64)
+        if N == 0:
+            return codes
+        hashes = hash_keys(datas, nulls)
+        pending = np.arange(N, dtype=np.int64)
+        slots = (hashes & np.uint64(self.capacity - 1)).astype(np.int64)
+        while len(pending):
+            groups = self._slots[slots]
+            occupied = groups != _EMPTY
+            same = occupied.copy()
+            if occupied.any():
+                same[occupied] = self._equal(datas, nulls, pending[occupied], groups[occupied])
+            codes[pending[same]] = groups[same]
+            done = same.copy()
+            empty = ~occupied
+            if insert and empty.any():
+                rows = pending[empty]
+                if (self.count + len(rows)) > self.max_load * self.capacity:
+                    capacity = self.capacity * 2
+                    while (self.count + len(rows)) > self.max_load * capacity:
+                        capacity *= 2
+                    self._resize(capacity)
+                    slots = (hashes[pending] & np.uint64(self.capacity - 1)).astype(np.int64)
+                    continue
+                # rows competing for the same empty slot: the last one written wins (we write in
+                # reverse so the first row wins), the others compare against the winner in the next round
+                empty_slots = slots[empty]
+                self._owner[empty_slots[::-1]] = rows[::-1]
+                winner = self._owner[empty_slots] == rows
+                new_groups = self._append(datas, nulls, rows[winner])
+                self._slots[empty_slots[winner]] = new_groups
+                codes[rows[winner]] = new_groups
+                done[np.flatnonzero(empty)[winner]] = True
+            elif not insert:
+                done |= empty
+            probe = occupied & ~same
+            slots[probe] = (slots[probe] + 1) & (self.capacity - 1)
+            pending = pending[~done]
+            slots = slots[~done]
+        return codes
+
+
+class HashIndex(object):
+    """Maps (multi column) keys to the row number at which they occur, which is what we need for a join.
+
+    Rows with missing values in their keys are not indexed, and will never match.
+
+    :param HashTable table: table with the distinct keys
+    :param rows: for each group in the table, the (first) row number at which it occurs
+    :param counts: for each group in the table, the number of rows
+    """
+    def __init__(self, table, rows, counts):
+        self.table = table
+        self.rows = rows
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def unique(self):
+        """True when every key occurs only once"""
+        return bool(np.all(self.counts <= 1))
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes + self.rows.nbytes + self.counts.nbytes
+
+    def lookup(self, keys):
+        """Returns for each row (given by keys) the row number where the key occurs, or -1 if not found"""
+        codes = self.table.lookup(keys)
+        found = codes != _EMPTY
+        rows = np.full(len(codes), _EMPTY, dtype=np.int64)
+        rows[found] = self.rows[codes[found]]
+        return rows
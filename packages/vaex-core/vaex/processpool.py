@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Executor backend that runs the evaluation of expressions and statistics in worker processes.
+
+Threads only help when the work releases the GIL (like the binning in vaexfast), expressions that
+call Python functions (e.g. :meth:`DataFrame.apply`) or long chains of small numpy operations
+are effectively serialized. :class:`ExecutorProcess` evaluates those in worker processes instead.
+
+Workers do not receive the data: each column of the DataFrame is described by the file it is memory
+mapped from, and its offset, dtype, shape and strides, and the workers map the same file again. The
+state of the DataFrame (virtual columns, selections, variables, functions) is sent along with the
+work, and the statistics are written directly into grids in shared memory (one slot per worker), which
+are reduced by the main process.
+
+Only statistics (:class:`vaex.tasks.TaskStatistic`) on DataFrames whose columns are all memory mapped
+are executed in the worker processes, all other tasks are executed by the threads as usual.
+
+Example:
+
+>>> import vaex, vaex.processpool
+>>> df = vaex.open('big.hdf5')
+>>> df.executor = vaex.processpool.ExecutorProcess()
+>>> df['y'] = df.apply(some_python_function, arguments=[df.x])
+>>> df.mean(df.y)
+"""
+from __future__ import division, print_function
+import concurrent.futures
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import pickle
+import tempfile
+import warnings
+import numpy as np
+import six
+
+import vaex.dataframe
+import vaex.dataset_mmap
+import vaex.execution
+import vaex.multithreading
+import vaex.tasks
+import vaex.utils
+from .utils import _ensure_strings_from_expressions
+
+logger = logging.getLogger("vaex.processpool")
+
+_pass_ids = itertools.count()
+
+# ops are compared by identity (e.g. OP_ADD1), so we send the code, and the worker looks them up
+_ops = {op.code: op for op in [vaex.tasks.OP_ADD1, vaex.tasks.OP_COUNT, vaex.tasks.OP_MIN_MAX, vaex.tasks.OP_ADD_WEIGHT_MOMENTS_01,
+                               vaex.tasks.OP_ADD_WEIGHT_MOMENTS_012, vaex.tasks.OP_COV, vaex.tasks.OP_FIRST]}
+
+
+def _task_spec(task):
+    """Returns the arguments to create the same task in a worker, or None when that is not supported"""
+    if type(task) is not vaex.tasks.TaskStatistic or _ops.get(task.op.code) is not task.op or task.row_start != 0:
+        return None
+    selections = task.selections
+    if not all(selection in [None, False, True] or isinstance(selection, six.string_types) for selection in selections):
+        return None
+    return dict(expressions=_ensure_strings_from_expressions(task.expressions),
+                shape=tuple(k - 3 for k in task.shape) if task.edges else task.shape,
+                limits=task.limits, masked=task.masked, op=task.op.code, edges=task.edges,
+                weights=_ensure_strings_from_expressions(task.weights),
+                selection=selections if task.selection_waslist else selections[0])
+
+
+# the state of a worker process
+_worker = {}
+
+
+def _worker_init(counter):
+    with counter.get_lock():
+        _worker['index'] = counter.value
+        counter.value += 1
+    _worker['executor'] = vaex.execution.Executor(vaex.multithreading.ThreadPoolIndex(max_workers=1))
+    _worker['mappings'] = {}
+    _worker['dfs'] = {}
+    _worker['pass'] = (None, None, None)
+
+
+def _worker_array(spec):
+    path, offset, dtype, shape, strides = spec
+    if path not in _worker['mappings']:
+        with open(path, 'rb') as f:
+            _worker['mappings'][path] = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+    return np.ndarray(shape, np.dtype(dtype), buffer=_worker['mappings'][path], offset=offset, strides=strides)
+
+
+def _worker_df(columns, state):
+    key = pickle.dumps((sorted(columns.items()), state))
+    if key not in _worker['dfs']:
+        if len(_worker['dfs']) > 16:
+            _worker['dfs'].clear()
+        df = vaex.dataframe.DataFrameArrays()
+        for name, (data, mask) in columns.items():
+            data = _worker_array(data)
+            if mask is not None:
+                data = np.ma.array(data, mask=mask if mask is np.ma.nomask else _worker_array(mask), shrink=False)
+            df.add_column(name, data)
+        df.state_set(state, use_active_range=True)
+        df.executor = _worker['executor']
+        _worker['dfs'][key] = df
+    return _worker['dfs'][key]
+
+
+def _worker_tasks(pass_id, df, specs):
+    """Creates the tasks for this pass, where the grid of each task is the slot of this worker in the shared grid"""
+    if _worker['pass'][0] != pass_id:
+        tasks = []
+        for spec in specs:
+            spec = dict(spec)
+            path, dtype, shape = spec.pop('grid')
+            spec['op'] = _ops[spec['op']]
+            task = vaex.tasks.TaskStatistic(df, **spec)
+            grid = np.memmap(path, dtype=np.dtype(dtype), mode='r+', shape=shape)
+            task.grid = grid[_worker['index']:_worker['index'] + 1]
+            tasks.append(task)
+        expressions = list(set(expression for task in tasks for expression in task.expressions_all))
+        _worker['pass'] = (pass_id, tasks, vaex.execution.ExpressionPlan(df, expressions))
+    return _worker['pass'][1:]
+
+
+def _process_chunk(pass_id, columns, state, specs, i1, i2):
+    df = _worker_df(columns, state)
+    tasks, plan = _worker_tasks(pass_id, df, specs)
+    block_scope = df._block_scope(i1, i2)
+    blocks = plan.evaluate(block_scope)
+    shared = vaex.execution.SharedChunk(df, i1, i2)
+    for task in tasks:
+        task.map_shared(shared, 0, i1, i2, *[blocks[expression] for expression in task.expressions_all])
+    return i2 - i1
+
+
+def _shared_grid(shape, dtype):
+    """Returns a memory mapped array (and its path) that can be opened by the worker processes"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    fd, path = tempfile.mkstemp(prefix='vaex-grid-', dir=directory)
+    os.close(fd)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape), path
+
+
+class ExecutorProcess(vaex.execution.Executor):
+    """Executor that runs statistics in a pool of worker processes, see :mod:`vaex.processpool`.
+
+    :param int processes: number of worker processes, by default the number of cpu cores
+    :param thread_pool: thread pool for the tasks that are not executed by the processes
+    :param int buffer_size: number of rows per chunk
+    """
+    def __init__(self, processes=None, thread_pool=None, buffer_size=None, **kwargs):
+        super(ExecutorProcess, self).__init__(thread_pool=thread_pool, buffer_size=buffer_size, **kwargs)
+        self.processes = processes or vaex.multithreading.thread_count_default
+        self.process_pool = None
+
+    def _get_process_pool(self):
+        if self.process_pool is None:
+            counter = multiprocessing.Value('i', 0)
+            self.process_pool = concurrent.futures.ProcessPoolExecutor(self.processes, initializer=_worker_init, initargs=(counter,))
+        return self.process_pool
+
+    def close(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+
+    def _jobs(self):
+        """Returns a list of (df, tasks, specs, columns, state) for the tasks that can run in the worker processes"""
+        tasks_per_df = {}
+        for task in self.task_queue:
+            spec = None if task.cancelled else _task_spec(task)
+            if spec is not None:
+                tasks_per_df.setdefault(task.df, []).append((task, spec))
+        jobs = []
+        for df, items in tasks_per_df.items():
+            columns = vaex.dataset_mmap.mapped_columns(df)
+            if columns is None:
+                logger.debug("not all columns are memory mapped, using threads for %r", df)
+                continue
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    state = df.state_get()
+                state['renamed_columns'] = []  # the workers use the current names
+                pickle.dumps(state)
+            except Exception:
+                logger.debug("cannot send the state of %r to the workers, using threads", df, exc_info=True)
+                continue
+            tasks = [task for task, spec in items]
+            jobs.append((df, tasks, [spec for task, spec in items], columns, state))
+        return jobs
+
+    def execute(self):
+        if self._is_executing:
+            return
+        self.task_queue = self._fulfill_cached(self.task_queue)
+        jobs = self._jobs()
+        if not jobs:
+            return super(ExecutorProcess, self).execute()
+        for df, tasks, specs, columns, state in jobs:
+            for task in tasks:
+                self.task_queue.remove(task)
+        self._is_executing = True
+        try:
+            self._execute_processes(jobs)
+        finally:
+            self._is_executing = False
+        # other tasks, or tasks added by callbacks
+        if self.task_queue:
+            self.execute()
+
+    def _execute_processes(self, jobs):
+        pool = self._get_process_pool()
+        self.signal_begin.emit()
+        for df, tasks, specs, columns, state in jobs:
+            self.passes += 1
+            pass_id = (os.getpid(), next(_pass_ids))
+            grids = []
+            try:
+                for task, spec in zip(tasks, specs):
+                    grid, path = _shared_grid((self.processes,) + task.grid.shape[1:], task.grid.dtype)
+                    task.op.init(grid)
+                    grids.append((grid, path))
+                    spec['grid'] = (path, grid.dtype.str, grid.shape)
+                    task.signal_progress.emit(0)
+                parts = vaex.utils.subdivide(df.active_length(), max_length=self.buffer_size)
+                futures = [pool.submit(_process_chunk, pass_id, columns, state, specs, i1, i2) for i1, i2 in parts]
+                cancelled = False
+                try:
+                    for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                        future.result()  # raises the exception of a worker
+                        progress = (i + 1) / len(futures)
+                        if not (all(self.signal_progress.emit(progress)) and all([all(task.signal_progress.emit(progress)) for task in tasks])):
+                            cancelled = True
+                            break
+                except:
+                    logger.exception("error in worker process, cancelling")
+                    cancelled = True
+                    raise
+                finally:
+                    if cancelled:
+                        for future in futures:
+                            future.cancel()
+                        self.signal_cancel.emit()
+                if cancelled:
+                    logger.debug("execution aborted")
+                    continue
+                for task, (grid, path) in zip(tasks, grids):
+                    logger.debug("fulfill task: %r", task)
+                    task.grid = np.array(grid)
+                    if not task.cancelled:
+                        result = task.reduce(None)
+                        self._cache_result(task, result)
+                        task.fulfill(result)
+            finally:
+                for grid, path in grids:
+                    os.remove(path)
+        self.signal_end.emit()
@@ -0,0 +1,202 @@
+"""Binary protocol for the messages between the server (:mod:`vaex.webserver`) and remote DataFrames (:mod:`vaex.remote`).
+
+A message is a dict (e.g. job_id, job_phase and result), which may contain numpy arrays at any level (in dicts and
+lists). The arrays are not converted to json, but sent as raw (optionally compressed) buffers. A frame is::
+
+    magic (b'VXP') | version (uint8) | kind (uint8) | header length (uint32, little endian) | header (json) | payload
+
+For a message (kind 0), the header is the message with each array replaced by a reference to its buffer(s), and
+a list with the dtype, shape, compression and number of bytes of each buffer. The payload is the concatenation of the
+buffers. Masked arrays are sent as two buffers (the data and the mask), arrays of objects (e.g. strings) are sent
+as json.
+
+Large frames are split into chunks (kind 1), with a header of the form {"id": ..., "index": ..., "count": ...} and a
+part of the frame as payload, such that the chunks of different jobs can be interleaved on a single websocket.
+:class:`Assembler` puts them together again.
+
+Compression is negotiated per request: the client sends the version and the compressions it supports, and the server
+uses the first of those it supports as well (zlib is always available, lz4 and zstd when the lz4 or zstandard
+packages are installed). Clients that do not send a version get the (json based) messages of earlier versions.
+"""
+import json
+import struct
+import uuid
+import zlib
+
+import numpy as np
+
+MAGIC = b'VXP'
+VERSION = 1
+MESSAGE = 0
+CHUNK = 1
+content_type = "application/x-vaex-protocol"
+
+_prefix = struct.Struct('<3sBBI')
+chunk_size_default = 1024**2
+compress_size_min = 1024  # smaller buffers are not worth compressing
+
+compressors = {"zlib": (lambda data: zlib.compress(data, 1), zlib.decompress)}
+try:
+    import zstandard
+    compressors["zstd"] = (lambda data: zstandard.ZstdCompressor(level=1).compress(data),
+                           lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+try:
+    import lz4.frame
+    compressors["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+# from fastest to best compression, the order in which a client prefers them
+_preference = ["lz4", "zstd", "zlib"]
+
+
+def compressions():
+    """Returns the names of the available compressions, in the order of preference"""
+    return [name for name in _preference if name in compressors]
+
+
+def negotiate(protocol):
+    """Returns (version, compression) to use for a request with the protocol (as sent by the client), or (None, None)
+    when the client does not support (this version of) the protocol"""
+    if not protocol:
+        return None, None
+    version = min(int(protocol.get("version", 0)), VERSION)
+    if version < 1:
+        return None, None
+    compression = None
+    for name in protocol.get("compression") or []:
+        if name in compressors:
+            compression = name
+            break
+    return version, compression
+
+
+def is_frame(data):
+    """Returns True when data is a frame (of any kind) of this protocol"""
+    return isinstance(data, bytes) and data[:len(MAGIC)] == MAGIC
+
+
+def _frame(kind, header, payload):
+    header = json.dumps(header).encode('utf8')
+    return _prefix.pack(MAGIC, VERSION, kind, len(header)) + header + payload
+
+
+def _unframe(frame):
+    magic, version, kind, header_length = _prefix.unpack_from(frame)
+    if magic != MAGIC:
+        raise ValueError("not a frame of the vaex protocol")
+    if version > VERSION:
+        raise ValueError("unsupported protocol version %d (we support up to version %d)" % (version, VERSION))
+    start = _prefix.size + header_length
+    return kind, json.loads(frame[_prefix.size:start].decode('utf8')), memoryview(frame)[start:]
+
+
+def encode(message, compression=None):
+    """Returns the frame for the message (a dict, with possibly numpy arrays as values)
+
+    :param str compression: name of the compression to use for the buffers (see :data:`compressors`), or None
+    """
+    buffers = []
+    specs = []
+
+    def add(array):
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        used = None
+        if compression and len(data) >= compress_size_min:
+            compressed = compressors[compression][0](data)
+            if len(compressed) < len(data):
+                data, used = compressed, compression
+        specs.append(dict(dtype=array.dtype.str, shape=list(array.shape), compression=used, length=len(data)))
+        buffers.append(data)
+        return len(buffers) - 1
+
+    def walk(value):
+        if isinstance(value, dict):
+            return {key: walk(item) for key, item in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return [walk(item) for item in value]
+        elif isinstance(value, np.ndarray):
+            if value.dtype.kind == 'O':
+                return walk(value.tolist())
+            reference = {"__buffer__": add(np.ma.getdata(value))}
+            if np.ma.isMaskedArray(value):
+                reference["mask"] = add(np.ma.getmaskarray(value))
+            return reference
+        elif isinstance(value, np.generic):
+            return value.item()
+        else:
+            return value
+    header = dict(message=walk(message), buffers=specs)
+    return _frame(MESSAGE, header, b''.join(buffers))
+
+
+def decode(frame):
+    """Returns the message of a frame (of kind message)"""
+    kind, header, payload = _unframe(frame)
+    if kind != MESSAGE:
+        raise ValueError("expected a message, not kind %d (use Assembler for chunks)" % kind)
+    arrays = []
+    offset = 0
+    for spec in header["buffers"]:
+        data = payload[offset:offset + spec["length"]]
+        offset += spec["length"]
+        if spec["compression"]:
+            data = compressors[spec["compression"]][1](bytes(data))
+        # a copy, since the frame is read only
+        arrays.append(np.frombuffer(data, dtype=np.dtype(spec["dtype"])).reshape(spec["shape"]).copy())
+
+    def walk(value):
+        if isinstance(value, dict):
+            if "__buffer__" in value:
+                array = arrays[value["__buffer__"]]
+                if "mask" in value:
+                    array = np.ma.array(array, mask=arrays[value["mask"]])
+                return array
+            return {key: walk(item) for key, item in value.items()}
+        elif isinstance(value, list):
+            return [walk(item) for item in value]
+        else:
+            return value
+    return walk(header["message"])
+
+
+def split(frame, chunk_size=None):
+    """Returns a list of frames: the frame itself when it is small enough, otherwise chunks of about chunk_size bytes
+    (:data:`chunk_size_default` by default)"""
+    chunk_size = chunk_size or chunk_size_default
+    if len(frame) <= chunk_size:
+        return [frame]
+    id = str(uuid.uuid4())
+    count = (len(frame) + chunk_size - 1) // chunk_size
+    return [_frame(CHUNK, dict(id=id, index=index, count=count), frame[index * chunk_size:(index + 1) * chunk_size])
+            for index in range(count)]
+
+
+class Assembler(object):
+    """Decodes frames, putting the chunks of a frame together again.
+
+    Example:
+
+    >>> assembler = vaex.protocol.Assembler()
+    >>> for frame in vaex.protocol.split(vaex.protocol.encode(dict(result=np.arange(10**6))), 1000):
+    ...     message = assembler.feed(frame)
+    >>> message['result']
+    array([     0,      1,      2, ..., 999997, 999998, 999999])
+    """
+    def __init__(self):
+        self.chunks = {}  # id -> list of the payloads of the chunks (None when not received yet)
+
+    def feed(self, frame):
+        """Returns the message when the frame (or the last missing chunk) completes it, otherwise None"""
+        kind, header, payload = _unframe(frame)
+        if kind == MESSAGE:
+            return decode(frame)
+        chunks = self.chunks.setdefault(header["id"], [None] * header["count"])
+        chunks[header["index"]] = bytes(payload)
+        if any(chunk is None for chunk in chunks):
+            return None
+        del self.chunks[header["id"]]
+        return decode(b''.join(chunks))
@@ -9,7 +9,10 @@ from .dataset import Dataset
 from .utils import _issequence
 from .tasks import Task
 from .legacy import Subspace
+import vaex.events
+import vaex.execution
 import vaex.promise
+import vaex.protocol
 import vaex.settings
 import vaex.utils
 from tornado.httpclient import AsyncHTTPClient, HTTPClient
@@ -80,7 +83,15 @@ def _check_error(object):
 
 
 class ServerRest(object):
-    def __init__(self, hostname, port=5000, base_path="/", background=False, thread_mover=None, websocket=True):
+    """Connection to a vaex server (see :mod:`vaex.webserver`).
+
+    :param bool websocket: send the requests over a single websocket (otherwise each request is an http request)
+    :param bool protocol: receive the results using the binary protocol (see :mod:`vaex.protocol`), otherwise as json
+    :param float partial_interval: when given (and using the protocol over a websocket), the server sends partial results
+        of statistics after each fraction partial_interval of the pass over the data, see :attr:`TaskServer.signal_partial`
+    """
+    def __init__(self, hostname, port=5000, base_path="/", background=False, thread_mover=None, websocket=True, protocol=True,
+                 partial_interval=None):
         self.hostname = hostname
         self.port = port
         self.base_path = base_path if base_path.endswith("/") else (base_path + "/")
@@ -120,6 +131,9 @@ class ServerRest(object):
         self.user_id = vaex.settings.webclient.get("cookie.user_id")
         self.use_websocket = websocket
         self.websocket = None
+        self.protocol = protocol
+        self.partial_interval = partial_interval
+        self.assembler = vaex.protocol.Assembler()  # puts the chunks of the results together
 
         self.submit = self.submit_http
 
@@ -173,13 +187,20 @@ class ServerRest(object):
             raise self.websocket.reason
 
     def _on_websocket_message(self, msg):
-        json_data, data = msg.split(b"\n", 1)
-        response = json.loads(json_data.decode("utf8"))
-        if data:
-            import zlib
-            data = zlib.decompress(data)
-            numpy_array = np.fromstring(data, dtype=np.dtype(response["dtype"])).reshape(ast.literal_eval(response["shape"]))
-            response["result"] = numpy_array
+        if msg is None:  # the connection is closed
+            return
+        if vaex.protocol.is_frame(msg):
+            response = self.assembler.feed(msg)
+            if response is None:
+                return  # not all chunks are received yet
+        else:
+            json_data, data = msg.split(b"\n", 1)
+            response = json.loads(json_data.decode("utf8"))
+            if data:
+                import zlib
+                data = zlib.decompress(data)
+                numpy_array = np.fromstring(data, dtype=np.dtype(response["dtype"])).reshape(ast.literal_eval(response["shape"]))
+                response["result"] = numpy_array
         import sys
         if sys.getsizeof(msg) > 1024 * 4:
             logger.debug("socket read message: <large amount of data>",)
@@ -188,7 +209,7 @@ class ServerRest(object):
             logger.debug("json response: %r", response)
         # for the moment, job == task, in the future a job can be multiple tasks
         job_id = response.get("job_id")
-        if job_id:
+        if job_id in self.jobs:  # cancelled jobs are removed
             try:
                 phase = response["job_phase"]
                 logger.debug("job update %r, phase=%r", job_id, phase)
@@ -222,6 +243,13 @@ class ServerRest(object):
                         self.thread_mover(task.reject, exception)
                     else:
                         task.reject(exception)
+                elif phase == "PARTIAL":
+                    task = self.jobs[job_id]
+                    result = task.post_process(response["result"])
+                    if task.delay:
+                        self.thread_mover(task._partial, result)
+                    else:
+                        task._partial(result)
                 elif phase == "PENDING":
                     fraction = response["progress"]
                     logger.debug("pending?: %r", phase)
@@ -251,9 +279,14 @@ class ServerRest(object):
         logger.debug("created task: %r, %r (delay=%r)" % (path, arguments, delay))
         job_id = str(uuid.uuid4())
         self.jobs[job_id] = task
+        task.server, task.job_id = self, job_id
         arguments["job_id"] = job_id
         arguments["path"] = path
         arguments["user_id"] = self.user_id
+        if self.protocol:
+            arguments["protocol"] = dict(version=vaex.protocol.VERSION, compression=vaex.protocol.compressions())
+            if self.partial_interval:
+                arguments["partial"] = self.partial_interval
         # arguments = dict({key: (value.tolist() if hasattr(value, "tolist") else value) for key, value in arguments.items()})
         arguments = dict({key: listify(value) for key, value in arguments.items()})
 
@@ -277,6 +310,15 @@ class ServerRest(object):
         else:
             return task.get()
 
+    def _cancel(self, task):
+        """Tells the server we are no longer interested in the result of the task, and rejects it"""
+        if self.jobs.pop(task.job_id, None) is None:
+            return  # already done (or cancelled)
+        if self.use_websocket:
+            message = json.dumps(dict(cancel=task.job_id))
+            self.io_loop.add_callback(lambda: self.websocket_connected.then(lambda socket: socket.write_message(message)).end())
+        task.reject(vaex.execution.UserAbort("cancelled"))
+
     def submit_http(self, path, arguments, post_process, delay, progress=None, **kwargs):
         def pre_post_process(response):
             cookie = Cookie.SimpleCookie()
@@ -294,7 +336,11 @@ class ServerRest(object):
             is_json = False
             logger.info("response is: %r", response.body)
             logger.info("content_type is: %r", response.headers["Content-Type"])
-            if response.headers["Content-Type"] == "application/numpy-array":
+            if response.headers["Content-Type"] == vaex.protocol.content_type:
+                data = vaex.protocol.decode(response.body)
+                self._check_exception(data)
+                return post_process(data["result"])
+            elif response.headers["Content-Type"] == "application/numpy-array":
                 shape, dtype, data = response.body.split(b"\n", 2)
                 shape = shape.decode("ascii")
                 dtype = dtype.decode("ascii")
@@ -325,6 +371,8 @@ class ServerRest(object):
         if self.user_id is not None:
             headers.add("Cookie", "user_id=%s" % self.user_id)
             logger.debug("adding user_id %s to request", self.user_id)
+        if self.protocol:
+            headers.add("Accept", vaex.protocol.content_type)
         if delay:
             task = TaskServer(pre_post_process, delay=delay)
             # tornado doesn't like that we call fetch while ioloop is running in another thread, we should use ioloop.add_callbacl
@@ -587,6 +635,23 @@ class TaskServer(Task):
         self.post_process = post_process
         self.delay = delay
         self.task_queue = []
+        self.server = None  # the server and id of the job, when sent over a websocket
+        self.job_id = None
+        # emits the successive partial results (when the server sends them, see ServerRest.partial_interval)
+        self.signal_partial = vaex.events.Signal("partial result")
+        self.partial_result = None
+
+    def _partial(self, result):
+        if self.isPending:  # a partial result may arrive after the result
+            self.partial_result = result
+            self.signal_partial.emit(result)
+
+    def cancel(self):
+        """Cancels the request, the server only stops the pass over the data when no other request shares it (see
+        :class:`vaex.webserver.PassBatcher`)"""
+        Task.cancel(self)
+        if self.server is not None and self.isPending:
+            self.server._cancel(self)
 
     def schedule(self, task):
         self.task_queue.append(task)
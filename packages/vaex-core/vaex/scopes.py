@@ -173,7 +173,17 @@ class _BlockScopeSelection(object):
                 # logger.debug("was not cached")
                 if variable in self.df.variables:
                     return self.df.variables[variable]
-                mask = selection.evaluate(self.df, variable, self.i1, self.i2)
+                # masks can be shared with other DataFrames (e.g. copies), see vaex.cache.SelectionMaskCache
+                mask = None
+                if self.df._selection_mask_cache is not None:
+                    shared_cache, token = self.df._selection_mask_cache
+                    shared_key = shared_cache.key(self.df, token, variable, selection, self.i1, self.i2)
+                    if shared_key is not None:
+                        mask = shared_cache.get_mask(shared_key, self.i2 - self.i1)
+                if mask is None:
+                    mask = selection.evaluate(self.df, variable, self.i1, self.i2)
+                    if self.df._selection_mask_cache is not None and shared_key is not None:
+                        shared_cache.set_mask(shared_key, mask)
                 # logger.debug("put selection in mask with key %r" % (key,))
                 if self.store_in_cache:
                     cache[key] = selection, mask
@@ -2,6 +2,7 @@ import logging
 import numpy as np
 
 import vaex.expression
+import vaex.zonemaps
 from .utils import _split_and_combine_mask, as_flat_float
 
 logger = logging.getLogger('vaex.selections')
@@ -130,7 +131,7 @@ class SelectionExpression(Selection):
             previous_mask = df._evaluate_selection_mask(name, i1, i2, selection=self.previous_selection)
         else:
             previous_mask = None
-        current_mask = df._evaluate_selection_mask(self.boolean_expression, i1, i2).astype(np.bool)
+        current_mask = self._evaluate_expression(df, i1, i2)
         if previous_mask is None:
             logger.debug("setting mask")
             mask = current_mask
@@ -141,6 +142,20 @@ class SelectionExpression(Selection):
         return mask
 
 
+    def _evaluate_expression(self, df, i1, i2):
+        # zone maps (see vaex.zonemaps) tell us which blocks of rows cannot (or all) match, we only evaluate the others
+        segments = vaex.zonemaps.expression_segments(df, self.boolean_expression, i1, i2)
+        if segments is None or all(state == vaex.zonemaps.SOME for j1, j2, state in segments):
+            return df._evaluate_selection_mask(self.boolean_expression, i1, i2).astype(np.bool)
+        mask = np.zeros(i2 - i1, dtype=np.bool)
+        for j1, j2, state in segments:
+            if state == vaex.zonemaps.ALL:
+                mask[j1 - i1:j2 - i1] = True
+            elif state == vaex.zonemaps.SOME:
+                mask[j1 - i1:j2 - i1] = df._evaluate_selection_mask(self.boolean_expression, j1, j2)
+        return mask
+
+
 class SelectionInvert(Selection):
     def __init__(self, previous_selection):
         super(SelectionInvert, self).__init__(previous_selection, "")
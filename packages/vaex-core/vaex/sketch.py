@@ -0,0 +1,100 @@
+"""Mergeable quantile sketches.
+
+A :class:`KLL` sketch (Karnin, Lang and Liberty, 2016) summarizes a stream of values using a number of items that
+only grows logarithmically with the number of values. Items at level h represent 2**h values. When a level holds
+more items than its capacity, it is sorted and every other item (starting at a random offset) is promoted to the
+next level. Two sketches can be merged by merging their levels, so each thread (or process) can sketch its own part
+of the data, which are merged at the end.
+
+The error in the rank of a quantile is bounded by roughly 1.7/k (with high probability), so with the default
+k=256, a median will be between the 49.3 and 50.7 percentile. For less than k values, the quantiles are exact.
+
+Example:
+
+>>> sketch = KLL()
+>>> sketch.update(np.random.normal(size=1000000))
+>>> sketch.quantile([0.5, 0.99])
+array([-0.00138021,  2.32485017])
+"""
+from __future__ import division, print_function
+import numpy as np
+
+
+class KLL(object):
+    """Quantile sketch.
+
+    :param int k: size of the sketch (the capacity of the top level), which determines the accuracy
+    :param seed: seed for the random offsets of the compactions, for reproducible results
+    """
+    min_capacity = 8
+
+    def __init__(self, k=256, seed=None):
+        self.k = k
+        self.levels = [np.zeros(0)]
+        self.count = 0
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return sum(items.nbytes for items in self.levels)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(self.min_capacity, int(np.ceil(self.k * (2. / 3) ** depth)))
+
+    def update(self, values):
+        """Adds the values (missing values should be removed before)"""
+        values = np.sort(np.asarray(values, dtype=np.float64))
+        self.count += len(values)
+        self._insert(0, values)
+        self._compress()
+
+    def merge(self, other):
+        """Adds the values summarized by another sketch"""
+        for level, items in enumerate(other.levels):
+            self._insert(level, items)
+        self.count += other.count
+        self._compress()
+
+    def _insert(self, level, items):
+        """Inserts sorted items into a level, which we keep sorted, so compacting does not need to sort"""
+        if level == len(self.levels):
+            self.levels.append(np.zeros(0))
+        current = self.levels[level]
+        if len(current) < len(items):
+            current, items = items, current
+        self.levels[level] = np.insert(current, np.searchsorted(current, items), items) if len(items) else current
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                keep = items[:0]
+                if len(items) % 2:  # one item stays at this level, the smallest or largest, to avoid a bias
+                    if self.random.randint(2):
+                        keep, items = items[:1], items[1:]
+                    else:
+                        keep, items = items[-1:], items[:-1]
+                self.levels[level] = keep
+                self._insert(level + 1, items[self.random.randint(2)::2])
+            level += 1
+
+    def quantile(self, q):
+        """Returns the quantiles (between 0 and 1), linearly interpolated between the nearest ranks, like numpy's
+        default, or NaN when no values were added"""
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2**level, dtype=np.int64) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        items = items[order]
+        ends = np.cumsum(weights[order])  # item i represents the ranks [ends[i] - weights[i], ends[i])
+        rank = q * (ends[-1] - 1)
+        lower = items[np.minimum(np.searchsorted(ends, np.floor(rank), side='right'), len(items) - 1)]
+        upper = items[np.minimum(np.searchsorted(ends, np.ceil(rank), side='right'), len(items) - 1)]
+        return lower + (upper - lower) * (rank - np.floor(rank))
@@ -0,0 +1,187 @@
+"""External memory (out of core) sorting.
+
+Sorting happens in two phases. First, each chunk of rows is sorted on its own (in parallel, by the
+:class:`vaex.execution.Executor`), and the sorted keys and row numbers are written to temporary
+memory mapped files, which we call a sorted run. Next, the runs are merged (k-way merge), a batch of
+rows at a time, into the final order. Memory usage is therefore bounded by the chunk size, not
+by the length of the DataFrame.
+
+Missing values (masked values or NaN) are always put last, and the sort is stable, meaning
+that rows with equal keys keep their original order.
+
+Example:
+
+>>> keys = [normalize(np.array([3, 1, 2]), ascending=True)]
+>>> argsort(keys, [True])
+array([1, 2, 0])
+>>> run1 = Run([normalize(np.array([1, 3]), True)], np.array([0, 1]))
+>>> run2 = Run([normalize(np.array([2, 4]), True)], np.array([2, 3]))
+>>> merge([run1, run2], [True])
+array([0, 2, 1, 3])
+"""
+from __future__ import division, print_function
+import logging
+import tempfile
+import numpy as np
+
+logger = logging.getLogger("vaex.sort")
+
+min_batch_size = 1024
+
+
+def normalize(values, ascending):
+    """Returns (null, values), where null flags missing values (or is None when there are none), and
+    values is an array that can be sorted ascending to get the requested order.
+
+    Numerical and datetime values are transformed such that they sort in the requested order, for
+    other types (e.g. strings) this is not possible, and :func:`argsort` will rank them.
+    """
+    if np.ma.isMaskedArray(values):
+        null = np.ma.getmaskarray(values)
+        values = values.data
+    else:
+        values = np.asarray(values)
+        null = np.zeros(len(values), dtype=bool)
+    kind = values.dtype.kind
+    if kind in 'mM':
+        values = values.view(np.int64)
+        kind = 'i'
+    if kind == 'f':
+        null = null | np.isnan(values)
+    if null.any():
+        values = values.copy()
+        values[null] = np.zeros(1, dtype=values.dtype)[0]
+    else:
+        null = None
+    if not ascending:
+        if kind == 'f':
+            values = -values
+        elif kind in 'iub':
+            values = ~values  # reverses the order, and does not overflow like negation
+    return null, values
+
+
+def argsort(keys, ascending):
+    """Returns the indices that sort the (normalized) keys, the first key being the most significant.
+
+    :param keys: list of (null, values) tuples, as returned by :func:`normalize`
+    :param ascending: list of booleans, one for each key
+    """
+    lexkeys = []
+    for (null, values), asc in zip(keys[::-1], ascending[::-1]):
+        if not asc and values.dtype.kind not in 'fiub':
+            values = -np.unique(values, return_inverse=True)[1]
+        lexkeys.append(values)
+        if null is not None:
+            lexkeys.append(null)
+    if len(lexkeys) == 1:
+        return np.argsort(lexkeys[0], kind='mergesort')  # faster than lexsort, and also stable
+    return np.lexsort(lexkeys)
+
+
+def empty(length, dtype):
+    """Returns an array backed by a memory mapped temporary file (which is removed when no longer used)"""
+    return np.memmap(tempfile.TemporaryFile(prefix='vaex-sort-'), dtype=dtype, shape=(length,), mode='w+')
+
+
+def _spill(ar):
+    """Copies the array to a memory mapped temporary file"""
+    if ar is None or len(ar) == 0 or ar.dtype.hasobject:
+        return ar
+    mmap = empty(len(ar), ar.dtype)
+    mmap[:] = ar
+    return mmap
+
+
+class Run(object):
+    """A sorted run: normalized keys and the row numbers they originate from, in sorted order.
+
+    :param keys: list of (null, values) tuples, as returned by :func:`normalize`
+    :param rows: row numbers
+    :param bool spill: if True, write the run to disk (memory mapped temporary files)
+    :param bool sorted: if False, the run will be sorted
+    """
+    def __init__(self, keys, rows, ascending=None, spill=False, sorted=True):
+        if not sorted:
+            indices = argsort(keys, ascending)
+            keys = [(null[indices] if null is not None else None, values[indices]) for null, values in keys]
+            rows = rows[indices]
+        if spill:
+            keys = [(_spill(null), _spill(values)) for null, values in keys]
+            rows = _spill(rows)
+        self.keys = keys
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes + (null.nbytes if null is not None else 0) for null, values in self.keys) + self.rows.nbytes
+
+
+def merge(runs, ascending, batch_size=1024 * 1024, out=None):
+    """Merges sorted runs, and returns the row numbers in sorted order.
+
+    In each step, we take a batch from each run, and sort all of them. All rows up to (and including)
+    the smallest last row of the batches of the runs that have more rows, are in their final position,
+    since the rows that follow in any run cannot sort before it.
+
+    :param runs: list of :class:`Run` objects, for equal keys, rows from earlier runs come first
+    :param ascending: list of booleans, one for each key
+    :param batch_size: total number of rows to take from all runs in each step
+    :param out: optional int64 output array (e.g. memory mapped)
+    """
+    lengths = np.array([len(run) for run in runs], dtype=np.int64)
+    length = lengths.sum()
+    indices = np.empty(length, dtype=np.int64) if out is None else out
+    if len(runs) == 1:
+        indices[:] = runs[0].rows
+        return indices
+    batch_size = max(batch_size // max(len(runs), 1), min_batch_size)
+    offsets = np.zeros(len(runs), dtype=np.int64)
+    offset = 0
+    while offset < length:
+        active = np.flatnonzero(offsets < lengths)
+        starts = offsets[active]
+        ends = np.minimum(starts + batch_size, lengths[active])
+        sizes = ends - starts
+        keys = []
+        for i in range(len(ascending)):
+            values = np.concatenate([runs[k].keys[i][1][i1:i2] for k, i1, i2 in zip(active, starts, ends)])
+            if any(runs[k].keys[i][0] is not None for k in active):
+                null = np.concatenate([runs[k].keys[i][0][i1:i2] if runs[k].keys[i][0] is not None else np.zeros(i2 - i1, dtype=bool)
+                                       for k, i1, i2 in zip(active, starts, ends)])
+            else:
+                null = None
+            keys.append((null, values))
+        rows = np.concatenate([runs[k].rows[i1:i2] for k, i1, i2 in zip(active, starts, ends)])
+        order = argsort(keys, ascending)
+        remaining = ends < lengths[active]
+        if remaining.any():
+            position = np.empty_like(order)
+            position[order] = np.arange(len(order))
+            last = np.cumsum(sizes) - 1
+            order = order[:position[last[remaining]].min() + 1]
+        indices[offset:offset + len(order)] = rows[order]
+        offset += len(order)
+        run_index = np.repeat(np.arange(len(active)), sizes)
+        offsets[active] += np.bincount(run_index[order], minlength=len(active))
+    return indices
+
+
+def top(values, rows, n):
+    """Returns the indices of the n smallest (normalized, see :func:`normalize`) values, in sorted order, where for
+    equal values the lowest row comes first, like a stable sort would.
+
+    Unlike sorting all values, we only sort the values up to the n-th smallest value (found by partitioning).
+    """
+    if len(values) > n:
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64)
+        kth = np.partition(values, n - 1)[n - 1]
+        candidates = np.flatnonzero(values <= kth)  # includes all values equal to the n-th value
+    else:
+        candidates = np.arange(len(values))
+    order = np.lexsort([rows[candidates], values[candidates]])
+    return candidates[order[:n]]
@@ -3,6 +3,12 @@ import logging
 import numpy as np
 
 import vaex.promise
+import vaex.hash
+import vaex.cache
+import vaex.sketch
+import vaex.sort
+import vaex.execution
+import vaex.zonemaps
 
 
 from .utils import (_ensure_strings_from_expressions,
@@ -41,6 +47,7 @@ class Task(vaex.promise.Promise):
         self.signal_progress.connect(self._set_progress)
         self.cancelled = False
         self.name = name
+        self.row_start = 0  # the executor only passes over the rows from row_start on, see resume
 
     def _set_progress(self, fraction):
         self.progress_fraction = fraction
@@ -49,6 +56,28 @@ class Task(vaex.promise.Promise):
     def cancel(self):
         self.cancelled = True
 
+    def fingerprint(self):
+        """Returns a fingerprint of the arguments of the task (json serializable), such that the result can be
+        cached (see :mod:`vaex.cache`), or None when the task cannot be cached (the default)."""
+        return None
+
+    def partial(self):
+        """Returns the result over the rows processed so far while the task is executed (see
+        :func:`vaex.execution.partial_result`), or None when not supported (the default) or not executing."""
+        return None
+
+    resumable = False  # if True, the task implements merged_state and resume
+
+    def map_shared(self, shared, thread_index, i1, i2, *blocks):
+        """Called by the executor for each chunk, shared is a :class:`vaex.execution.SharedChunk` which holds values
+        that can be reused by all tasks that process this chunk. By default we simply call map."""
+        return self.map(thread_index, i1, i2, *blocks)
+
+    def map_metadata(self, shared, thread_index, i1, i2):
+        """Called by the executor for each chunk before the data is read, a task that can process the chunk using
+        metadata only (e.g. zone maps, see :mod:`vaex.zonemaps`) returns what map would return, otherwise None."""
+        return None
+
     @property
     def dimension(self):
         return len(self.expressions)
@@ -128,8 +157,9 @@ class TaskBase(Task):
 
 class TaskMapReduce(Task):
     def __init__(self, df, expressions, map, reduce, converter=lambda x: x, info=False, to_float=False,
-                 ordered_reduce=False, name="task"):
+                 ordered_reduce=False, name="task", fingerprint=None):
         Task.__init__(self, df, expressions, name=name)
+        self._fingerprint = fingerprint
         self._map = map
         self._reduce = reduce
         self.converter = converter
@@ -145,6 +175,11 @@ class TaskMapReduce(Task):
         else:
             return self._map(*blocks)  # [self.map(block) for block in blocks]
 
+    def fingerprint(self):
+        # map and reduce can be any function (and can have side effects), so only when a fingerprint is given
+        if self._fingerprint is not None:
+            return [self.__class__.__name__, self._fingerprint, [vaex.cache.normalize_expression(k) for k in self.expressions]]
+
     def reduce(self, results):
         if self.ordered_reduce:
             results.sort(key=lambda x: x[0])
@@ -227,6 +262,10 @@ class StatOp(object):
         else:
             return value
 
+    def merge(self, grid):
+        """Merges the grids of all threads into a single one, with the same layout (the first dimension has length 1)"""
+        return self.reduce(grid)[np.newaxis]
+
 
 class StatOpMinMax(StatOp):
     def __init__(self, code, fields):
@@ -280,6 +319,11 @@ class StatOpFirst(StatOp):
         # the value found, and the value by which it is ordered
         return 2
 
+    def merge(self, grid):
+        # unlike reduce, we keep the value by which it is ordered
+        indices = np.argmin(grid[..., 1], axis=0)
+        return np.take_along_axis(grid, indices[np.newaxis, ..., np.newaxis], axis=0)
+
 
 OP_ADD1 = StatOp(0, 1)
 OP_COUNT = StatOp(1, 1)
@@ -313,6 +357,7 @@ class TaskStatistic(Task):
         self.fields = op.fields(weights)
         self.shape_total = (self.df.executor.thread_pool.nthreads,) + (len(self.selections), ) + self.shape + (self.fields,)
         self.grid = np.zeros(self.shape_total, dtype=self.dtype)
+        self.grid_resumed = None
         self.op.init(self.grid)
         self.minima = []
         self.maxima = []
@@ -335,37 +380,76 @@ class TaskStatistic(Task):
         return "<%s(df=%r, expressions=%r, shape=%r, limits=%r, weights=%r, selections=%r, op=%r)> instance at 0x%x" % (name, self.df, self.expressions, self.shape, self.limits, self.weights, self.selections, self.op, id(self))
 
 
+    def fingerprint(self):
+        return [self.__class__.__name__, [vaex.cache.normalize_expression(k) for k in self.expressions_all],
+                self.shape, self.minima, self.maxima, self.op.code, self.edges, self.masked,
+                [str(selection) for selection in self.selections], self.selection_waslist]
+
     def map(self, thread_index, i1, i2, *blocks):
-        class Info(object):
-            pass
-        info = Info()
-        info.i1 = i1
-        info.i2 = i2
-        info.first = i1 == 0
-        info.last = i2 == self.df.length_unfiltered()
-        info.size = i2 - i1
+        return self.map_shared(vaex.execution.SharedChunk(self.df, i1, i2), thread_index, i1, i2, *blocks)
+
+    def map_metadata(self, shared, thread_index, i1, i2):
+        # chunks where the zone maps (if present) tell us that no row matches the selections can be skipped, and counts
+        # and minmax without binby can be computed from the zone maps
+        if not self.df._zone_maps:
+            return None
+        states = [shared.zone_state(selection) for selection in self.selections]
+        if self.df.filtered and vaex.zonemaps.SOME not in states:
+            # a pass over a filtered DataFrame caches the masks of the filter (see _filtered_range_to_unfiltered_indices)
+            # which is cheap when the zone maps tell us the state of all blocks
+            shared.selection_mask(None)
+        if all(state == vaex.zonemaps.NONE for state in states):
+            return i2 - i1
+        if vaex.zonemaps.SOME in states or self.expressions:
+            return None
+        zone_map = None
+        if self.weights:
+            if self.op not in [OP_COUNT, OP_MIN_MAX] or len(self.weights) != 1:
+                return None
+            zone_map = vaex.zonemaps.get(self.df, str(self.weights[0]))
+            if zone_map is None:
+                return None
+        elif self.op != OP_ADD1:
+            return None
+        statistics = None
+        if zone_map is not None and vaex.zonemaps.ALL in states:
+            offset = self.df._index_start
+            statistics = zone_map.statistics(offset + i1, offset + i2)
+            if statistics is None:  # the chunk is not aligned to the blocks
+                return None
+        this_thread_grid = self.grid[thread_index]
+        for i, state in enumerate(states):
+            if state == vaex.zonemaps.NONE:
+                continue
+            if zone_map is None:
+                this_thread_grid[i][0] += i2 - i1
+            elif self.op == OP_COUNT:
+                this_thread_grid[i][0] += statistics[0]
+            elif statistics[0]:
+                this_thread_grid[i][0] = min(this_thread_grid[i][0], statistics[1])
+                this_thread_grid[i][1] = max(this_thread_grid[i][1], statistics[2])
+        return i2 - i1
 
+    def _flat_blocks(self, blocks):
+        """Casts the blocks to a common dtype and removes missing values, returns the statistic function, blocks and mask"""
         masks = [np.ma.getmaskarray(block) for block in blocks if np.ma.isMaskedArray(block)]
         blocks = [block.data if np.ma.isMaskedArray(block) else block for block in blocks]
         mask = None
+        statistic_function = None
 
         #blocks = [as_flat_float(block) for block in blocks]
         if len(blocks) != 0:
             dtype = np.find_common_type([block.dtype for block in blocks], [])
-            histogram2d = vaex.vaexfast.histogram2d
             if dtype.str in ">f8 <f8 =f8":
                 statistic_function = vaex.vaexfast.statisticNd_f8
             elif dtype.str in ">f4 <f4 =f4":
                 statistic_function = vaex.vaexfast.statisticNd_f4
-                histogram2d = vaex.vaexfast.histogram2d_f4
             elif dtype.str in ">i8 <i8 =i8":
                 dtype = np.dtype(np.float64)
                 statistic_function = vaex.vaexfast.statisticNd_f8
             else:
                 dtype = np.dtype(np.float32)
                 statistic_function = vaex.vaexfast.statisticNd_f4
-                histogram2d = vaex.vaexfast.histogram2d_f4
-            #print(dtype, statistic_function, histogram2d)
 
         blocks = [as_flat_array(block, dtype) for block in blocks]
         if masks:
@@ -373,28 +457,42 @@ class TaskStatistic(Task):
             for other in masks[1:]:
                 mask |= other
             blocks = [block[~mask] for block in blocks]
+        return statistic_function, blocks, mask
+
+    def _selection_blocks(self, shared, blocks, mask, selection):
+        """Applies the selection (and filter) to the blocks, and makes sure they have the same byteorder"""
+        selection_mask = None
+        if selection or self.df.filtered:
+            selection_mask = shared.selection_mask(selection)
+            if selection_mask is None:
+                raise ValueError("performing operation on selection while no selection present")
+            if mask is not None:
+                selection_mask = selection_mask[~mask]
+            selection_blocks = [block[selection_mask] for block in blocks]
+        else:
+            selection_blocks = [block for block in blocks]
+        little_endians = len([k for k in selection_blocks if k.dtype.byteorder in ["<", "="]])
+        if not ((len(selection_blocks) == little_endians) or little_endians == 0):
+            def _to_native(ar):
+                if ar.dtype.byteorder not in ["<", "="]:
+                    dtype = ar.dtype.newbyteorder()
+                    return ar.astype(dtype)
+                else:
+                    return ar
+
+            selection_blocks = [_to_native(k) for k in selection_blocks]
+        return selection_mask, selection_blocks
+
+    def map_shared(self, shared, thread_index, i1, i2, *blocks):
+        # tasks with the same expressions (e.g. many histograms of the same columns, with different
+        # limits or ops) share the casting, masking and selecting of the blocks
+        key = tuple(self.expressions_all)
+        statistic_function, blocks, mask = shared.get(('statistic blocks', key), self._flat_blocks, blocks)
 
         this_thread_grid = self.grid[thread_index]
         for i, selection in enumerate(self.selections):
-            if selection or self.df.filtered:
-                selection_mask = self.df.evaluate_selection_mask(selection, i1=i1, i2=i2, cache=True)  # TODO
-                if selection_mask is None:
-                    raise ValueError("performing operation on selection while no selection present")
-                if mask is not None:
-                    selection_mask = selection_mask[~mask]
-                selection_blocks = [block[selection_mask] for block in blocks]
-            else:
-                selection_blocks = [block for block in blocks]
-            little_endians = len([k for k in selection_blocks if k.dtype.byteorder in ["<", "="]])
-            if not ((len(selection_blocks) == little_endians) or little_endians == 0):
-                def _to_native(ar):
-                    if ar.dtype.byteorder not in ["<", "="]:
-                        dtype = ar.dtype.newbyteorder()
-                        return ar.astype(dtype)
-                    else:
-                        return ar
-
-                selection_blocks = [_to_native(k) for k in selection_blocks]
+            selection_mask, selection_blocks = shared.get(('statistic selection blocks', key, type(selection), str(selection)),
+                                                          self._selection_blocks, shared, blocks, mask, selection)
             subblock_weight = None
             subblock_weights = selection_blocks[len(self.expressions):]
             selection_blocks = list(selection_blocks[:len(self.expressions)])
@@ -424,7 +522,641 @@ class TaskStatistic(Task):
         #   self.data[0] += self.data[i]
         # return self.data[0]
         # return self.data
-        grid = self.op.reduce(self.grid)
+        grid = self.op.reduce(self._grid_all())
         # If selection was a string, we just return the single selection
         return grid if self.selection_waslist else grid[0]
 
+    def partial(self):
+        # the grids of the threads are reduced while they may be updated, which is fine for a preview
+        if getattr(self, '_results', None) is None:
+            return None
+        return self.reduce(None)
+
+    # all ops can merge grids, so statistics can continue where an earlier pass (over fewer rows) stopped
+    resumable = True
+
+    def _grid_all(self):
+        return self.grid if self.grid_resumed is None else np.concatenate([self.grid_resumed, self.grid])
+
+    def resume(self, state, row_start):
+        """Continue from the state (see merged_state) of an earlier pass over the first row_start rows"""
+        self.grid_resumed = state
+        self.row_start = row_start
+
+    def merged_state(self):
+        """Returns the grids of all threads (and the resumed state) merged, which can be passed to resume"""
+        return self.op.merge(self._grid_all())
+
+
+
+def _valid_values(values):
+    """Returns the data and a boolean array indicating which values are not missing (masked or nan)"""
+    if np.ma.isMaskedArray(values):
+        valid = ~np.ma.getmaskarray(values)
+        values = values.data
+    else:
+        valid = np.ones(len(values), dtype=np.bool_)
+    if values.dtype.kind == 'f':
+        valid &= values == values
+    return values, valid
+
+
+class _Aggregator(object):
+    """Per thread aggregation state for :class:`TaskGroupby`, which keeps one value per group in each of its fields.
+
+    Subclasses define the fields (name, dtype and initial value), how a chunk of data updates the state (update),
+    how the state of other threads is merged (merge), and what the final value per group is (result).
+
+    :param dtype: dtype of the values that are aggregated, or None (e.g. for counting rows)
+    """
+    fields = []
+
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+        self.count = 0
+        for name, dtype, initial in self.fields:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+
+    def _ensure(self, count):
+        """Makes sure we have room for count groups"""
+        if count > self.count:
+            for name, dtype, initial in self.fields:
+                old = getattr(self, name)
+                if count > len(old):
+                    new = np.zeros(max(count, 2 * len(old)), dtype=old.dtype)
+                    new[:] = initial
+                    new[:len(old)] = old
+                    setattr(self, name, new)
+            self.count = count
+
+    def update(self, codes, count, values, rows):
+        raise NotImplementedError
+
+    def merge(self, other, mapping, count):
+        """Merges other into self, where mapping maps the group indices of other to self"""
+        self._ensure(count)
+        for name, dtype, initial in self.fields:
+            getattr(self, name)[mapping] += getattr(other, name)[:other.count]
+
+    def result(self, groups):
+        raise NotImplementedError
+
+
+class _AggregatorCount(_Aggregator):
+    fields = [('counts', np.int64, 0)]
+
+    def update(self, codes, count, values, rows):
+        self._ensure(count)
+        if values is not None:
+            values, valid = _valid_values(values)
+            codes = codes[valid]
+        self.counts[:count] += np.bincount(codes, minlength=count)
+
+    def result(self, groups):
+        return self.counts[groups]
+
+
+def _integer_dtype(dtype):
+    """Returns the (64 bit) dtype that integers (and booleans) of dtype are aggregated in, or None for other dtypes"""
+    kind = getattr(dtype, 'kind', None)
+    if kind in ['i', 'b']:
+        return np.dtype(np.int64)
+    elif kind == 'u':
+        return np.dtype(np.uint64)
+
+
+class _AggregatorSum(_Aggregator):
+    """Sums integers in 64 bit integers (like numpy), other values in floats"""
+    fields = [('counts', np.int64, 0), ('sums', np.float64, 0)]
+
+    def __init__(self, dtype=None):
+        self.integer_dtype = _integer_dtype(dtype)
+        if self.integer_dtype is not None:
+            self.fields = [('counts', np.int64, 0), ('sums', self.integer_dtype, 0)]
+        super(_AggregatorSum, self).__init__(dtype)
+
+    def update(self, codes, count, values, rows):
+        self._ensure(count)
+        values, valid = _valid_values(values)
+        codes = codes[valid]
+        self.counts[:count] += np.bincount(codes, minlength=count)
+        if self.integer_dtype is not None:  # bincount uses float weights, which loses precision above 2**53
+            np.add.at(self.sums, codes, values[valid].astype(self.integer_dtype))
+        else:
+            self.sums[:count] += np.bincount(codes, weights=values[valid], minlength=count)
+
+    def result(self, groups):
+        return self.sums[groups]
+
+
+class _AggregatorMean(_AggregatorSum):
+    def result(self, groups):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sums[groups] / self.counts[groups]
+
+
+class _AggregatorVar(_Aggregator):
+    fields = [('counts', np.int64, 0), ('sums', np.float64, 0), ('sums2', np.float64, 0)]
+
+    def update(self, codes, count, values, rows):
+        self._ensure(count)
+        values, valid = _valid_values(values)
+        codes = codes[valid]
+        values = values[valid].astype(np.float64)
+        self.counts[:count] += np.bincount(codes, minlength=count)
+        self.sums[:count] += np.bincount(codes, weights=values, minlength=count)
+        self.sums2[:count] += np.bincount(codes, weights=values**2, minlength=count)
+
+    def result(self, groups):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.sums[groups] / self.counts[groups]
+            return self.sums2[groups] / self.counts[groups] - mean**2
+
+
+class _AggregatorStd(_AggregatorVar):
+    def result(self, groups):
+        return np.sqrt(super(_AggregatorStd, self).result(groups))
+
+
+class _AggregatorMin(_Aggregator):
+    """Takes the minimum in the dtype of the values for integers, groups without values give a missing value"""
+    fields = [('counts', np.int64, 0), ('values', np.float64, np.inf)]
+    ufunc = np.fmin
+
+    def __init__(self, dtype=None):
+        integer_dtype = _integer_dtype(dtype)
+        if integer_dtype is not None:
+            dtype = np.dtype(dtype) if dtype.kind != 'b' else integer_dtype
+            info = np.iinfo(dtype)
+            self.fields = [('counts', np.int64, 0), ('values', dtype, info.max if self.ufunc is np.fmin else info.min)]
+        super(_AggregatorMin, self).__init__(dtype)
+
+    def update(self, codes, count, values, rows):
+        self._ensure(count)
+        values, valid = _valid_values(values)
+        codes = codes[valid]
+        self.counts[:count] += np.bincount(codes, minlength=count)
+        self.ufunc.at(self.values, codes, values[valid])
+
+    def merge(self, other, mapping, count):
+        self._ensure(count)
+        self.counts[mapping] += other.counts[:other.count]
+        self.values[mapping] = self.ufunc(self.values[mapping], other.values[:other.count])
+
+    def result(self, groups):
+        values = self.values[groups]
+        empty = self.counts[groups] == 0
+        if values.dtype.kind == 'f':
+            values[empty] = np.nan
+        elif empty.any():
+            values = np.ma.array(values, mask=empty)
+        return values
+
+
+class _AggregatorMax(_AggregatorMin):
+    fields = [('counts', np.int64, 0), ('values', np.float64, -np.inf)]
+    ufunc = np.fmax
+
+
+class _AggregatorFirst(_Aggregator):
+    """Takes the value of the first row (in row order) of each group, rows with a missing value are skipped"""
+    fields = [('rows', np.int64, np.iinfo(np.int64).max)]
+
+    def __init__(self, dtype=None):
+        super(_AggregatorFirst, self).__init__(dtype)
+        self.values = None
+
+    def _ensure(self, count):
+        super(_AggregatorFirst, self)._ensure(count)
+        if self.values is not None and len(self.values) < len(self.rows):
+            values = np.ma.masked_all(len(self.rows), dtype=self.values.dtype)
+            values[:len(self.values)] = self.values
+            self.values = values
+
+    def _set(self, groups, rows, values):
+        if self.values is None:
+            self.values = np.ma.masked_all(len(self.rows), dtype=values.dtype)
+            self._ensure(self.count)
+        better = rows < self.rows[groups]
+        self.rows[groups[better]] = rows[better]
+        self.values[groups[better]] = values[better]
+
+    def update(self, codes, count, values, rows):
+        self._ensure(count)
+        values, valid = _valid_values(values)
+        codes, values, rows = codes[valid], values[valid], rows[valid]
+        if len(codes) == 0:
+            return
+        # find the first row for each group, by writing in reverse, the first occurance is written last
+        first = np.full(count, -1, dtype=np.int64)
+        first[codes[::-1]] = np.arange(len(codes))[::-1]
+        groups = np.flatnonzero(first != -1)
+        first = first[groups]
+        self._set(groups, rows[first], values[first])
+
+    def merge(self, other, mapping, count):
+        self._ensure(count)
+        if other.values is not None:
+            self._set(mapping, other.rows[:other.count], other.values[:other.count])
+
+    def result(self, groups):
+        if self.values is None:
+            return np.ma.masked_all(len(groups))
+        values = self.values[groups]
+        return values if np.ma.is_masked(values) else values.data
+
+
+aggregators = dict(count=_AggregatorCount, sum=_AggregatorSum, mean=_AggregatorMean, var=_AggregatorVar,
+                   std=_AggregatorStd, min=_AggregatorMin, max=_AggregatorMax, first=_AggregatorFirst)
+
+
+class TaskGroupby(Task):
+    """Groups the rows by the values of the by expressions and calculates aggregations per group in a single pass.
+
+    Each thread builds its own :class:`vaex.hash.HashTable` that maps the keys to group indices, and updates
+    its own aggregation state. In the reduce step, the hash tables and aggregation states are merged.
+
+    :param by: list of expressions to group by
+    :param aggregations: list of (expression, aggregator name) tuples, where expression can be None for counting rows
+    :param selection: selection to apply (the filter is always applied)
+    :param sort: sort the groups by the key values
+    """
+    def __init__(self, df, by, aggregations, selection=None, sort=True):
+        Task.__init__(self, df, by, name="groupby")
+        self.by = by
+        self.aggregations = aggregations
+        self.selection = selection
+        self.sort = sort
+        for expression, name in self.aggregations:
+            if name not in aggregators:
+                raise ValueError("unknown aggregation %r, choose from %r" % (name, sorted(aggregators.keys())))
+            if expression is None and name != 'count':
+                raise ValueError("aggregation %r requires an expression" % name)
+            if expression is not None and expression not in self.expressions_all:
+                self.expressions_all.append(expression)
+        nthreads = self.df.executor.thread_pool.nthreads
+        self.tables = [vaex.hash.HashTable() for i in range(nthreads)]
+        dtypes = [self.df.dtype(expression) if expression is not None else None for expression, name in self.aggregations]
+        self.aggregators = [[aggregators[name](dtype) for dtype, (expression, name) in zip(dtypes, self.aggregations)]
+                            for i in range(nthreads)]
+
+    def __repr__(self):
+        name = self.__class__.__module__ + "." + self.__class__.__name__
+        return "<%s(df=%r, by=%r, aggregations=%r, selection=%r)> instance at 0x%x" % (name, self.df, self.by, self.aggregations, self.selection, id(self))
+
+    def map(self, thread_index, i1, i2, *blocks):
+        blocks = dict(zip(self.expressions_all, blocks))
+        rows = np.arange(i1, i2)
+        if self.selection or self.df.filtered:
+            selection_mask = self.df.evaluate_selection_mask(self.selection, i1=i1, i2=i2, cache=True)
+            if selection_mask is None:
+                raise ValueError("performing operation on selection while no selection present")
+            blocks = {expression: block[selection_mask] for expression, block in blocks.items()}
+            rows = rows[selection_mask]
+        table = self.tables[thread_index]
+        codes = table.update([blocks[expression] for expression in self.by])
+        for aggregator, (expression, name) in zip(self.aggregators[thread_index], self.aggregations):
+            aggregator.update(codes, len(table), blocks.get(expression), rows)
+        return i2 - i1
+
+    def reduce(self, results):
+        table = self.tables[0]
+        aggregators = self.aggregators[0]
+        for other_table, other_aggregators in zip(self.tables[1:], self.aggregators[1:]):
+            mapping = table.merge(other_table)
+            for aggregator, other in zip(aggregators, other_aggregators):
+                aggregator.merge(other, mapping, len(table))
+        for aggregator in aggregators:
+            aggregator._ensure(len(table))
+        keys = table.keys()
+        if len(keys) == 0:  # no rows, but we still want the proper number of keys
+            keys = [np.zeros(0)] * len(self.by)
+        groups = np.arange(len(table))
+        if self.sort and len(table):
+            # lexsort uses the last key as primary key, and we put missing values last
+            sort_keys = []
+            for key in keys[::-1]:
+                sort_keys.append(key.data if np.ma.isMaskedArray(key) else key)
+                sort_keys.append(np.ma.getmaskarray(key))
+            groups = np.lexsort(sort_keys)
+            keys = [key[groups] for key in keys]
+        values = [aggregator.result(groups) for aggregator in aggregators]
+        return keys, values
+
+
+class TaskHashIndex(Task):
+    """Builds a :class:`vaex.hash.HashIndex`, mapping the keys (given by expressions) to their row number.
+
+    All rows in the active range are used (the filter is ignored), rows with missing keys are skipped.
+    """
+    def __init__(self, df, expressions):
+        Task.__init__(self, df, expressions, name="hash index")
+        nthreads = self.df.executor.thread_pool.nthreads
+        self.tables = [vaex.hash.HashTable() for i in range(nthreads)]
+        self.rows = [np.zeros(0, dtype=np.int64) for i in range(nthreads)]
+        self.counts = [np.zeros(0, dtype=np.int64) for i in range(nthreads)]
+
+    def _update(self, thread_index, codes, rows, counts):
+        """Keeps the lowest row number for each group, and adds the counts"""
+        count = len(self.tables[thread_index])
+        if len(self.rows[thread_index]) < count:
+            self.rows[thread_index] = np.concatenate([self.rows[thread_index],
+                                                      np.full(count - len(self.rows[thread_index]), np.iinfo(np.int64).max, dtype=np.int64)])
+            self.counts[thread_index] = np.concatenate([self.counts[thread_index],
+                                                        np.zeros(count - len(self.counts[thread_index]), dtype=np.int64)])
+        self.rows[thread_index][codes] = np.minimum(self.rows[thread_index][codes], rows)
+        self.counts[thread_index][codes] += counts
+
+    def map(self, thread_index, i1, i2, *blocks):
+        datas, nulls = vaex.hash.split_masks(blocks)
+        null = reduce(np.logical_or, nulls)
+        rows = np.arange(i1, i2)
+        if null.any():
+            blocks = [block[~null] for block in datas]
+            rows = rows[~null]
+        table = self.tables[thread_index]
+        codes = table.update(blocks)
+        # by writing in reverse, the first occurrence of each group is written last
+        first = np.full(len(table), -1, dtype=np.int64)
+        first[codes[::-1]] = np.arange(len(codes))[::-1]
+        groups = np.flatnonzero(first != -1)
+        self._update(thread_index, groups, rows[first[groups]], np.bincount(codes, minlength=len(table))[groups])
+        return i2 - i1
+
+    def reduce(self, results):
+        table = self.tables[0]
+        self._update(0, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 0)
+        for thread_index in range(1, len(self.tables)):
+            mapping = table.merge(self.tables[thread_index])
+            self._update(0, mapping, self.rows[thread_index][:len(mapping)], self.counts[thread_index][:len(mapping)])
+        return vaex.hash.HashIndex(table, self.rows[0][:len(table)], self.counts[0][:len(table)])
+
+
+class TaskValueCounts(Task):
+    """Finds the distinct values of an expression, and how often they occur, in a single pass.
+
+    Each thread builds its own :class:`vaex.hash.HashTable` with a count per value, which are merged in the reduce
+    step, so memory usage scales with the number of distinct values, not with the number of rows. Missing values
+    and NaN's are counted as values of their own. The reduce step returns the values (a masked array when missing
+    values are present) in sorted order and their counts, and when return_inverse is True, also for each row in
+    the active range the index into the values (or -1 for rows that are filtered out or not selected).
+
+    :param expression: expression to find the distinct values of
+    :param selection: selection to apply (the filter is always applied)
+    :param bool return_inverse: also return the index into the values for each row
+    """
+    def __init__(self, df, expression, selection=None, return_inverse=False):
+        Task.__init__(self, df, [expression], name="value counts")
+        self.selection = selection
+        self.return_inverse = return_inverse
+        nthreads = self.df.executor.thread_pool.nthreads
+        self.tables = [vaex.hash.HashTable() for i in range(nthreads)]
+        self.counts = [np.zeros(0, dtype=np.int64) for i in range(nthreads)]
+        self.codes = []  # (i1, thread_index, codes) for each chunk, when return_inverse is True
+
+    def fingerprint(self):
+        return [self.__class__.__name__, vaex.cache.normalize_expression(self.expressions[0]), str(self.selection), self.return_inverse]
+
+    def map(self, thread_index, i1, i2, block):
+        selection_mask = None
+        if self.selection or self.df.filtered:
+            selection_mask = self.df.evaluate_selection_mask(self.selection, i1=i1, i2=i2, cache=True)
+            if selection_mask is None:
+                raise ValueError("performing operation on selection while no selection present")
+            block = block[selection_mask]
+        table = self.tables[thread_index]
+        codes = table.update([block])
+        counts = np.bincount(codes, minlength=len(table))
+        counts[:len(self.counts[thread_index])] += self.counts[thread_index]
+        self.counts[thread_index] = counts
+        if self.return_inverse:
+            if selection_mask is not None:
+                all_codes = np.full(i2 - i1, -1, dtype=np.int64)
+                all_codes[selection_mask] = codes
+                codes = all_codes
+            self.codes.append((i1, thread_index, codes))
+        return i2 - i1
+
+    def reduce(self, results):
+        table = self.tables[0]
+        counts = np.zeros(0, dtype=np.int64)
+        mappings = []
+        for thread_index in range(len(self.tables)):
+            if thread_index == 0:
+                mapping = np.arange(len(table), dtype=np.int64)
+            else:
+                mapping = table.merge(self.tables[thread_index])
+            mappings.append(mapping)
+            if len(counts) < len(table):
+                counts = np.concatenate([counts, np.zeros(len(table) - len(counts), dtype=np.int64)])
+            np.add.at(counts, mapping, self.counts[thread_index][:len(mapping)])
+        keys = table.keys()
+        values = keys[0] if keys else np.zeros(0)
+        # sort by value, with the missing values last, like np.unique does
+        try:
+            order = np.lexsort([values.data if np.ma.isMaskedArray(values) else values, np.ma.getmaskarray(values)])
+        except TypeError:  # e.g. objects that cannot be compared, like None and str
+            order = np.arange(len(values))
+        values, counts = values[order], counts[order]
+        if not self.return_inverse:
+            return values, counts
+        # maps the index of each thread's table to the sorted index, with -1 (not used) staying -1
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        inverse = np.full(self.df.active_length(), -1, dtype=np.int64)
+        for i1, thread_index, codes in self.codes:
+            used = codes != -1
+            part = inverse[i1:i1 + len(codes)]
+            part[used] = rank[mappings[thread_index][codes[used]]]
+        return values, counts, inverse
+
+
+class TaskSort(Task):
+    """Sorts the rows by the keys (given by expressions), returning the row numbers in sorted order.
+
+    Each chunk is sorted in its own thread, and when there is more than one chunk, they are
+    written to disk as sorted runs (see :mod:`vaex.sort`), which are merged in the reduce step.
+    All rows in the active range are used (the filter is ignored), unless filtered is True.
+
+    :param selection: only sort the rows of this selection (and the filter)
+    :param bool filtered: only sort the rows that pass the filter (and the selection)
+    """
+    def __init__(self, df, expressions, ascending, selection=None, filtered=False):
+        Task.__init__(self, df, expressions, name="sort")
+        self.ascending = ascending
+        self.selection = selection
+        self.filtered = filtered or bool(selection)
+        self.length = self.df.active_length()
+        self.runs = []
+
+    def map(self, thread_index, i1, i2, *blocks):
+        rows = np.arange(i1, i2)
+        if self.selection or (self.filtered and self.df.filtered):
+            selection_mask = self.df.evaluate_selection_mask(self.selection or None, i1=i1, i2=i2, cache=True)
+            if selection_mask is None:
+                raise ValueError("performing operation on selection while no selection present")
+            blocks = [block[selection_mask] for block in blocks]
+            rows = rows[selection_mask]
+        keys = [vaex.sort.normalize(block, ascending) for block, ascending in zip(blocks, self.ascending)]
+        spill = (i2 - i1) < self.length
+        self.runs.append((i1, vaex.sort.Run(keys, rows, self.ascending, spill=spill, sorted=False)))
+        return i2 - i1
+
+    def reduce(self, results):
+        runs = [run for i1, run in sorted(self.runs, key=lambda item: item[0])]
+        logger.debug("merging %d sorted runs", len(runs))
+        if len(runs) > 1:
+            out = vaex.sort.empty(sum(len(run) for run in runs), np.int64)
+        else:
+            out = None
+        return vaex.sort.merge(runs, self.ascending, batch_size=self.df.executor.buffer_size, out=out)
+
+
+def _bin_indices(length, blocks, minima, maxima, shape):
+    """Returns the flat index into a grid of the given shape for each of the length rows, or -1 when the row falls
+    outside the limits (the limits are [min, max), like in :class:`TaskStatistic`), or has a missing value"""
+    indices = np.zeros(length, dtype=np.int64)
+    outside = np.zeros(length, dtype=bool)
+    for block, vmin, vmax, length in zip(blocks, minima, maxima, shape):
+        values, valid = _valid_values(block)
+        with np.errstate(invalid='ignore'):
+            scaled = (values - vmin) / (vmax - vmin)
+            outside |= ~valid | ~((scaled >= 0) & (scaled < 1))
+        indices = indices * length + np.clip((scaled * length).astype(np.int64), 0, length - 1)
+    indices[outside] = -1
+    return indices
+
+
+class TaskQuantile(Task):
+    """Calculates quantiles using a :class:`vaex.sketch.KLL` sketch per bin, possibly on a grid defined by binby.
+
+    Each thread updates its own sketches, which are merged in the reduce step, so this only needs a single pass
+    over the data, and does not need the limits of the values (like :meth:`DataFrame.percentile_approx` does).
+
+    :param expression: expression to calculate the quantiles for
+    :param binby: list of expressions to bin by
+    :param shape: shape of the grid
+    :param limits: limits of the grid, one [min, max] for each binby expression
+    :param quantiles: list of quantiles (between 0 and 1)
+    :param int k: size of the sketches, see :class:`vaex.sketch.KLL`
+    :param selection: selection to apply (the filter is always applied)
+    """
+    def __init__(self, df, expression, binby, shape, limits, quantiles, k=256, selection=None):
+        Task.__init__(self, df, [expression] + list(binby), name="quantile")
+        self.expression = expression
+        self.binby = binby
+        self.shape = _expand_shape(shape, len(binby))
+        self.limits = limits
+        limits = np.array(limits, dtype=np.float64).reshape(len(binby), 2)  # also for the short notation [xmin, xmax]
+        self.minima = limits[:, 0].tolist()
+        self.maxima = limits[:, 1].tolist()
+        self.quantiles = quantiles
+        self.k = k
+        self.selection = selection
+        nthreads = self.df.executor.thread_pool.nthreads
+        self.sketches = [{} for i in range(nthreads)]  # per thread, a dict mapping the flat bin index to a sketch
+
+    def __repr__(self):
+        name = self.__class__.__module__ + "." + self.__class__.__name__
+        return "<%s(df=%r, expression=%r, binby=%r, shape=%r, limits=%r, quantiles=%r, selection=%r)> instance at 0x%x" %\
+            (name, self.df, self.expression, self.binby, self.shape, self.limits, self.quantiles, self.selection, id(self))
+
+    def fingerprint(self):
+        return [self.__class__.__name__, [vaex.cache.normalize_expression(k) for k in self.expressions_all],
+                self.shape, self.minima, self.maxima, list(self.quantiles), self.k, str(self.selection)]
+
+    def map(self, thread_index, i1, i2, block, *binby_blocks):
+        if self.selection or self.df.filtered:
+            selection_mask = self.df.evaluate_selection_mask(self.selection, i1=i1, i2=i2, cache=True)
+            if selection_mask is None:
+                raise ValueError("performing operation on selection while no selection present")
+            block = block[selection_mask]
+            binby_blocks = [binby_block[selection_mask] for binby_block in binby_blocks]
+        values, valid = _valid_values(block)
+        indices = _bin_indices(len(values), binby_blocks, self.minima, self.maxima, self.shape)
+        valid &= indices != -1
+        values, indices = values[valid], indices[valid]
+        sketches = self.sketches[thread_index]
+        if len(self.binby) == 0:
+            bins, starts = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+        else:
+            order = np.argsort(indices, kind='mergesort')
+            values, indices = values[order], indices[order]
+            bins, starts = np.unique(indices, return_index=True)
+        ends = np.append(starts[1:], len(values))
+        for index, start, end in zip(bins, starts, ends):
+            if index not in sketches:
+                sketches[index] = vaex.sketch.KLL(self.k, seed=index)
+            sketches[index].update(values[start:end])
+        return i2 - i1
+
+    def reduce(self, results):
+        sketches = self.sketches[0]
+        for other in self.sketches[1:]:
+            for index, sketch in other.items():
+                if index in sketches:
+                    sketches[index].merge(sketch)
+                else:
+                    sketches[index] = sketch
+        grid = np.full((int(np.prod(self.shape)), len(self.quantiles)), np.nan)
+        for index, sketch in sketches.items():
+            grid[index] = sketch.quantile(self.quantiles)
+        return grid.reshape(self.shape + (len(self.quantiles),))
+
+
+class TaskTopK(Task):
+    """Finds the rows with the n smallest (or largest) values, in sorted order. For equal values, the lowest
+    rows comes first. Rows with missing values are skipped.
+
+    Each thread keeps the n best values (and rows) it has seen so far, which are merged in the reduce step.
+
+    :param expression: expression to find the smallest (or largest) values for
+    :param int n: number of rows
+    :param bool largest: find the largest values instead of the smallest
+    :param selection: selection to apply (the filter is always applied)
+    """
+    def __init__(self, df, expression, n, largest=False, selection=None):
+        Task.__init__(self, df, [expression], name="top k")
+        self.n = n
+        self.largest = largest
+        self.selection = selection
+        nthreads = self.df.executor.thread_pool.nthreads
+        self.keys = [None] * nthreads  # normalized values, see vaex.sort.normalize
+        self.values = [None] * nthreads
+        self.rows = [None] * nthreads
+
+    def fingerprint(self):
+        return [self.__class__.__name__, vaex.cache.normalize_expression(self.expressions[0]), self.n, self.largest, str(self.selection)]
+
+    def _keep(self, thread_index, keys, values, rows):
+        if self.keys[thread_index] is not None:
+            keys = np.concatenate([self.keys[thread_index], keys])
+            values = np.concatenate([self.values[thread_index], values])
+            rows = np.concatenate([self.rows[thread_index], rows])
+        indices = vaex.sort.top(keys, rows, self.n)
+        self.keys[thread_index], self.values[thread_index], self.rows[thread_index] = keys[indices], values[indices], rows[indices]
+
+    def map(self, thread_index, i1, i2, block):
+        rows = np.arange(i1, i2)
+        if self.selection or self.df.filtered:
+            selection_mask = self.df.evaluate_selection_mask(self.selection, i1=i1, i2=i2, cache=True)
+            if selection_mask is None:
+                raise ValueError("performing operation on selection while no selection present")
+            block = block[selection_mask]
+            rows = rows[selection_mask]
+        if np.asarray(block).dtype.kind not in 'biufmM':
+            raise ValueError("can only find the smallest or largest values for numerical or datetime values, not %s" % block.dtype)
+        null, keys = vaex.sort.normalize(block, ascending=not self.largest)
+        values = block.data if np.ma.isMaskedArray(block) else block
+        if null is not None:
+            keys, values, rows = keys[~null], values[~null], rows[~null]
+        self._keep(thread_index, keys, values, rows)
+        return i2 - i1
+
+    def reduce(self, results):
+        for thread_index in range(1, len(self.keys)):
+            if self.keys[thread_index] is not None:
+                self._keep(0, self.keys[thread_index], self.values[thread_index], self.rows[thread_index])
+        if self.keys[0] is None:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        return self.values[0], self.rows[0]
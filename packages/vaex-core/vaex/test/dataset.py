@@ -451,8 +451,8 @@ class TestDataset(unittest.TestCase):
 		self.assertEqual(ds.sum('x*z'), np.sum(x*y))
 		self.assertEqual(ds.sum('x*y'), np.sum(x[indices]*z))
 		self.assertEqual(ds.sum('x*y'), np.sum(x[indices]*z))
-		self.assertFalse(np.ma.isMaskedArray(ds.data.i))
-		self.assertFalse(np.ma.isMaskedArray(ds.data.names))
+		self.assertFalse(np.ma.isMaskedArray(ds.evaluate('i')))
+		self.assertFalse(np.ma.isMaskedArray(ds.evaluate('names')))
 
 		# test with incomplete data
 		ds = vaex.from_arrays(x=x, y=y)
@@ -460,8 +460,9 @@ class TestDataset(unittest.TestCase):
 		ds._join('x', ds2, 'x', column_names=['z', 'i', 'names'])
 		self.assertEqual(ds.sum('x*y'), np.sum(x*y))
 		self.assertEqual(ds.sum('x*z'), np.sum(x[indices][:4]*y[indices][:4]))
-		self.assertTrue(np.ma.isMaskedArray(ds.data.i))
-		self.assertTrue(np.ma.isMaskedArray(ds.data.names))
+		self.assertTrue(np.ma.isMaskedArray(ds.evaluate('i')))
+		self.assertTrue(np.ma.isMaskedArray(ds.evaluate('names')))
+		self.assertTrue(np.ma.isMaskedArray(ds.evaluate('z')))  # also floats are masked, not NaN
 
 		# test with incomplete data, but other way around
 		ds = vaex.from_arrays(x=x[:4], y=y[:4])
@@ -469,8 +470,14 @@ class TestDataset(unittest.TestCase):
 		ds._join('x', ds2, 'x', column_names=['z', 'i', 'names'])
 		self.assertEqual(ds.sum('x*y'), np.sum(x[:4]*y[:4]))
 		self.assertEqual(ds.sum('x*z'), np.sum(x[:4]*y[:4]))
-		self.assertFalse(np.ma.isMaskedArray(ds.data.i))
-		self.assertFalse(np.ma.isMaskedArray(ds.data.names))
+		self.assertFalse(np.ma.isMaskedArray(ds.evaluate('i')))
+		self.assertFalse(np.ma.isMaskedArray(ds.evaluate('names')))
+
+		# only many to one joins are supported
+		ds = vaex.from_arrays(x=x, y=y)
+		ds2 = vaex.from_arrays(x=np.array([1., 1.]), w=np.array([2., 3.]))
+		with self.assertRaises(ValueError):
+			ds._join('x', ds2, 'x', column_names=['w'])
 
 
 	def test_healpix_count(self):
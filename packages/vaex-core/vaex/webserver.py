@@ -21,8 +21,11 @@ import numpy as np
 import vaex.events
 import collections
 import concurrent.futures
+import vaex.cache
 import vaex.execution
 import vaex.multithreading
+import vaex.promise
+import vaex.protocol
 import tornado.escape
 from cachetools import Cache, LRUCache
 import sys
@@ -136,6 +139,107 @@ class JobExecutor(object):
                 return
 
 
+class PassBatcher(object):
+    """Coalesces the requests for a dataset that arrive at about the same time into a single pass over the data.
+
+    Requests schedule their tasks on the (shared) executor of the batcher (using delay=True), and pass the promise
+    of the result to :meth:`submit`. The first request of a batch opens an admission window, which is extended by
+    each request that arrives, up to the latency cap. After that, all tasks scheduled so far are executed, and the
+    tasks of the copies of a dataset (one per request) share a pass over the data. When that pass fails (e.g. due to
+    an expression of one of the requests), the requests are executed one by one, such that only the failing
+    request gets the error.
+
+    :param executor: executor on which the requests schedule their tasks
+    :param float window: seconds to wait for more requests after the last one arrived
+    :param float latency: maximum number of seconds a request waits before its pass starts
+    """
+    def __init__(self, executor, window=0.005, latency=0.05):
+        self.executor = executor
+        self.window = window
+        self.latency = latency
+        self.condition = threading.Condition()
+        self.batch = []  # (promise, progress, retry) for each request in the batch
+        self.time_first = self.time_last = None
+        self.passes = 0  # the number of batches executed
+        self.thread = threading.Thread(target=self._run, name="vaex-pass-batcher")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def submit(self, promise, progress=None, retry=None):
+        """Adds the request (of which the tasks are scheduled) to the current batch, returns a promise for the result
+
+        :param retry: function that schedules the tasks of the request again on the executor passed to it, and returns
+            the promise of the result, used to execute the request on its own when the pass of the batch fails
+        """
+        result = vaex.promise.Promise()
+        promise.then(result.fulfill, result.reject)
+        with self.condition:
+            self.time_last = time.time()
+            if self.time_first is None:
+                self.time_first = self.time_last
+            self.batch.append((result, progress or (lambda fraction: True), retry))
+            self.condition.notify()
+        return result
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.time_first is None:
+                    self.condition.wait()
+                while True:
+                    deadline = min(self.time_last + self.window, self.time_first + self.latency)
+                    if time.time() >= deadline:
+                        break
+                    self.condition.wait(deadline - time.time())
+                batch = self.batch
+                self.batch = []
+                self.time_first = self.time_last = None
+            self._execute(batch)
+
+    def _execute(self, batch):
+        logger.debug("executing a batch of %d requests", len(batch))
+        self.passes += 1
+
+        cancelled = [False]
+
+        def progress(fraction):
+            # the pass is only cancelled when all requests are (e.g. all clients cancelled them)
+            if not any([callback(fraction) for promise, callback, retry in batch]):
+                cancelled[0] = True
+                return False
+            return True
+        callback = self.executor.signal_progress.connect(progress)
+        try:
+            self.executor.execute()
+            error = vaex.execution.UserAbort("cancelled") if cancelled[0] else None
+        except Exception as e:
+            logger.exception("error executing batch")
+            error = e
+        finally:
+            self.executor.signal_progress.disconnect(callback)
+        if error is not None:
+            # the tasks in the queue are dropped, so the requests would wait forever
+            for promise, callback, retry in batch:
+                if promise.isPending:
+                    if retry is None or cancelled[0]:
+                        promise.reject(error)
+                    else:
+                        self._retry(promise, callback, retry)
+
+    def _retry(self, promise, progress, retry):
+        """Executes a request of a failed batch on its own, using a new executor (which shares the thread pool)"""
+        executor = vaex.execution.Executor(thread_pool=self.executor.thread_pool, buffer_size=self.executor.buffer_size)
+        executor.signal_progress.connect(progress)
+        try:
+            retry(executor).then(promise.fulfill, promise.reject)
+            executor.execute()
+        except Exception as e:
+            logger.exception("error executing request")
+            promise.reject(e)
+        if promise.isPending:
+            promise.reject(vaex.execution.UserAbort("cancelled"))
+
+
 class GoogleOAuth2LoginHandler(tornado.web.RequestHandler,
                                tornado.auth.GoogleOAuth2Mixin):
     @tornado.gen.coroutine
@@ -205,7 +309,13 @@ class ListHandler(tornado.web.RequestHandler):
         # logger.debug("response is: %r", response)
         if response is None:
             response = self.error("unknown request or error")
-        if isinstance(response, (np.ndarray, float)):
+        if vaex.protocol.content_type in self.request.headers.get("Accept", ""):
+            # the binary protocol, the response is compressed by tornado (see compress_response)
+            if not isinstance(response, dict):
+                response = dict(result=response)
+            self.set_header("Content-Type", vaex.protocol.content_type)
+            self.write(vaex.protocol.encode(response))
+        elif isinstance(response, (np.ndarray, float)):
             response = np.array(response)
             self.set_header("Content-Type", "application/numpy-array")
             self.write(str(response.shape) + "\n")
@@ -229,15 +339,40 @@ class ProgressWebSocket(tornado.websocket.WebSocketHandler):
 
     def open(self):
         logger.debug("WebSocket opened")
+        self.jobs = set()  # the job ids of the requests that are being handled
+        self.cancelled = set()  # the job ids of the requests the client is no longer interested in
 
-    @tornado.gen.coroutine
     def on_message(self, message):
+        # tornado does not read the next message until a coroutine on_message is done, we handle them
+        # concurrently, such that the requests of a client can share a pass over the data (see PassBatcher)
+        tornado.ioloop.IOLoop.current().spawn_callback(self.handle_message, message)
+
+    @tornado.gen.coroutine
+    def handle_message(self, message):
         logger.debug("websocket message: %r", message)
         arguments = json.loads(message)
+        if "cancel" in arguments:
+            if arguments["cancel"] in self.jobs:  # cancels of unknown (e.g. finished) jobs are ignored
+                self.cancelled.add(arguments["cancel"])
+            return
+        job_id = arguments.pop("job_id")
+        self.jobs.add(job_id)
+        try:
+            yield self.handle_job(job_id, arguments)
+        finally:
+            self.jobs.discard(job_id)
+            self.cancelled.discard(job_id)
+
+    @tornado.gen.coroutine
+    def handle_job(self, job_id, arguments):
         path = arguments["path"]
         arguments.pop("path")
         user_id = arguments.pop("user_id", None)
-        job_id = arguments.pop("job_id")
+        # clients that support the binary protocol send the version and compressions they support
+        protocol = vaex.protocol.negotiate(arguments.pop("protocol", None))
+        # clients can ask for partial results, at an interval (fraction of the pass over the data)
+        partial_interval = arguments.pop("partial", None)
+        io_loop = tornado.ioloop.IOLoop.current()  # progress and partial are called from other threads
 
         if False:  # disable user_id for the moment
             user_id = self.get_cookie("user_id")
@@ -252,27 +387,54 @@ class ProgressWebSocket(tornado.websocket.WebSocketHandler):
             def do():
                 logger.debug("progress: %r", f)
                 last_progress[0] = f
-                self.write_json(job_id=job_id, job_phase="PENDING", progress=f)
+                if protocol[0]:
+                    self.write_message(vaex.protocol.encode(dict(job_id=job_id, job_phase="PENDING", progress=f)), binary=True)
+                else:
+                    self.write_json(job_id=job_id, job_phase="PENDING", progress=f)
             if last_progress[0] is None or (f - last_progress[0]) > 0.05 or f == 1.0:
-                tornado.ioloop.IOLoop.current().add_callback(do)
-            return True
+                io_loop.add_callback(do)
+            return job_id not in self.cancelled
+
+        partial = None
+        if partial_interval and protocol[0]:
+            def partial(result):
+                frame = vaex.protocol.encode(dict(job_id=job_id, job_phase="PARTIAL", result=result), protocol[1])
+
+                @tornado.gen.coroutine
+                def do():
+                    for chunk in vaex.protocol.split(frame):
+                        yield self.write_message(chunk, binary=True)
+                if job_id not in self.cancelled:
+                    io_loop.add_callback(do)
         key = (path, "-".join([str(v) for v in sorted(arguments.items())]))
         response = self.cache.get(key)
         progress(0)
         if response is None:
             # response = yield self.submit_threaded(process, self.webserver, user_id, self.request.path, **arguments)
             response = yield self.submit_threaded(process, self.webserver, user_id, path, progress=progress,
-                                                  **arguments)
+                                                  partial=partial, partial_interval=partial_interval or 0.1, **arguments)
             try:
                 self.cache[key] = response
                 pass
             except ValueError:
                 pass  # raised when it doesn't fit in cache
         progress(1)
+        if job_id in self.cancelled:
+            return
 
         if response is None:
             response = self.error("unknown request or error")
 
+        if protocol[0]:
+            if not isinstance(response, dict):
+                response = dict(result=response)
+            meta_data = dict(job_id=job_id, job_phase=_job_phase(response))
+            meta_data.update(response)
+            # large results are sent in chunks, such that the results of other jobs can be sent in between
+            for frame in vaex.protocol.split(vaex.protocol.encode(meta_data, protocol[1])):
+                yield self.write_message(frame, binary=True)
+            return
+
         meta_data = dict(job_id=job_id)
         if isinstance(response, (np.ndarray, float)):
             response = np.array(response)
@@ -313,6 +475,10 @@ class QueueHandler(tornado.web.RequestHandler):
     def initialize(self, datasets):
         self.datasets = datasets
         self.datasets_map = dict([(ds.name, ds) for ds in self.datasets])
+        if self.selection_mask_cache is not None:
+            for ds in self.datasets:
+                if ds._selection_mask_cache is None or ds._selection_mask_cache[0] is not self.selection_mask_cache:
+                    self.selection_mask_cache.attach(ds)
 
     def get(self):
         # self.write("Hello, world")
@@ -324,11 +490,68 @@ def exception(exception):
     return ({"exception": {"class": str(exception.__class__.__name__), "msg": str(exception)}})
 
 
+def _job_phase(response):
+    if "exception" in response:
+        return "EXCEPTION"
+    elif "error" in response:
+        return "ERROR"
+    else:
+        return "COMPLETED"
+
+
 def error(msg):
     return ({"error": msg})  # , "result":None})
 
 
-def process(webserver, user_id, path, fraction=None, progress=None, **arguments):
+# methods of which the tasks are executed by a PassBatcher, those of the dataset and those of a subspace
+batched_methods = "count cov correlation covariance mean std minmax min max sum var".split()
+batched_methods_subspace = "minmax mean sum histogram".split()
+
+
+def _tolist_result(values):
+    return {"result": values.tolist() if hasattr(values, "tolist") else values}
+
+
+def _partial_progress(progress, partial, partial_interval, dataset, tasks, call):
+    """Returns a progress callback that also calls partial with the partial result of the calculation (see
+    vaex.execution.partial_result) after each partial_interval of the pass over the data"""
+    last = [0]
+
+    def wrapped(fraction):
+        if 0 < fraction < 1 and fraction - last[0] >= partial_interval:
+            last[0] = fraction
+            result = vaex.execution.partial_result(dataset, tasks, call)
+            if result is not None:
+                partial(result)
+        return progress(fraction)
+    return wrapped
+
+
+def _batched(webserver, dataset_original, progress, promise, post_process=lambda x: x, retry=None):
+    """Returns a promise for the response of a request, for which the tasks are scheduled on the executor of the
+    PassBatcher of the dataset, see :meth:`PassBatcher.submit` for retry"""
+    promise = webserver.batcher(dataset_original).submit(promise, progress, retry)
+    return promise.then(post_process).then(None, exception)
+
+
+def _retry(dataset, subspace, method_name, arguments):
+    """Returns a function that schedules the tasks of a batched request on the executor passed to it"""
+    def retry(executor):
+        dataset.executor = executor
+        if subspace is None:
+            return task_invoke(dataset, method_name, delay=True, **arguments)
+        subspace.executor = executor
+        return task_invoke(subspace, method_name, **arguments)
+    return retry
+
+
+def process(webserver, user_id, path, fraction=None, progress=None, partial=None, partial_interval=0.1, **arguments):
+    """Handles a request, and returns the response (or a promise for it, when the request is batched)
+
+    :param progress: called with the fraction of the pass over the data that is done, returning False cancels
+    :param partial: called with the partial results of (batched) statistics while the pass over the data is done
+    :param float partial_interval: fraction of the pass over the data between two partial results
+    """
     if not hasattr(webserver.thread_local, "executor"):
         logger.debug("creating thread pool and executor")
         webserver.thread_local.thread_pool = vaex.multithreading.ThreadPoolIndex(max_workers=webserver.threads_per_job)
@@ -337,8 +560,9 @@ def process(webserver, user_id, path, fraction=None, progress=None, **arguments)
 
     progress = progress or (lambda x: True)
     progress(0)
-    # TODO: mem leak and other issues if we don't disconnect this
-    webserver.thread_local.executor.signal_progress.connect(progress)
+    # a request is not cancelled during a pass of the executor of the thread (the tasks would never be fulfilled, and
+    # the thread would wait forever), only batched requests are, see PassBatcher
+    progress_callback = webserver.thread_local.executor.signal_progress.connect(lambda fraction: progress(fraction) or True)
     # return ("Hello, world")
     # print request.path
     try:
@@ -373,26 +597,32 @@ def process(webserver, user_id, path, fraction=None, progress=None, **arguments)
                             expressions = arguments["expressions"]
                         else:
                             expressions = None
-                        # make a shallow copy, such that selection and active_fraction is not shared
+                        # make a shallow copy, such that selection and active_fraction is not shared, the copy shares
+                        # the masks of the selections with the other copies (see WebServer.selection_mask_cache)
                         dataset_original = webserver.datasets_map[dataset_name]
                         dataset = dataset_original.copy()
-                        # copy the cache, 2 level deep clone
-                        # currently not working, could be a good optimization
-                        # dataset._selection_mask_caches = {key:dict(value) for key, value in dataset_original._selection_mask_caches.items()}
                         logger.info("method: %r args: %r" % (method_name, arguments))
                         # TODO: executor should be an argument to the stats functions..
                         dataset.executor = webserver.thread_local.executor
+                        batched = bool(webserver.batching and ((expressions and method_name in batched_methods_subspace) or
+                                                               (not expressions and method_name in batched_methods)))
+                        if batched:
+                            dataset.executor = webserver.batcher(dataset_original).executor
                         if dataset.mask is not None:
                             logger.debug("selection: %r", dataset.mask.sum())
                         if 'state' in arguments:
                             dataset.state_set(arguments['state'])
+                            # a client can restrict the rows (vaex.distributed hands out row ranges to the servers)
+                            active_range = tuple(arguments['state'].get('active_range', ()))
+                            if active_range and active_range != (0, dataset.length_original()):
+                                dataset.set_active_range(*active_range)
                         if expressions:
                             for expression in expressions:
                                 try:
                                     dataset.validate_expression(expression)
                                 except (SyntaxError, KeyError, NameError) as e:
                                     return exception(e)
-                        subspace = dataset(*expressions, executor=webserver.thread_local.executor) if expressions else None
+                        subspace = dataset(*expressions, executor=dataset.executor, delay=batched) if expressions else None
                         if dataset_original.has_selection(vaex.dataset.FILTER_SELECTION_NAME):
                             selection_original = dataset_original.get_selection(vaex.dataset.FILTER_SELECTION_NAME)
                             if not dataset.has_selection(vaex.dataset.FILTER_SELECTION_NAME):
@@ -418,7 +648,22 @@ def process(webserver, user_id, path, fraction=None, progress=None, **arguments)
                                     for name in "job_id state auto_fraction expressions active_fraction selection selections variables virtual_columns active_start_index active_end_index".split():
                                         arguments.pop(name, None)
                             logger.debug("subspace: %r", subspace)
-                            if subspace is None and method_name in "count cov correlation covariance mean std minmax min max sum var".split():
+                            if batched and subspace is None:
+                                queued = list(dataset.executor.task_queue)
+                                promise = task_invoke(dataset, method_name, delay=True, **arguments)
+                                if partial is not None:
+                                    tasks = [task for task in dataset.executor.task_queue if task not in queued]
+                                    call = lambda df: task_invoke(df, method_name, delay=True, **arguments)
+                                    progress = _partial_progress(progress, partial, partial_interval, dataset, tasks, call)
+                                return _batched(webserver, dataset_original, progress, promise,
+                                                retry=_retry(dataset, None, method_name, arguments))
+                            elif batched and method_name == "histogram":
+                                return _batched(webserver, dataset_original, progress, task_invoke(subspace, method_name, **arguments),
+                                                retry=_retry(dataset, subspace, method_name, arguments))
+                            elif batched:
+                                return _batched(webserver, dataset_original, progress, task_invoke(subspace, method_name, **arguments), _tolist_result,
+                                                retry=_retry(dataset, subspace, method_name, arguments))
+                            elif subspace is None and method_name in batched_methods:
                                 grid = task_invoke(dataset, method_name, **arguments)
                                 return grid
                             elif method_name in ["minmax", "image_rgba_url", "var", "mean", "sum", "limits_sigma", "nearest", "correlation", "mutual_information"]:
@@ -462,6 +707,8 @@ def process(webserver, user_id, path, fraction=None, progress=None, **arguments)
     except Exception as e:
         logger.exception("unknown issue")
         return exception(e)
+    finally:
+        webserver.thread_local.executor.signal_progress.disconnect(progress_callback)
     return error("unknown request")
 
 
@@ -471,12 +718,15 @@ GB = MB * 1024
 
 class WebServer(threading.Thread):
     def __init__(self, address="localhost", port=9000, webserver_thread_count=2, cache_byte_size=500 * MB,
-                 cache_selection_byte_size=500 * MB, datasets=[], compress=True, development=False, threads_per_job=4):
+                 cache_selection_byte_size=500 * MB, datasets=[], compress=True, development=False, threads_per_job=4,
+                 batching=True, batch_window=0.005, batch_latency=0.05, cache_selection_mask_byte_size=100 * MB):
         threading.Thread.__init__(self)
         self.setDaemon(True)
         self.address = address
         self.port = port
         self.started = threading.Event()
+        # the masks of the selections and filters are shared by the copies of the datasets made for each request
+        self.selection_mask_cache = vaex.cache.SelectionMaskCache(cache_selection_mask_byte_size) if cache_selection_mask_byte_size else None
         self.set_datasets(datasets)
 
         self.webserver_thread_count = webserver_thread_count
@@ -485,17 +735,25 @@ class WebServer(threading.Thread):
         self.thread_pool = concurrent.futures.ThreadPoolExecutor(self.webserver_thread_count)
         self.thread_local = threading.local()
         self.thread_pools = []
+        # concurrent requests for the same dataset share a pass over the data (see PassBatcher)
+        self.batching = batching
+        self.batch_window = batch_window
+        self.batch_latency = batch_latency
+        self.batchers = {}
+        self.batchers_lock = threading.Lock()
 
         self.job_queue = JobQueue()
 
-        self.cache = LRUCache(cache_byte_size, getsizeof=sys.getsizeof)
-        self.cache_selection = LRUCache(cache_selection_byte_size, getsizeof=sys.getsizeof)
+        # sys.getsizeof does not include the data of numpy arrays that do not own their data
+        self.cache = LRUCache(cache_byte_size, getsizeof=vaex.cache.nbytes)
+        self.cache_selection = LRUCache(cache_selection_byte_size, getsizeof=vaex.cache.nbytes)
 
         self.options = dict(webserver=self, datasets=datasets, submit_threaded=self.submit_threaded, cache=self.cache,
                             cache_selection=self.cache_selection)
 
         # tornado.web.GZipContentEncoding.MIN_LENGTH = 1
         tornado.web.GZipContentEncoding.CONTENT_TYPES.add("application/octet-stream")
+        tornado.web.GZipContentEncoding.CONTENT_TYPES.add(vaex.protocol.content_type)
         self.application = tornado.web.Application([
             (r"/queue", QueueHandler, self.options),
             (r"/auth", GoogleOAuth2LoginHandler, {}),
@@ -509,6 +767,20 @@ class WebServer(threading.Thread):
     def set_datasets(self, datasets):
         self.datasets = list(datasets)
         self.datasets_map = dict([(ds.name, ds) for ds in self.datasets])
+        if self.selection_mask_cache is not None:
+            for ds in self.datasets:
+                if ds._selection_mask_cache is None or ds._selection_mask_cache[0] is not self.selection_mask_cache:
+                    self.selection_mask_cache.attach(ds)
+
+    def batcher(self, dataset):
+        """Returns the PassBatcher for the dataset"""
+        with self.batchers_lock:
+            if dataset.name not in self.batchers:
+                thread_pool = vaex.multithreading.ThreadPoolIndex(max_workers=self.threads_per_job)
+                self.thread_pools.append(thread_pool)
+                executor = vaex.execution.Executor(thread_pool=thread_pool)
+                self.batchers[dataset.name] = PassBatcher(executor, window=self.batch_window, latency=self.batch_latency)
+            return self.batchers[dataset.name]
 
     def submit_threaded(self, callable, *args, **kwargs):
         job = JobFlexible(4., callable, args=args, kwargs=kwargs)
@@ -522,7 +794,21 @@ class WebServer(threading.Thread):
             finally:
                 self.job_queue.finished(job)
             return result
-        future = self.thread_pool.submit(execute)  # , *args, **kwargs)
+        # batched requests return a promise, which is fulfilled after the pass over the data, while the thread
+        # can handle the next request
+        future = concurrent.futures.Future()
+
+        def done(thread_future):
+            try:
+                result = thread_future.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if isinstance(result, vaex.promise.Promise):
+                result.then(future.set_result, future.set_exception)
+            else:
+                future.set_result(result)
+        self.thread_pool.submit(execute).add_done_callback(done)
         return future
 
     def serve(self):
@@ -607,10 +893,13 @@ def main(argv):
     parser.add_argument("--port", help="port to listen on (default: %(default)s)", type=int, default=9000)
     parser.add_argument('--verbose', '-v', action='count', default=2)
     parser.add_argument('--cache', help="cache size in bytes for requests, set to zero to disable (default: %(default)s)", type=int, default=500000000)
+    parser.add_argument('--cache-selection-mask', help="cache size in bytes for the (bit packed) masks of selections, set to zero to disable (default: %(default)s)", type=int, default=100 * MB)
     parser.add_argument('--compress', help="compress larger replies (default: %(default)s)", default=True, action='store_true')
     parser.add_argument('--no-compress', dest="compress", action='store_false')
     parser.add_argument('--development', default=False, action='store_true', help="enable development features (auto reloading)")
     parser.add_argument('--threads-per-job', default=4, type=int, help="threads per job (default: %(default)s)")
+    parser.add_argument('--no-batching', dest="batching", default=True, action='store_false', help="do not let concurrent requests share a pass over the data")
+    parser.add_argument('--batch-latency', default=0.05, type=float, help="maximum seconds a request waits for other requests to share a pass with (default: %(default)s)")
     # config = layeredconfig.LayeredConfig(defaults, env, layeredconfig.Commandline(parser=parser, commandline=argv[1:]))
     config = parser.parse_args(argv[1:])
 
@@ -637,7 +926,8 @@ def main(argv):
         logger.info("\thttp://%s:%d/%s or ws://%s:%d/%s", config.address, config.port, dataset.name, config.address, config.port, dataset.name)
     server = WebServer(datasets=datasets, address=config.address, port=config.port, cache_byte_size=config.cache,
                        compress=config.compress, development=config.development,
-                       threads_per_job=config.threads_per_job)
+                       threads_per_job=config.threads_per_job, batching=config.batching, batch_latency=config.batch_latency,
+                       cache_selection_mask_byte_size=config.cache_selection_mask)
     server.serve()
 
 
@@ -0,0 +1,332 @@
+"""Zone maps are the minimum, maximum and number of missing values of a column, for each block of rows.
+
+They are stored by :meth:`DataFrame.export_hdf5` (see the zone_maps argument), and used to skip the blocks of rows
+that cannot match a selection (or filter), and to compute counts and minima/maxima of (the blocks of) columns without
+reading the data.
+"""
+import ast
+import logging
+
+import numpy as np
+import six
+
+logger = logging.getLogger("vaex.zonemaps")
+
+block_length_default = 2**16
+
+# the states of a block of rows for a selection
+NONE = 0  # no row matches
+ALL = 1  # all rows match
+SOME = -1  # unknown, the data needs to be read
+
+_flipped = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+
+
+class ZoneMap(object):
+    """The minimum, maximum and number of missing (masked or NaN) values for each block of block_length rows of a column.
+
+    The minima and maxima exclude the missing values.
+
+    :param column: the column, the zone map is only used while the DataFrame has this column
+    :param int block_length: number of rows per block
+    :param minima: the minimum of each block
+    :param maxima: the maximum of each block
+    :param null_counts: the number of missing values of each block
+    :param int length: number of rows of the (untrimmed) column the zone map was computed for
+    :param int offset: the row of the zone map that is the first row of the column (the column may be trimmed)
+    :param bool masked: True when the column has a mask, in which case the minima and maxima only say something about
+            the rows of the blocks without missing values
+    """
+    def __init__(self, column, block_length, minima, maxima, null_counts, length, offset=0, masked=False):
+        self.column = column
+        self.block_length = int(block_length)
+        self.minima = minima
+        self.maxima = maxima
+        self.null_counts = null_counts
+        self.length = int(length)
+        self.offset = int(offset)
+        self.masked = masked
+
+    def trim(self, column, i1):
+        """Returns the zone map for column, which are the rows from i1 of the column of this zone map"""
+        return ZoneMap(column, self.block_length, self.minima, self.maxima, self.null_counts, self.length, self.offset + i1, self.masked)
+
+    @property
+    def geometry(self):
+        return self.block_length, self.length, self.offset
+
+    def blocks(self, i1, i2):
+        """Returns the first block, and the last block + 1 covering the rows i1 to i2 of the column"""
+        return (i1 + self.offset) // self.block_length, (i2 + self.offset + self.block_length - 1) // self.block_length
+
+    def boundaries(self):
+        """Returns the rows of the column where a block starts"""
+        starts = np.arange(0, self.length, self.block_length) - self.offset
+        return starts[(starts > 0) & (starts < len(self.column))]
+
+    def rows(self, b1, b2):
+        """Returns the number of rows of the blocks b1 to b2"""
+        starts = np.arange(b1, b2) * self.block_length
+        return np.minimum(starts + self.block_length, self.length) - starts
+
+    def statistics(self, i1, i2):
+        """Returns (count, minimum, maximum) of the non missing values of the rows i1 to i2, or None when the rows do
+        not start and end at block boundaries"""
+        z1, z2 = i1 + self.offset, i2 + self.offset
+        if z1 % self.block_length != 0 or (z2 % self.block_length != 0 and z2 != self.length):
+            return None
+        b1, b2 = self.blocks(i1, i2)
+        counts = self.rows(b1, b2) - self.null_counts[b1:b2]
+        present = counts > 0
+        if not present.any():
+            return 0, np.nan, np.nan
+        return int(counts.sum()), self.minima[b1:b2][present].min(), self.maxima[b1:b2][present].max()
+
+    def compare(self, op, value, b1, b2):
+        """Returns the states of the blocks b1 to b2 for the expression 'column <op> value'"""
+        minima, maxima = self.minima[b1:b2], self.maxima[b1:b2]
+        null_counts = self.null_counts[b1:b2]
+        if op == ast.Gt:
+            none, all = maxima <= value, minima > value
+        elif op == ast.GtE:
+            none, all = maxima < value, minima >= value
+        elif op == ast.Lt:
+            none, all = minima >= value, maxima < value
+        elif op == ast.LtE:
+            none, all = minima > value, maxima <= value
+        elif op == ast.Eq:
+            none, all = (minima > value) | (maxima < value), (minima == value) & (maxima == value)
+        else:  # NotEq
+            none, all = (minima == value) & (maxima == value), (minima > value) | (maxima < value)
+        empty = null_counts == self.rows(b1, b2)
+        all = all & (null_counts == 0)
+        if self.masked:
+            # we do not know what a masked value compares to
+            none = none & (null_counts == 0)
+        elif op == ast.NotEq:
+            none = none & (null_counts == 0)  # NaN != value
+        else:
+            none = none | empty  # NaN never compares
+        return np.where(none, NONE, np.where(all, ALL, SOME)).astype(np.int8)
+
+
+def compute(array, block_length=block_length_default):
+    """Returns the minima, maxima and null counts for each block of block_length rows of the (masked) array"""
+    blocks = (len(array) + block_length - 1) // block_length
+    dtype = array.dtype.newbyteorder('=')
+    minima = np.zeros(blocks, dtype=dtype)
+    maxima = np.zeros(blocks, dtype=dtype)
+    null_counts = np.zeros(blocks, dtype=np.int64)
+    for block in range(blocks):
+        values = array[block * block_length:(block + 1) * block_length]
+        missing = np.ma.getmaskarray(values) if np.ma.isMaskedArray(values) else None
+        values = np.ma.getdata(values)
+        if dtype.kind == 'f':
+            nans = np.isnan(values)
+            missing = nans if missing is None else missing | nans
+        if missing is not None and missing.any():
+            null_counts[block] = np.sum(missing)
+            values = values[~missing]
+        if len(values):
+            minima[block] = values.min()
+            maxima[block] = values.max()
+    return minima, maxima, null_counts
+
+
+def get(df, name):
+    """Returns the zone map of the column with name, or None"""
+    zone_map = df._zone_maps.get(name)
+    if zone_map is not None and df.columns.get(name) is zone_map.column:
+        return zone_map
+
+
+def _zone_maps(df):
+    """Returns a dict with the zone maps of the DataFrame that share the block layout with the first one (the others are
+    ignored)"""
+    zone_maps = [(name, get(df, name)) for name in list(df._zone_maps)]
+    zone_maps = [(name, zone_map) for name, zone_map in zone_maps if zone_map is not None]
+    return {name: zone_map for name, zone_map in zone_maps if zone_map.geometry == zone_maps[0][1].geometry}
+
+
+def _constant(node):
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _constant(node.operand)
+        return None if value is None else (-value if isinstance(node.op, ast.USub) else value)
+    value = getattr(node, 'n', None) if isinstance(node, ast.Num) else getattr(node, 'value', None)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+
+
+def _parse(expression):
+    try:
+        return ast.parse(str(expression), mode='eval').body
+    except SyntaxError:
+        return None
+
+
+def _and(states):
+    states = np.array(states)
+    return np.where((states == NONE).any(axis=0), NONE, np.where((states == ALL).all(axis=0), ALL, SOME)).astype(np.int8)
+
+
+def _or(states):
+    states = np.array(states)
+    return np.where((states == ALL).any(axis=0), ALL, np.where((states == NONE).all(axis=0), NONE, SOME)).astype(np.int8)
+
+
+def _not(states):
+    return np.where(states == NONE, ALL, np.where(states == ALL, NONE, SOME)).astype(np.int8)
+
+
+def _xor(a, b):
+    known = (a != SOME) & (b != SOME)
+    return np.where(known, np.where(a == b, NONE, ALL), SOME).astype(np.int8)
+
+
+def _maybe_masked(df, node, zone_maps, b1, b2):
+    """Returns for each of the blocks b1 to b2 whether the (ast) node may have masked values, which happens when it
+    depends on a column with missing values (or that we know nothing about)"""
+    if node is None:
+        return np.ones(b2 - b1, dtype=np.bool_)
+    masked = np.zeros(b2 - b1, dtype=np.bool_)
+    names = set()
+    for name in set(child.id for child in ast.walk(node) if isinstance(child, ast.Name)):
+        if name in df.columns:
+            names.add(name)
+        elif name in df.virtual_columns:
+            try:
+                names |= set(df._expr(name).variables())
+            except Exception:
+                return np.ones(b2 - b1, dtype=np.bool_)
+    for name in names:
+        zone_map = zone_maps.get(name)
+        column = df.columns.get(name)
+        if zone_map is not None:
+            if zone_map.masked:
+                masked |= zone_map.null_counts[b1:b2] > 0
+        elif column is not None and (np.ma.isMaskedArray(column) or not isinstance(column, np.ndarray)):
+            return np.ones(b2 - b1, dtype=np.bool_)
+    return masked
+
+
+def _node_states(df, node, zone_maps, b1, b2):
+    """Returns the states of the blocks b1 to b2 for the (ast) node of a boolean expression"""
+    combined = None
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        states = [_node_states(df, node.left, zone_maps, b1, b2), _node_states(df, node.right, zone_maps, b1, b2)]
+        combined = (_and if isinstance(node.op, ast.BitAnd) else _or)(states)
+    elif isinstance(node, ast.BoolOp):
+        states = [_node_states(df, value, zone_maps, b1, b2) for value in node.values]
+        combined = (_and if isinstance(node.op, ast.And) else _or)(states)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Invert, ast.Not)):
+        combined = _not(_node_states(df, node.operand, zone_maps, b1, b2))
+    if combined is not None:
+        # like numpy, True | masked and ~masked are masked, and masked rows are never selected, so a block of which
+        # (part of) the rows may be masked cannot be ALL (but NONE still holds)
+        masked = _maybe_masked(df, node, zone_maps, b1, b2)
+        return np.where(masked & (combined == ALL), SOME, combined).astype(np.int8)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _flipped:
+        op = type(node.ops[0])
+        left, right = node.left, node.comparators[0]
+        if isinstance(right, ast.Name):
+            left, right, op = right, left, _flipped[op]
+        value = _constant(right)
+        if isinstance(left, ast.Name) and left.id in zone_maps and value is not None:
+            return zone_maps[left.id].compare(op, value, b1, b2)
+    return np.full(b2 - b1, SOME, dtype=np.int8)
+
+
+def _selection_states(df, selection, zone_maps, b1, b2):
+    import vaex.selections
+    if selection is None:
+        return np.full(b2 - b1, ALL, dtype=np.int8)
+    if not isinstance(selection, vaex.selections.SelectionExpression):
+        return np.full(b2 - b1, SOME, dtype=np.int8)
+    states = _node_states(df, _parse(selection.boolean_expression), zone_maps, b1, b2)
+    if selection.previous_selection is not None:
+        previous = _selection_states(df, selection.previous_selection, zone_maps, b1, b2)
+        if selection.mode == "and":
+            states = _and([previous, states])
+        elif selection.mode == "or":
+            states = _or([previous, states])
+        elif selection.mode == "xor":
+            states = _xor(previous, states)
+        elif selection.mode == "subtract":
+            states = _and([previous, _not(states)])
+    elif selection.mode == "subtract":
+        states = _not(states)
+    else:
+        return states
+    # the masks are combined like the expressions are, see _node_states
+    masked = _selection_maybe_masked(df, selection, zone_maps, b1, b2)
+    return np.where(masked & (states == ALL), SOME, states).astype(np.int8)
+
+
+def _selection_maybe_masked(df, selection, zone_maps, b1, b2):
+    import vaex.selections
+    masked = np.zeros(b2 - b1, dtype=np.bool_)
+    while selection is not None:
+        if not isinstance(selection, vaex.selections.SelectionExpression):
+            return np.ones(b2 - b1, dtype=np.bool_)
+        masked |= _maybe_masked(df, _parse(selection.boolean_expression), zone_maps, b1, b2)
+        selection = selection.previous_selection
+    return masked
+
+
+def _segments(df, i1, i2, states_function):
+    zone_maps = _zone_maps(df)
+    if not zone_maps:
+        return None
+    first = list(zone_maps.values())[0]
+    offset = df._index_start + first.offset
+    b1, b2 = first.blocks(df._index_start + i1, df._index_start + i2)
+    states = states_function(zone_maps, b1, b2)
+    segments = []
+    for block, state in zip(range(b1, b2), states):
+        j1 = max(i1, block * first.block_length - offset)
+        j2 = min(i2, (block + 1) * first.block_length - offset)
+        if segments and segments[-1][2] == state:
+            segments[-1] = (segments[-1][0], j2, state)
+        else:
+            segments.append((j1, j2, state))
+    return segments
+
+
+def expression_segments(df, expression, i1, i2):
+    """Returns the consecutive rows of i1 to i2 (relative to the active range) with the same state for the boolean
+    expression, as a list of (j1, j2, state) tuples, or None when the DataFrame has no zone maps"""
+    node = _parse(expression)
+    return _segments(df, i1, i2, lambda zone_maps, b1, b2: _node_states(df, node, zone_maps, b1, b2))
+
+
+def selection_segments(df, selection, i1, i2, name="default"):
+    """Like :func:`expression_segments`, for a selection.
+
+    :param selection: a :class:`vaex.selections.Selection`, or a string or bool to refer to a selection by name, or
+            None or False for all rows. The filter is taken into account, unless name is the name of the filter.
+    """
+    if not df._zone_maps:
+        return None
+    if selection is True:
+        selection = "default"
+    if isinstance(selection, six.string_types):
+        if not df.has_selection(selection):
+            return None
+        name, selection = selection, df.get_selection(selection)
+    elif selection is False:
+        selection = None
+
+    def states(zone_maps, b1, b2):
+        states = _selection_states(df, selection, zone_maps, b1, b2)
+        if df.filtered and name != "__filter__":
+            states = _and([states, _selection_states(df, df.get_selection("__filter__"), zone_maps, b1, b2)])
+        return states
+    return _segments(df, i1, i2, states)
+
+
+def selection_state(df, selection, i1, i2):
+    """Returns NONE, ALL or SOME for the rows i1 to i2, see :func:`selection_segments`"""
+    segments = selection_segments(df, selection, i1, i2)
+    if segments is None or len(segments) != 1:
+        return SOME
+    return segments[0][2]
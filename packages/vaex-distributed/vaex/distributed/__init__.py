@@ -2,8 +2,15 @@ import vaex as vx
 import vaex.dataset
 import vaex.settings
 import vaex.legacy
+import vaex.execution
+import vaex.promise
+from vaex.dataframe import default_shape
 from vaex.remote import ServerExecutor
+import bisect
+import collections
 import socket
+import threading
+import time
 import numpy as np
 import logging
 import aplus
@@ -25,6 +32,212 @@ def multi_map_reduce(self):
 """
 
 
+# errors of a calculation itself (e.g. a typo in an expression), which a retry on another server does not fix
+calculation_errors = (NameError, SyntaxError, KeyError, TypeError, ValueError, vaex.execution.UserAbort)
+
+
+def _merge_minmax(minmax1, minmax2):
+    minmax1, minmax2 = np.asarray(minmax1), np.asarray(minmax2)
+    # a server that has no (selected) rows in its range gives NaN, which fmin and fmax ignore
+    return np.stack([np.fmin(minmax1[..., 0], minmax2[..., 0]), np.fmax(minmax1[..., 1], minmax2[..., 1])], axis=-1)
+
+
+class _Worker(object):
+    """A server (a remote DataFrame), with its measured throughput"""
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.throughput = None  # rows per second, a moving average
+        self.running = 0  # number of requests
+        self.failures = 0  # number of failed requests in a row
+        self.alive = True
+
+    def __repr__(self):
+        return "<worker %s (%r rows/s)>" % (self.dataset.server.hostname, self.throughput)
+
+
+class _Job(object):
+    """A calculation of a :class:`Scheduler`, the rows are split in ranges, and a piece is one or more consecutive
+    ranges, as handed out to a worker, a tuple (i1, i2, ranges)"""
+    def __init__(self, call, merge, ranges):
+        self.call = call
+        self.merge = merge
+        self.pending = list(ranges)  # the ranges that are not handed out (sorted)
+        self.todo = set(ranges)  # the ranges without result
+        self.running = collections.OrderedDict()  # piece -> the workers running it, in the order they were handed out
+        self.attempts = collections.Counter()  # range -> number of failures
+        self.result = None
+        self.promise = vaex.promise.Promise()
+        self.finished = False
+
+
+class Scheduler(object):
+    """Distributes calculations over servers that all serve the same rows, and merges the results.
+
+    The rows are split in many small ranges, which are handed out while the calculation runs: a server gets a new range
+    when it finishes one, so a fast server handles more ranges than a slow one, and once its throughput is known, it
+    gets as many consecutive ranges at once as it handles in about target_seconds. When a server fails, its ranges are
+    retried on the other servers, and it is no longer used after max_failures failures in a row. When all ranges are
+    handed out, idle servers also run the ranges that other servers are still working on (the first result is used),
+    such that a slow or hanging server does not stall the calculation. The results of the ranges are merged as they
+    arrive.
+
+    Example:
+
+    >>> scheduler = vaex.distributed.Scheduler([server1.datasets()[0], server2.datasets()[0]])
+    >>> promise = scheduler.map_reduce(lambda df: df.count(delay=True), np.add, 0, len(df))
+    >>> promise.get()
+
+    :param datasets: the remote DataFrames, one per server
+    :param int ranges_per_worker: the rows are split in this number of ranges per server
+    :param int inflight: the number of requests a server works on at the same time (such that it has the next one while
+            sending the result of the previous one)
+    :param float target_seconds: the time a request should take, given the measured throughput of a server
+    :param int retries: the number of times a range can fail, before the calculation fails
+    :param int max_failures: the number of failures in a row after which a server is no longer used
+    """
+    def __init__(self, datasets, ranges_per_worker=16, inflight=2, target_seconds=0.5, retries=3, max_failures=3):
+        self.workers = [_Worker(dataset) for dataset in datasets]
+        self.ranges_per_worker = ranges_per_worker
+        self.inflight = inflight
+        self.target_seconds = target_seconds
+        self.retries = retries
+        self.max_failures = max_failures
+        self.smoothing = 0.5  # weight of the last measurement for the throughput
+        self.jobs = []
+        self.lock = threading.RLock()
+
+    def map_reduce(self, call, merge, i1, i2):
+        """Calls call(dataset) for ranges of the rows i1 to i2 (set as the active range of the dataset), and merges
+        the results using merge(a, b).
+
+        :param call: function that returns a promise for the result of the calculation of a remote DataFrame
+        :param merge: function that merges two results, e.g. np.add
+        :return: a promise for the merged result
+        """
+        count = max(1, min(i2 - i1, len(self.workers) * self.ranges_per_worker))
+        parts = np.linspace(i1, i2, count + 1, dtype=int).tolist()
+        job = _Job(call, merge, list(zip(parts[:-1], parts[1:])))
+        with self.lock:
+            self.jobs.append(job)
+            finish = self._dispatch()
+        self._finish(finish)
+        return job.promise
+
+    def _dispatch(self):
+        """Hands out work to the idle workers, returns the jobs to finish (outside of the lock)"""
+        workers = [worker for worker in self.workers if worker.alive]
+        if not workers:
+            return [self._end(job, RuntimeError("all servers failed")) for job in list(self.jobs)]
+        # the fastest workers first, such that they get the ranges before they are all handed out
+        workers.sort(key=lambda worker: -(worker.throughput or 0))
+        handed_out = True
+        while handed_out:
+            handed_out = False
+            for job in list(self.jobs):
+                for worker in workers:
+                    if worker.alive and worker.running < self.inflight:
+                        piece = self._take(job, worker)
+                        if piece is not None:
+                            self._submit(job, worker, piece)
+                            handed_out = True
+        return []
+
+    def _take(self, job, worker):
+        if job.pending:
+            ranges = [job.pending.pop(0)]
+            length = ranges[0][1] - ranges[0][0]
+            count = 1
+            if worker.throughput and length:
+                count = int(worker.throughput * self.target_seconds / length)
+                # but leave some for the other workers
+                count = max(1, min(count, len(job.pending) // sum(worker.alive for worker in self.workers)))
+            while len(ranges) < count and job.pending and job.pending[0][0] == ranges[-1][1]:
+                ranges.append(job.pending.pop(0))
+            return (ranges[0][0], ranges[-1][1], tuple(ranges))
+        # all ranges are handed out, help with the piece that runs the longest on (only) another worker
+        for piece, workers in job.running.items():
+            if len(workers) == 1 and workers[0] is not worker:
+                return piece
+
+    def _submit(self, job, worker, piece):
+        i1, i2, ranges = piece
+        worker.running += 1
+        job.running.setdefault(piece, []).append(worker)
+        t0 = time.time()
+        dataset = worker.dataset
+        active_range = dataset.get_active_range()
+        dataset.set_active_range(i1, i2)
+        try:
+            promise = job.call(dataset)
+        except Exception as e:
+            promise = vaex.promise.Promise.rejected(e)
+        finally:
+            dataset.set_active_range(*active_range)
+        logger.debug("rows %d-%d to %r", i1, i2, worker)
+        promise.then(lambda result: self._finish(self._done(job, worker, piece, t0, result)),
+                     lambda error: self._finish(self._failed(job, worker, piece, error)))
+
+    def _done(self, job, worker, piece, t0, result):
+        with self.lock:
+            worker.running -= 1
+            worker.failures = 0
+            throughput = (piece[1] - piece[0]) / max(time.time() - t0, 1e-6)
+            if worker.throughput is None:
+                worker.throughput = throughput
+            else:
+                worker.throughput = self.smoothing * throughput + (1 - self.smoothing) * worker.throughput
+            finish = []
+            if not job.finished and piece[2][0] in job.todo:
+                # the other workers running this piece are ignored
+                del job.running[piece]
+                job.todo.difference_update(piece[2])
+                try:
+                    job.result = result if job.result is None else job.merge(job.result, result)
+                except Exception as e:
+                    finish.append(self._end(job, e))
+                else:
+                    if not job.todo:
+                        finish.append(self._end(job))
+            return finish + self._dispatch()
+
+    def _failed(self, job, worker, piece, error):
+        with self.lock:
+            worker.running -= 1
+            finish = []
+            if isinstance(error, calculation_errors):
+                if not job.finished:
+                    finish.append(self._end(job, error))
+                return finish + self._dispatch()
+            worker.failures += 1
+            logger.error("%r failed for rows %d-%d: %r", worker, piece[0], piece[1], error)
+            if worker.failures >= self.max_failures:
+                logger.error("no longer using %r", worker)
+                worker.alive = False
+            if not job.finished and piece[2][0] in job.todo:
+                workers = job.running[piece]
+                workers.remove(worker)
+                if not workers:  # nobody else is running it, so we retry it
+                    del job.running[piece]
+                    for range in piece[2]:
+                        job.attempts[range] += 1
+                        bisect.insort(job.pending, range)
+                    if max(job.attempts[range] for range in piece[2]) > self.retries:
+                        finish.append(self._end(job, error))
+            return finish + self._dispatch()
+
+    def _end(self, job, error=None):
+        job.finished = True
+        self.jobs.remove(job)
+        return (job, job.result, error)
+
+    def _finish(self, finish):
+        for job, result, error in finish:
+            if error is None:
+                job.promise.fulfill(result)
+            else:
+                job.promise.reject(error)
+
+
 class SubspaceDistributed(vaex.legacy.Subspace):
     def toarray(self, list):
         return np.array(list)
@@ -43,73 +256,22 @@ class SubspaceDistributed(vaex.legacy.Subspace):
     def sleep(self, seconds, delay=False):
         return self.dataset.server.call("sleep", seconds, delay=delay)
 
-    def _apply_all(self, name, *args, **kwargs):
-        promises = []
-        print("calling %s (selection: %s)" % (name, self.is_masked))
-        selection_name = "default"
-        selection = self.dataset.get_selection(name=selection_name)
-        if selection:
-            print(selection, selection.to_dict())
-        for dataset in self.dataset.datasets:
-            dataset.set_selection(selection)  # , selection_name=selection_name)
+    def _apply_all(self, name, merge, *args, **kwargs):
+        selection = self.df.get_selection(name="default")
+
+        def call(dataset):
+            dataset.set_selection(selection)
             subspace = dataset(*self.expressions, delay=True)
             if self.is_masked:
                 subspace = subspace.selected()
-            print(subspace.get_selection(), dataset.get_selection("default"), subspace.is_masked, self.is_masked)
-            import time
-            t0 = time.time()
-
-            def timit(o, dataset=dataset, t0=t0):
-                print("took %s %f" % (dataset.server.hostname, time.time() - t0))
-                return o
-
-            def error(e, dataset=dataset):
-                print("issues with %s (%r)" % (dataset.server.hostname, e))
-                try:
-                    raise e
-                except:
-                    logger.exception("error in error handler")
-            # subspace.histogram(limits, size=size, weight=weight).then(timit, error)
-            f = getattr(subspace, name)
-            promise = f(*args, **kwargs).then(timit, error)
-            promises.append(promise)
-        return aplus.listPromise(promises)
+            return getattr(subspace, name)(*args, **kwargs)
+        return self.df.scheduler.map_reduce(call, merge, *self.df.get_active_range())
 
     def minmax(self):
-        def min_max_reduce(minmax1, minmax2):
-            if minmax1 is None:
-                return minmax2
-            if minmax2 is None:
-                return minmax1
-            result = []
-            for d in range(self.dimension):
-                min1, max1 = minmax1[d]
-                min2, max2 = minmax2[d]
-                result.append((min(min1, min2), max(max1, max2)))
-            return result
-
-        @delayed
-        def reduce_minmaxes(minmaxes):
-            if None in minmaxes:
-                raise ValueError("one of the results are invalid")
-            return reduce(min_max_reduce, minmaxes)
-        minmaxes = self._apply_all("minmax")
-        promise = reduce_minmaxes(minmaxes)
-        task = vaex.dataset.Task()
-        self.dataset.executor.schedule(task)
-        #promise.then(task.fulfill)
-        return self.dataset._delay(False, task) #self._task(task)#, progressbar=progressbar)
+        return self._task(self._apply_all("minmax", _merge_minmax))
 
     def histogram(self, limits, size=256, weight=None, progressbar=False, group_by=None, group_limits=None, delay=None):
-        @delayed
-        def sum(grids):
-            if None in grids:
-                raise ValueError("one of the results are invalid")
-            return np.sum(grids, axis=0)
-        promise = sum(self._apply_all("histogram", limits=limits, size=size, weight=weight))
-        task = vaex.dataset.Task()
-        promise.then(task.fulfill)
-        return self._task(task)  # , progressbar=progressbar)
+        return self._task(self._apply_all("histogram", np.add, limits=limits, size=size, weight=weight))
 
     def nearest(self, point, metric=None):
         point = vaex.utils.make_list(point)
@@ -136,24 +298,27 @@ class SubspaceDistributed(vaex.legacy.Subspace):
 
 
 class DatasetDistributed(vaex.dataset.Dataset):
-    def __init__(self, datasets):
+    """A DataFrame of which the rows are served by several servers (which all serve the same rows), the calculations
+    are distributed over the servers by a :class:`Scheduler`.
+
+    :param datasets: the remote DataFrames, one per server
+    :param scheduler: a :class:`Scheduler` for the datasets, by default one with the default arguments
+    """
+    def __init__(self, datasets, scheduler=None):
         super(DatasetDistributed, self).__init__(datasets[0].name, datasets[0].column_names)
         self.datasets = datasets
+        self.scheduler = scheduler or Scheduler(datasets)
         self.executor = ServerExecutor()
-        # self.name = self.datasets[0].name
-        #   self.column_names = self.datasets[0].column_names
-        self.dtypes = self.datasets[0].dtypes
+        self._dtypes = self.datasets[0]._dtypes
         self.units = self.datasets[0].units
-        self.virtual_columns.update(self.datasets[0].units)
+        self.virtual_columns.update(self.datasets[0].virtual_columns)
         self.ucds = self.datasets[0].ucds
         self.descriptions = self.datasets[0].descriptions
         self.description = self.datasets[0].description
         self._length_original = self.datasets[0].length_original()
         self._length_unfiltered = self.datasets[0].length_unfiltered()
+        self._index_end = self._length_original
         self.path = self.datasets[0].path # may we should use some cluster name oroso
-        parts = np.linspace(0, self._length_original, len(self.datasets)+1, dtype=int)
-        for dataset, i1, i2 in zip(self.datasets, parts[0:-1], parts[1:]):
-            dataset.set_active_range(i1.item(), i2.item())
         for column_name in self.get_column_names(virtual=True, strings=True):
             self._save_assign_expression(column_name)
 
@@ -161,8 +326,8 @@ class DatasetDistributed(vaex.dataset.Dataset):
         return DatasetDistributed([k.copy() for k in self.datasets])
 
     def dtype(self, expression):
-        if expression in self.dtypes:
-            return self.dtypes[expression]
+        if expression in self._dtypes:
+            return self._dtypes[expression]
         else:
             return np.zeros(1, dtype=np.float64).dtype
 
@@ -171,58 +336,35 @@ class DatasetDistributed(vaex.dataset.Dataset):
     def __call__(self, *expressions, **kwargs):
         return SubspaceDistributed(self, expressions, kwargs.get("executor") or self.executor, delay=kwargs.get("delay", False))
 
-    def _apply_all(self, name, *args, **kwargs):
-        promises = []
-        logger.info("calling %s (args: %r, kwargs: %r)", name, args, kwargs)
+    def _map_reduce(self, name, merge, **kwargs):
+        """Calls the method with name of the remote DataFrames for the active range, and merges the results"""
+        logger.info("calling %s (kwargs: %r)", name, kwargs)
         kwargs['delay'] = True
-        for dataset in self.datasets:
-            import time
-            t0 = time.time()
-            def timit(o, dataset=dataset, t0=t0):
-                logger.info("took %s %f for %r" % (dataset.server.hostname, time.time() - t0, o))
-                return o
-            def error(e, dataset=dataset):
-                logger.error("issues with %s (%r)" % (dataset.server.hostname, e))
-                try:
-                    raise e
-                except:
-                    logger.exception("error in error handler")
-            f = getattr(dataset, name)
-            promise = f(*args, **kwargs).then(timit, error)
-            promises.append(promise)
-        return aplus.listPromise(promises)    
-
-    @delayed
-    def _sum_calculation(self, expression, binby, limits, shape, selection, progressbar):
+        return self.scheduler.map_reduce(lambda dataset: getattr(dataset, name)(**kwargs), merge, self._index_start, self._index_end)
+
+    def _limits(self, binby, limits):
+        # a server only sees a part of the rows, so the limits are computed over all rows first
+        if binby:
+            return self.limits(binby, limits, delay=True)
+        return aplus.Promise.fulfilled(limits)
+
+    def count(self, expression=None, binby=[], limits=None, shape=default_shape, selection=False, delay=False, edges=False, progress=None):
         @delayed
-        def sum_reduce(sums):
-            return np.sum(sums, axis=0)
-        promise = sum_reduce(self._apply_all("sum", expression=expression, binby=binby, limits=limits, shape=shape, selection=selection))
-        return promise
+        def calculate(limits):
+            return self._map_reduce("count", np.add, expression=expression, binby=binby, limits=limits, shape=shape, selection=selection, edges=edges)
+        return self._delay(delay, calculate(self._limits(binby, limits)))
 
-    @delayed
-    def _count_calculation(self, expression, binby, limits, shape, selection, edges, progressbar):
+    def sum(self, expression, binby=[], limits=None, shape=default_shape, selection=False, delay=False, progress=None):
         @delayed
-        def count_reduce(counts):
-            print(counts)
-            counts = np.array(counts)
-            return np.sum(counts, axis=0)
-        print('expression', expression)
-        promise = count_reduce(self._apply_all("count", expression=expression, binby=binby, limits=limits, shape=shape, edges=edges, selection=selection))
-        return promise
-
-    @delayed
-    def _minmax_calculation(self, expression, binby, limits, shape, selection, progressbar):
-        # TODO: this should take all expressions as argument, more efficient
+        def calculate(limits):
+            return self._map_reduce("sum", np.add, expression=expression, binby=binby, limits=limits, shape=shape, selection=selection)
+        return self._delay(delay, calculate(self._limits(binby, limits)))
+
+    def minmax(self, expression, binby=[], limits=None, shape=default_shape, selection=False, delay=False, progress=None):
         @delayed
-        def minmax_reduce(minmaxes):
-            minmaxes = np.array(minmaxes)
-            mins = minmaxes[...,0]
-            maxs = minmaxes[...,1]
-            minmax = np.stack([np.nanmin(mins, axis=0), np.nanmax(maxs, axis=0)], axis=-1)
-            return minmax
-        promise = minmax_reduce(self._apply_all("minmax", expression=expression, binby=binby, limits=limits, shape=shape, selection=selection))
-        return promise
+        def calculate(limits):
+            return self._map_reduce("minmax", _merge_minmax, expression=expression, binby=binby, limits=limits, shape=shape, selection=selection)
+        return self._delay(delay, calculate(self._limits(binby, limits)))
 
     def select(self, *args, **kwargs):
         for dataset in self.datasets:
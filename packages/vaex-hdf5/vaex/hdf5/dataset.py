@@ -14,11 +14,17 @@ from vaex.utils import ensure_string
 import astropy.io.fits as fits
 import re
 import six
+import threading
+import zlib
 from vaex.dataset import DatasetLocal, DatasetArrays
+import vaex.cache
 import vaex.dataset
 import vaex.file
+import vaex.zonemaps
+from vaex.dataframe import Column
 from vaex.expression import Expression
 from vaex.dataset_mmap import DatasetMemoryMapped
+import vaex.dataset_mmap
 
 logger = logging.getLogger("vaex.file")
 
@@ -31,6 +37,14 @@ try:
 except:
     if not on_rtd:
         raise
+try:
+    import hdf5plugin  # registers the blosc and lz4 filters
+except ImportError:
+    hdf5plugin = None
+
+# decompressed chunks of chunked hdf5 columns, shared by all files
+chunk_cache = vaex.cache.Cache(int(os.environ.get('VAEX_HDF5_CHUNK_CACHE_SIZE', 256 * vaex.cache.MB)), copy=False)
+_h5py_lock = threading.Lock()
 
 
 def _try_unit(unit):
@@ -54,6 +68,102 @@ def _try_unit(unit):
         return unit
 
 
+class ColumnHdf5Chunked(Column):
+    """A column backed by a chunked (and possibly compressed) hdf5 dataset, which cannot be memory mapped.
+
+    Chunks are read when a slice is requested, and kept (decompressed) in :data:`chunk_cache`, an LRU cache bounded by
+    the number of bytes. Gzip (deflate) and shuffle are undone by us, outside of the h5py lock, so the threads of
+    the executor decompress in parallel, other filters (e.g. lzf, blosc) are left to h5py. The executor aligns its
+    passes over the data with the chunks, see :attr:`chunk_offsets`.
+
+    :param data: h5py dataset
+    :param dtype: dtype of the column, when the data is stored as a different type (e.g. datetime64 as int64)
+    :param mask: mask of the column, an array (of the rows from start on) or another chunked column (without trimming)
+    """
+    def __init__(self, data, dtype=None, mask=None, start=0, stop=None):
+        self.data = data
+        self.dtype = np.dtype(dtype or data.dtype)
+        self.mask = mask
+        self.start = start
+        self.stop = len(data) if stop is None else stop
+        self.shape = (self.stop - self.start,) + (data.shape[1:] if self.dtype == data.dtype else ())
+        self.is_masked = mask is not None
+        self.chunk_length = data.chunks[0]
+        edges = np.arange(0, len(data) + self.chunk_length, self.chunk_length)
+        self.chunk_offsets = np.unique(np.clip(edges - self.start, 0, len(self))).astype(np.int64)
+        stat = os.stat(data.file.filename)
+        self._key = (data.file.filename, stat.st_mtime, stat.st_size, data.name)
+        filters = data.id.get_create_plist()
+        filters = [filters.get_filter(i)[0] for i in range(filters.get_nfilters())]
+        shuffle, deflate = h5py.h5z.FILTER_SHUFFLE, h5py.h5z.FILTER_DEFLATE
+        self._direct = hasattr(data.id, 'read_direct_chunk') and data.chunks[1:] == data.shape[1:] and\
+            filters in [[], [deflate], [shuffle], [shuffle, deflate]]
+        self._shuffle = shuffle in filters
+        self._deflate = deflate in filters
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def trim(self, i1, i2):
+        mask = self.mask
+        if mask is not None and not isinstance(mask, ColumnHdf5Chunked):
+            mask = mask[i1:i2]  # arrays are relative to start, only chunked masks are untrimmed
+        return ColumnHdf5Chunked(self.data, self.dtype, mask, self.start + i1, self.start + i2)
+
+    def __getitem__(self, slice):
+        start, stop, step = slice.start, slice.stop, slice.step
+        start = start or 0
+        stop = len(self) if stop is None else stop
+        assert step in [None, 1]
+        i1, i2 = self.start + start, self.start + stop
+        first = i1 // self.chunk_length
+        last = max(first, (i2 - 1) // self.chunk_length)
+        chunks = [self._chunk(index) for index in range(first, last + 1)]
+        array = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        offset = first * self.chunk_length
+        array = array[i1 - offset:i2 - offset]
+        if self.mask is not None:
+            if isinstance(self.mask, ColumnHdf5Chunked):
+                mask = self.mask[i1:i2]
+            else:
+                mask = self.mask[start:stop]
+            array = np.ma.array(array, mask=mask, shrink=False)
+        return array
+
+    def prefetch(self, i1, i2):
+        """Decompresses the chunks of the rows into the cache (see :class:`vaex.execution.Prefetcher`)"""
+        self[i1:i2]
+
+    def _chunk(self, index):
+        """Returns the (read only) rows of a chunk, from the cache when possible"""
+        key = self._key + (index,)
+        array = chunk_cache.get(key)
+        if array is None:
+            i1 = index * self.chunk_length
+            i2 = min(i1 + self.chunk_length, len(self.data))
+            filter_mask = None
+            if self._direct:
+                with _h5py_lock:
+                    filter_mask, raw = self.data.id.read_direct_chunk((i1,) + (0,) * (self.data.ndim - 1))
+            if filter_mask == 0:  # all filters were applied to this chunk
+                if self._deflate:
+                    raw = zlib.decompress(raw)  # releases the gil
+                if self._shuffle:
+                    itemsize = self.data.dtype.itemsize
+                    raw = np.frombuffer(raw, np.uint8).reshape(itemsize, -1).T.tobytes()
+                array = np.frombuffer(raw, self.data.dtype).reshape(self.data.chunks)[:i2 - i1]
+            else:
+                with _h5py_lock:
+                    array = self.data[i1:i2]
+            if array.dtype != self.dtype:
+                array = np.ascontiguousarray(array).view(self.dtype)
+                if self.dtype.kind == 'U':
+                    array = array.reshape(-1)
+            array.setflags(write=False)
+            chunk_cache.set(key, array)
+        return array
+
+
 class Hdf5MemoryMapped(DatasetMemoryMapped):
     """Implements the vaex hdf5 file format"""
 
@@ -62,10 +172,12 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
         self.h5file = h5py.File(self.filename, "r+" if write else "r")
         self.h5table_root_name = None
         self._version = 1
+        self._chunked = False
         try:
             self._load()
         finally:
-            self.h5file.close()
+            if not self._chunked:  # chunked columns read from the file when needed
+                self.h5file.close()
 
     def write_meta(self):
         """ucds, descriptions and units are written as attributes in the hdf5 file, instead of a seperate file as
@@ -197,23 +309,39 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
 
     def _map_hdf5_array(self, data, mask=None):
         offset = data.id.get_offset()
-        if offset is None:
-            raise Exception("columns doesn't really exist in hdf5 file")
         shape = data.shape
         dtype = data.dtype
         if "dtype" in data.attrs:
             dtype = data.attrs["dtype"]
             if dtype == 'utf32':
                 dtype = np.dtype('U' + str(data.attrs['dlength']))
+        if offset is None:
+            if data.chunks is None:
+                raise Exception("columns doesn't really exist in hdf5 file")
+            self._chunked = True
+            if mask is not None:
+                mask = self._map_hdf5_array(mask)
+            return ColumnHdf5Chunked(data, dtype, mask)
         #self.addColumn(column_name, offset, len(data), dtype=dtype)
         array = self._map_array(data.id.get_offset(), dtype=dtype, length=len(data))
         if mask is not None:
             mask_array = self._map_hdf5_array(mask)
+            if isinstance(mask_array, ColumnHdf5Chunked):
+                mask_array = mask_array[:]
+            if isinstance(array, vaex.dataset_mmap.ColumnReader):  # VAEX_NO_MMAP, the mask is read along with the data
+                return array.masked(mask_array)
             return np.ma.array(array, mask=mask_array, shrink=False)
             assert ar.mask is mask_array, "masked array was copied"
         else:
             return array
 
+    def _load_zone_map(self, column_name, h5zone_map):
+        column = self.columns[column_name]
+        self._zone_maps[column_name] = vaex.zonemaps.ZoneMap(column, h5zone_map.attrs["block_length"],
+                                                             h5zone_map["minima"][()], h5zone_map["maxima"][()],
+                                                             h5zone_map["null_counts"][()], len(column),
+                                                             masked=np.ma.isMaskedArray(column) or self.is_masked(column_name))
+
     def _load_columns(self, h5data, first=[]):
         # print h5data
         # make sure x y x etc are first
@@ -303,6 +431,8 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
                             self.add_column(column_name, self._map_hdf5_array(data, column['mask']))
                         else:
                             self.add_column(column_name, self._map_hdf5_array(data))
+                        if self._version > 1 and 'zone_map' in column:
+                            self._load_zone_map(column_name, column['zone_map'])
                             # mask = column['mask']
                             # offset = mask.id.get_offset()
                             # self.addColumn("temp_mask", offset, len(data), dtype=mask.dtype)
@@ -338,6 +468,11 @@ class Hdf5MemoryMapped(DatasetMemoryMapped):
         super(Hdf5MemoryMapped, self).close()
         self.h5file.close()
 
+    def close_files(self):
+        super(Hdf5MemoryMapped, self).close_files()
+        if self._chunked:
+            self.h5file.close()
+
     def __expose_array(self, hdf5path, column_name):
         array = self.h5file[hdf5path]
         array[0] = array[0]  # without this, get_offset returns None, probably the array isn't really created
@@ -1,7 +1,9 @@
 __author__ = 'maartenbreddels'
+import io
 import os
 import sys
 import collections
+from functools import reduce
 import numpy as np
 import logging
 import vaex
@@ -9,8 +11,10 @@ import vaex.utils
 import vaex.execution
 import vaex.export
 import vaex.hdf5.dataset
+import vaex.zonemaps
 
 max_length = int(1e5)
+chunk_length_default = 2**16  # rows per chunk of compressed columns
 
 on_rtd = os.environ.get('READTHEDOCS', None) == 'True'
 try:
@@ -18,6 +22,10 @@ try:
 except:
     if not on_rtd:
         raise
+try:
+    import hdf5plugin  # provides the blosc and lz4 filters
+except ImportError:
+    hdf5plugin = None
 
 logger = logging.getLogger("vaex.hdf5.export")
 
@@ -102,7 +110,7 @@ def export_hdf5_v1(dataset, path, column_names=None, byteorder="=", shuffle=Fals
     return
 
 
-def export_hdf5(dataset, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=True, sort=None, ascending=True):
+def export_hdf5(dataset, path, column_names=None, byteorder="=", shuffle=False, selection=False, progress=None, virtual=True, sort=None, ascending=True, compression=None, zone_maps=False):
     """
     :param DatasetLocal dataset: dataset to export
     :param str path: path for file
@@ -113,8 +121,28 @@ def export_hdf5(dataset, path, column_names=None, byteorder="=", shuffle=False,
     :param progress: progress callback that gets a progress fraction as argument and should return True to continue,
             or a default progress bar when progress=True
     :param: bool virtual: When True, export virtual columns
+    :param str compression: store the columns chunked and compressed, using 'gzip', 'lzf', 'blosc' or 'lz4' (the last
+            two require the hdf5plugin package), the columns cannot be memory mapped, but are decompressed when needed
+    :param zone_maps: store the minimum, maximum and number of missing values for each block of rows (of zone_maps rows,
+            or 65536 when True) of the numerical columns, see :mod:`vaex.zonemaps`
     :return:
     """
+    if compression:
+        options = _compression_options(compression)
+        if progress == True:
+            progress = vaex.utils.progressbar_callable(title="exporting")
+        progress = progress or (lambda value: True)
+        # we first export as usual, and compress the columns in a second pass
+        path_uncompressed = path + ".uncompressed"
+        try:
+            export_hdf5(dataset, path_uncompressed, column_names=column_names, byteorder=byteorder, shuffle=shuffle,
+                        selection=selection, progress=lambda fraction: progress(0.5 * fraction), virtual=virtual,
+                        sort=sort, ascending=ascending, zone_maps=zone_maps)
+            _compress_hdf5(path_uncompressed, path, options, progress=lambda fraction: progress(0.5 + 0.5 * fraction))
+        finally:
+            if os.path.exists(path_uncompressed):
+                os.remove(path_uncompressed)
+        return
 
     if selection:
         if selection == True:  # easier to work with the name
@@ -220,5 +248,342 @@ def export_hdf5(dataset, path, column_names=None, byteorder="=", shuffle=False,
     dataset_output.description = description
     logger.debug("writing meta information")
     dataset_output.write_meta()
+    if zone_maps:
+        block_length = vaex.zonemaps.block_length_default if zone_maps is True else int(zone_maps)
+        zone_maps = _compute_zone_maps(dataset_output, block_length)
     dataset_output.close_files()
+    if zone_maps:
+        _write_zone_maps(path, zone_maps, block_length)
     return
+
+
+def _compute_zone_maps(dataset, block_length):
+    """Returns a dict mapping the names of the numerical columns to their (minima, maxima, null_counts)"""
+    zone_maps = {}
+    for name, column in dataset.columns.items():
+        if isinstance(column, np.ndarray) and column.ndim == 1 and column.dtype.kind in 'iuf':
+            zone_maps[name] = vaex.zonemaps.compute(column, block_length)
+    return zone_maps
+
+
+def _write_zone_maps(path, zone_maps, block_length):
+    with h5py.File(path, "r+") as h5file:
+        for name, (minima, maxima, null_counts) in zone_maps.items():
+            h5zone_map = h5file.require_group("/table/columns/%s/zone_map" % name)
+            h5zone_map.attrs["block_length"] = block_length
+            h5zone_map.create_dataset("minima", data=minima)
+            h5zone_map.create_dataset("maxima", data=maxima)
+            h5zone_map.create_dataset("null_counts", data=null_counts)
+
+
+def _compression_options(compression):
+    """Returns the keyword arguments for h5py's create_dataset for the compression"""
+    if compression is True:
+        compression = 'gzip'
+    if compression == 'gzip':
+        return dict(compression='gzip', compression_opts=4, shuffle=True)
+    elif compression == 'lzf':
+        return dict(compression='lzf', shuffle=True)
+    elif compression in ['blosc', 'lz4']:
+        if hdf5plugin is None:
+            raise ValueError('compression %r requires the hdf5plugin package' % compression)
+        if compression == 'blosc':
+            return dict(hdf5plugin.Blosc(cname='lz4', shuffle=hdf5plugin.Blosc.SHUFFLE))
+        else:
+            return dict(hdf5plugin.LZ4())
+    else:
+        raise ValueError('unknown compression %r, use gzip, lzf, blosc or lz4' % compression)
+
+
+def _compress_hdf5(path, path_output, options, chunk_length=chunk_length_default, progress=None):
+    """Copies a vaex hdf5 file, storing the data and masks of the columns chunked and compressed"""
+    progress = progress or (lambda value: True)
+    with h5py.File(path, "r") as h5file, h5py.File(path_output, "w") as h5file_output:
+        h5file_output.attrs.update(h5file.attrs)
+        names = []
+        h5file.visit(names.append)
+        for i, name in enumerate(names):
+            item = h5file[name]
+            if isinstance(item, h5py.Group):
+                h5file_output.require_group(name).attrs.update(item.attrs)
+                continue
+            parts = name.split("/")
+            if len(parts) == 4 and parts[:2] == ["table", "columns"] and parts[3] in ["data", "mask"] and len(item):
+                chunks = (min(chunk_length, len(item)),) + item.shape[1:]
+                array = h5file_output.create_dataset(name, shape=item.shape, dtype=item.dtype, chunks=chunks, **options)
+                step = chunks[0] * max(1, max_length // chunks[0])
+                for i1 in range(0, len(item), step):
+                    array[i1:i1 + step] = item[i1:i1 + step]
+            else:  # e.g. sparse matrices, which need to be memory mapped
+                array = h5file_output.create_dataset(name, data=item[()])
+            array.attrs.update(item.attrs)
+            if not progress((i + 1) / float(len(names))):
+                break
+
+
+def _csv_kind(series):
+    """Returns the kind of a column of a chunk of a csv file, 'i', 'f', 'b', 'M' or 'S' (for strings)"""
+    kind = series.dtype.kind
+    if kind in 'iu':
+        return 'i'
+    elif kind in 'fbM':
+        return kind
+    else:
+        return 'S'
+
+
+def _csv_string_length(series):
+    """Returns the maximum number of (utf8 encoded) bytes of the non-missing values"""
+    values = series.dropna()
+    if len(values) == 0:
+        return 1
+    return max(1, int(values.astype(str).str.encode('utf8').str.len().max()))
+
+
+def _csv_strings(series, length):
+    return series.fillna('').astype(str).str.encode('utf8').values.astype('S%d' % length)
+
+
+def convert_csv(path, path_output, copy_index=True, index_name="index", chunk_size=int(1e6), progress=None, **kwargs):
+    """Converts a csv file to an hdf5 file, without reading the whole csv file into memory.
+
+    The csv file is read by pandas in chunks of chunk_size rows, twice. The first pass finds the number of rows and the
+    dtype of each column (as pandas would infer it for the whole file), and for strings, the maximum length and whether
+    missing values are present. The columns in the hdf5 file are then allocated at their full length, and the second
+    pass writes each chunk directly into the memory mapped columns. Integer columns with missing values become float
+    columns (like pandas does), columns of strings with missing values get a mask.
+
+    :param str path: path of the csv file
+    :param str path_output: path of the hdf5 file
+    :param bool copy_index: add a column with the row number (the index pandas would create)
+    :param str index_name: name of the index column
+    :param int chunk_size: number of rows per chunk, which bounds the memory usage
+    :param progress: progress callback that gets a progress fraction as argument and should return True to continue,
+            or a default progress bar when progress=True
+    :param kwargs: extra keyword arguments for pandas.read_csv
+    """
+    import pandas as pd
+    if progress == True:
+        progress = vaex.utils.progressbar_callable(title="converting")
+    progress = progress or (lambda value: True)
+    kwargs = dict(kwargs, chunksize=chunk_size)
+    size = max(1, os.path.getsize(path))
+
+    # first pass: the number of rows and the kinds of the columns
+    N = 0
+    kinds = collections.OrderedDict()
+    lengths = collections.defaultdict(lambda: 1)
+    missing = set()
+    numbers = set()  # columns where at least one chunk was parsed as numbers (or dates)
+    with io.open(path, 'rb') as f:
+        for chunk in pd.read_csv(f, **kwargs):
+            N += len(chunk)
+            for name in chunk.columns:
+                series = chunk[name]
+                kind = _csv_kind(series)
+                if kind == 'S':
+                    lengths[name] = max(lengths[name], _csv_string_length(series))
+                    if series.isnull().values.any():
+                        missing.add(name)
+                else:
+                    numbers.add(name)
+                previous = kinds.get(name, kind)
+                if previous != kind:
+                    kind = 'f' if set([previous, kind]) == set('if') else 'S'
+                kinds[name] = kind
+            if not progress(0.5 * f.tell() / size):
+                return
+    if N == 0:
+        raise ValueError("Cannot export empty table")
+    mixed = set(name for name in numbers if kinds[name] == 'S')
+    if mixed:
+        # we need the lengths of the strings as they are in the file, not as they were parsed
+        logger.debug("columns %r contain strings and numbers, finding the string lengths", sorted(mixed))
+        lengths_kwargs = dict(kwargs, usecols=sorted(mixed), dtype={name: str for name in mixed})
+        for chunk in pd.read_csv(path, **lengths_kwargs):
+            for name in mixed:
+                lengths[name] = max(lengths[name], _csv_string_length(chunk[name]))
+                if chunk[name].isnull().values.any():
+                    missing.add(name)
+
+    column_names = list(kinds.keys())
+    if copy_index:
+        while index_name in kinds:
+            index_name += "_"
+        column_names.append(index_name)
+    dtypes = {}
+    for name in column_names:
+        kind = kinds.get(name, 'i')
+        dtypes[name] = np.dtype({'i': np.int64, 'f': np.float64, 'b': np.bool_, 'M': 'datetime64[ns]', 'S': 'S%d' % lengths[name]}[kind])
+    _create_table(path_output, N, column_names, dtypes, [name for name in missing if kinds[name] == 'S'])
+
+    # second pass: write the chunks into the memory mapped columns
+    dataset_output = vaex.hdf5.dataset.Hdf5MemoryMapped(path_output, write=True)
+    dtypes = dict(kwargs.get('dtype') or {})
+    dtypes.update({name: str for name, kind in kinds.items() if kind == 'S'})
+    dtypes.update({name: np.float64 for name, kind in kinds.items() if kind == 'f'})
+    i1 = 0
+    try:
+        for chunk in pd.read_csv(path, **dict(kwargs, dtype=dtypes)):
+            i2 = i1 + len(chunk)
+            for name, kind in kinds.items():
+                series = chunk[name]
+                column = dataset_output.columns[name]
+                if kind == 'S':
+                    values = _csv_strings(series, lengths[name])
+                    if name in missing:
+                        column.mask[i1:i2] = series.isnull().values
+                        column = column.data
+                else:
+                    values = series.values
+                column[i1:i2] = values
+            if copy_index:
+                dataset_output.columns[index_name][i1:i2] = np.arange(i1, i2)
+            i1 = i2
+            if not progress(0.5 + 0.5 * i2 / N):
+                return
+        if i1 != N:
+            raise ValueError("csv file %r changed while converting it, expected %d rows, got %d" % (path, N, i1))
+        dataset_output.description = "file converted by vaex from %s" % path
+        dataset_output.write_meta()
+    finally:
+        dataset_output.close_files()
+    with h5py.File(path_output, "r+") as h5file_output:
+        h5file_output["/table"].attrs["source"] = _source_stamp(path)
+
+
+def _source_stamp(path):
+    """Identifies the version of a file, by its size and modification time"""
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime], dtype=np.float64)
+
+
+def _is_converted(path, path_output):
+    """Returns True when path_output was converted from path, and path did not change since"""
+    if not os.path.exists(path_output):
+        return False
+    try:
+        with h5py.File(path_output, "r") as h5file:
+            source = h5file["/table"].attrs.get("source")
+    except (IOError, OSError, KeyError):
+        return False
+    return source is not None and np.array_equal(source, _source_stamp(path))
+
+
+def _create_table(path, N, column_names, dtypes, masked):
+    """Creates an hdf5 file with (uninitialized) columns of length N, with a mask for the columns in masked"""
+    with h5py.File(path, "w") as h5file_output:
+        h5table_output = h5file_output.require_group("/table")
+        h5table_output.attrs["type"] = "table"
+        h5columns_output = h5file_output.require_group("/table/columns")
+        for name in column_names:
+            dtype = dtypes[name]
+            h5column_output = h5columns_output.require_group(name)
+            if dtype.type == np.datetime64:
+                array = h5column_output.require_dataset('data', shape=(N,), dtype=np.int64)
+                array.attrs["dtype"] = dtype.name
+            elif dtype.kind == 'U':
+                char_length = dtype.itemsize // 4
+                array = h5column_output.require_dataset('data', shape=(N, char_length), dtype=np.uint8)
+                array.attrs["dtype"] = 'utf32'
+                array.attrs["dlength"] = char_length
+            else:
+                array = h5column_output.require_dataset('data', shape=(N,), dtype=dtype)
+            array[0] = array[0]  # make sure the array really exists
+            if name in masked:
+                mask = h5column_output.require_dataset('mask', shape=(N,), dtype=np.bool)
+                mask[0] = mask[0]
+        h5columns_output.attrs["column_order"] = ",".join(column_names)
+
+
+def concatenate_hdf5(paths, path_output, progress=None):
+    """Concatenates hdf5 files with the same columns into a single hdf5 file.
+
+    The columns of each file are copied into the memory mapped columns of the output file, without evaluating them
+    through a (concatenated) DataFrame. When the dtypes of a column differ between the files, the common dtype is used
+    (e.g. the longest string, or float for integers and floats), and a mask is added when any of the files has one.
+
+    :param list[str] paths: paths of the hdf5 files
+    :param str path_output: path of the hdf5 file to write
+    :param progress: progress callback that gets a progress fraction as argument and should return True to continue,
+            or a default progress bar when progress=True
+    """
+    if progress == True:
+        progress = vaex.utils.progressbar_callable(title="concatenating")
+    progress = progress or (lambda value: True)
+    datasets = [vaex.hdf5.dataset.Hdf5MemoryMapped(path) for path in paths]
+    try:
+        column_names = datasets[0].get_column_names(strings=True)
+        for path, dataset in zip(paths, datasets):
+            if set(dataset.get_column_names(strings=True)) != set(column_names):
+                raise ValueError("cannot concatenate %r and %r, the columns differ: %r and %r" %
+                                 (paths[0], path, column_names, dataset.get_column_names(strings=True)))
+        dtypes = {name: reduce(np.promote_types, [dataset.columns[name].dtype for dataset in datasets]) for name in column_names}
+        masked = [name for name in column_names if any(np.ma.isMaskedArray(dataset.columns[name]) for dataset in datasets)]
+        N = sum(len(dataset) for dataset in datasets)
+        _create_table(path_output, N, column_names, dtypes, masked)
+        dataset_output = vaex.hdf5.dataset.Hdf5MemoryMapped(path_output, write=True)
+        try:
+            offset = 0
+            for dataset in datasets:
+                for i1 in range(0, len(dataset), max_length):
+                    i2 = min(len(dataset), i1 + max_length)
+                    for name in column_names:
+                        column = dataset.columns[name][i1:i2]
+                        target = dataset_output.columns[name]
+                        if name in masked:
+                            target.mask[offset + i1:offset + i2] = np.ma.getmaskarray(column)
+                            target = target.data
+                        target[offset + i1:offset + i2] = column.data if np.ma.isMaskedArray(column) else column
+                    if not progress((offset + i2) / float(N)):
+                        return
+                offset += len(dataset)
+            dataset_output.copy_metadata(datasets[0])
+            dataset_output.description = "file concatenated by vaex from %s" % ", ".join(paths)
+            dataset_output.write_meta()
+        finally:
+            dataset_output.close_files()
+    finally:
+        for dataset in datasets:
+            dataset.close_files()
+
+
+def convert_csv_many(paths, path_output, copy_index=True, processes=None, progress=None, **kwargs):
+    """Converts multiple csv files to a single hdf5 file.
+
+    Each csv file is converted to its own hdf5 file (with the .hdf5 extension added) by :func:`convert_csv`, in
+    parallel by a pool of worker processes. Csv files that were already converted, and did not change since (their size
+    and modification time are stored in the hdf5 file) are skipped. The hdf5 files are then concatenated into path_output
+    using :func:`concatenate_hdf5`.
+
+    :param list[str] paths: paths of the csv files
+    :param str path_output: path of the hdf5 file
+    :param bool copy_index: add a column with the row number (within each file)
+    :param int processes: number of worker processes, by default the number of cpu cores
+    :param progress: progress callback that gets a progress fraction as argument and should return True to continue,
+            or a default progress bar when progress=True
+    :param kwargs: extra keyword arguments for pandas.read_csv
+    :return: the paths of the hdf5 files of each csv file
+    """
+    import concurrent.futures
+    import vaex.multithreading
+    if progress == True:
+        progress = vaex.utils.progressbar_callable(title="converting")
+    progress = progress or (lambda value: True)
+    paths_hdf5 = [path + '.hdf5' for path in paths]
+    todo = [(path, path_hdf5) for path, path_hdf5 in zip(paths, paths_hdf5) if not _is_converted(path, path_hdf5)]
+    logger.debug("converting %d of %d csv files", len(todo), len(paths))
+    if todo:
+        processes = min(len(todo), processes or vaex.multithreading.thread_count_default)
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(convert_csv, path, path_hdf5, copy_index=copy_index, **kwargs) for path, path_hdf5 in todo]
+            try:
+                for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                    future.result()  # raises the exception of a worker
+                    if not progress(0.5 * (i + 1) / len(futures)):
+                        return
+            finally:
+                for future in futures:
+                    future.cancel()
+    concatenate_hdf5(paths_hdf5, path_output, progress=lambda fraction: progress(0.5 + 0.5 * fraction))
+    return paths_hdf5
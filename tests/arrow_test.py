@@ -0,0 +1,87 @@
+from common import *
+import pyarrow as pa
+import vaex_arrow.dataset  # registers the arrow format
+
+
+def _write_batches(path, stream):
+    batches = []
+    for i1, i2 in [(0, 4), (4, 5), (5, 10)]:
+        x = pa.array(list(range(i1, i2)), type=pa.int64())
+        y = pa.array([None if i % 3 == 0 else float(i) for i in range(i1, i2)])
+        s = pa.array([None if i == 7 else 'naïve' * (i % 3) for i in range(i1, i2)])
+        b = pa.array([i % 2 == 0 for i in range(i1, i2)])
+        batches.append(pa.RecordBatch.from_arrays([x, y, s, b], ['x', 'y', 's', 'b']))
+    with pa.OSFile(path, 'wb') as sink:
+        writer = (pa.RecordBatchStreamWriter if stream else pa.RecordBatchFileWriter)(sink, batches[0].schema)
+        for batch in batches:
+            writer.write_batch(batch)
+        writer.close()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_arrow_chunks(tmpdir, stream):
+    path = str(tmpdir.join('test.arrow'))
+    _write_batches(path, stream)
+    df = vaex.open(path)
+    assert len(df) == 10
+    assert df.columns['x'].chunk_offsets.tolist() == [0, 4, 5, 10]
+    assert df.x.tolist() == list(range(10))
+    assert df.y.tolist() == [None if i % 3 == 0 else i for i in range(10)]
+    assert df.s.dtype == np.dtype('O')
+    assert df.s.tolist() == [None if i == 7 else 'naïve' * (i % 3) for i in range(10)]
+    assert df.b.tolist() == [i % 2 == 0 for i in range(10)]
+    assert df.columns['x'][1:3].base is not None  # a view on the memory mapped batch
+    with small_buffer(df, 3):
+        assert df.sum('x') == 45
+        assert df.count('y') == 6
+        assert df.s.value_counts().to_dict() == {'': 4, 'naïve': 2, 'naïvenaïve': 3, 'missing': 1}
+
+    parts = []
+    with small_buffer(df, 3):
+        df.map_reduce(lambda thread_index, i1, i2, x: parts.append((i1, i2)), lambda a, b: a, ['x'], info=True)
+    assert sorted(parts) == [(0, 3), (3, 5), (5, 9), (9, 10)]
+
+    df.set_active_range(3, 8)
+    dft = df.trim()
+    assert dft.x.tolist() == [3, 4, 5, 6, 7]
+    assert dft.s.tolist() == ['', 'naïve', 'naïvenaïve', '', None]
+    assert dft.columns['x'].chunk_offsets.tolist() == [0, 1, 2, 5]
+    df.close_files()
+
+
+def test_arrow_strings_slice():
+    import vaex_arrow.convert
+    values = ['aap', None, 'noot', 'naïve', ''] * 3
+    array = pa.array(values)
+    for i1 in range(len(values)):
+        for i2 in range(i1, len(values) + 1):
+            # only the bytes of the slice are converted, with the offsets relative to the first value
+            strings = vaex_arrow.convert.numpy_array_from_arrow_array(array.slice(i1, i2 - i1))
+            assert strings.tolist() == values[i1:i2]
+
+
+def test_export_arrow(tmpdir):
+    x = np.ma.array(np.arange(10), mask=np.arange(10) % 4 == 1)
+    s = np.array(['a', 'bb', 'ccc', 'dddd', 'e'] * 2)
+    df = vaex.from_arrays(x=x, s=s, i=np.arange(10))
+    df['y'] = df.x * 2
+    path = str(tmpdir.join('test.arrow'))
+    with small_buffer(df, 3):
+        df.export_arrow(path, virtual=True)
+    dfa = vaex.open(path)
+    assert dfa.get_column_names() == ['x', 's', 'i', 'y']
+    assert len(dfa.columns['x'].chunks) == 4  # a record batch per chunk
+    assert dfa.x.tolist() == x.tolist()
+    assert dfa.y.tolist() == (x * 2).tolist()
+    assert dfa.s.tolist() == s.tolist()
+    dfa.close_files()
+
+    dff = df[df.i > 2]
+    dff.select(dff.i < 8)
+    with small_buffer(dff, 3):
+        dff.export_arrow(path, selection=True, virtual=True)
+    dfa = vaex.open(path)
+    assert dfa.x.tolist() == [3, 4, None, 6, 7]
+    assert dfa.y.tolist() == [6, 8, None, 12, 14]
+    assert dfa.s.tolist() == ['dddd', 'e', 'a', 'bb', 'ccc']
+    dfa.close_files()
@@ -0,0 +1,239 @@
+from common import *
+import os
+import subprocess
+import sys
+import vaex.cache
+
+
+def test_cache_lru():
+    cache = vaex.cache.Cache(maxsize=80)
+    cache.set('a', np.zeros(8))  # 64 bytes
+    assert cache.get('a').tolist() == [0] * 8
+    cache.get('a')[:] = 1  # we get a copy
+    assert cache.get('a').tolist() == [0] * 8
+    cache.set('b', np.zeros(4))
+    assert 'a' not in cache  # evicted, since 64 + 32 > 80
+    assert cache.get('b') is not None
+    cache.set('c', np.zeros(100))  # too large
+    assert 'c' not in cache
+    assert cache.get('c', 42) == 42
+
+
+def test_cache_disk(tmpdir):
+    cache = vaex.cache.Cache(maxsize=100, path=str(tmpdir), disk_maxsize=1500)
+    cache.set('a', np.arange(8.))
+    cache.set('b', np.arange(100.))  # does not fit in memory, but on disk
+    assert cache.get('b').tolist() == list(range(100))
+    cache = vaex.cache.Cache(maxsize=100, path=str(tmpdir), disk_maxsize=1500)  # e.g. a new process
+    assert cache.get('a').tolist() == list(range(8))
+    cache.set('c', np.arange(100.))  # makes the disk cache too large
+    assert 'a' not in cache or 'b' not in cache
+    assert cache.get('c') is not None
+    cache.clear()
+    assert 'c' not in cache
+
+
+def test_cache_executor(tmpdir):
+    x = np.arange(10.)
+    path = str(tmpdir.join('test.hdf5'))
+    vaex.from_arrays(x=x).export_hdf5(path)
+    cache = vaex.cache.Cache()
+    df = vaex.open(path)
+    df.executor = vaex.execution.Executor(cache=cache)
+    assert df.sum('x + 1') == 55
+    passes = df.executor.passes
+    assert df.sum('x+1') == 55  # only a formatting difference
+    assert df.executor.passes == passes
+    assert cache.hits == 1
+
+    # the state of the DataFrame is part of the key
+    df.add_variable('a', 2)
+    df.select(df.x < 5)
+    assert df.sum('x + a', selection=True) == 20
+    df.select(df.x < 4)
+    assert df.sum('x + a', selection=True) == 14
+    df.set_variable('a', 1)
+    assert df.sum('x + a', selection=True) == 10
+    dff = df[df.x > 7]
+    assert dff.sum('x + 1') == 19
+
+    # as is the data
+    vaex.from_arrays(x=x * 2).export_hdf5(path)
+    df2 = vaex.open(path)
+    df2.executor = df.executor
+    assert df2.sum('x + 1') == 100
+
+    # in memory data is not cached
+    df = vaex.from_arrays(x=x)
+    df.executor = vaex.execution.Executor(cache=cache)
+    hits = cache.hits
+    assert df.sum('x + 1') == 55
+    assert df.sum('x + 1') == 55
+    assert cache.hits == hits
+
+
+def test_cache_write(tmpdir):
+    # files opened for writing can be modified in place, without changing the modification time or size
+    path = str(tmpdir.join('test.hdf5'))
+    vaex.from_arrays(x=np.arange(10.)).export_hdf5(path)
+    cache = vaex.cache.Cache()
+    df = vaex.open(path, write=True)
+    df.executor = vaex.execution.Executor(cache=cache)
+    df.columns['x'][:] = 1
+    assert df.sum('x') == 10
+    df.columns['x'][:] = 2
+    assert df.sum('x') == 20
+    assert cache.hits == 0
+    df.close_files()
+
+    # while read only files are cached
+    df = vaex.open(path)
+    df.executor = vaex.execution.Executor(cache=cache)
+    assert df.sum('x') == 20
+    assert df.sum('x') == 20
+    assert cache.hits == 1
+    df.close_files()
+
+
+def test_cache_default():
+    # the cache is opt-in, see VAEX_CACHE_SIZE
+    code = "import vaex.cache; print(vaex.cache.get_default())"
+    env = dict(os.environ)
+    env.pop('VAEX_CACHE_SIZE', None)
+    assert subprocess.check_output([sys.executable, '-c', code], env=env).strip() == b'None'
+
+
+def test_cache_fresh_interpreter():
+    # the cache looks at the memory mapped files, which should not depend on the order of imports
+    code = "import vaex, numpy as np; print(vaex.from_arrays(x=np.arange(10.)).sum('x'))"
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'45.0'
+
+
+def test_cache_resume(tmpdir):
+    x = np.arange(1000.)
+    path = str(tmpdir.join('test.hdf5'))
+    executor = vaex.execution.Executor(cache=vaex.cache.Cache(), buffer_size=100, resume=True)
+
+    def statistics(df):
+        df.executor = executor
+        sum = df.sum('x', delay=True)
+        tasks = list(executor.task_queue)
+        minmax = df.minmax('y', delay=True)
+        first = df.first('x', '-x', delay=True)
+        count = df.count(binby='x', limits=[0, 1000], shape=2, delay=True)
+        df.execute()
+        return [sum.get(), minmax.get().tolist(), first.get(), count.get().tolist()], tasks[0].row_start
+
+    # the file grows by appending rows
+    for length in [500, 800]:
+        vaex.from_arrays(x=x[:length], y=np.ma.array(x[:length], mask=x[:length] % 5 == 0)).export_hdf5(path)
+        df = vaex.open(path)
+        values, row_start = statistics(df)
+        assert values == [x[:length].sum(), [1, length - 1], length - 1, [500, length - 500]]
+        assert row_start == (0 if length == 500 else 500)
+        df.close_files()
+
+    # when the existing rows are modified, we cannot resume
+    vaex.from_arrays(x=x[::-1].copy(), y=np.ma.array(x, mask=x % 5 == 0)).export_hdf5(path)
+    df = vaex.open(path)
+    values, row_start = statistics(df)
+    assert values == [x.sum(), [1, 999], 999, [500, 500]]
+    assert row_start == 0
+    df.close_files()
+
+    # or when the active range does not start at 0
+    df = vaex.open(path)
+    df.set_active_range(100, 1000)
+    values, row_start = statistics(df)
+    assert row_start == 0
+
+
+def test_cache_resume_modified_prefix(tmpdir):
+    x = np.arange(100000.)
+    path = str(tmpdir.join('test.hdf5'))
+    for resume in [False, True]:
+        executor = vaex.execution.Executor(cache=vaex.cache.Cache(), resume=resume)
+        vaex.from_arrays(x=x).export_hdf5(path)
+        df = vaex.open(path)
+        df.executor = executor
+        assert df.sum('x') == x.sum()
+        df.close_files()
+
+        # a row of the earlier pass is modified, and rows are appended
+        y = np.concatenate([x, [100000., 100001.]])
+        y[51234] += 1e6
+        vaex.from_arrays(x=y).export_hdf5(path)
+        df = vaex.open(path)
+        df.executor = executor
+        sum = df.sum('x', delay=True)
+        task = executor.task_queue[0]
+        df.execute()
+        assert sum.get() == y.sum()
+        assert task.row_start == 0
+        df.close_files()
+
+
+def test_cache_resume_digests(tmpdir, monkeypatch):
+    x = np.arange(1000.)
+    path = str(tmpdir.join('test.hdf5'))
+    executor = vaex.execution.Executor(cache=vaex.cache.Cache(), buffer_size=100, resume=True)
+    calls = []
+    rows_digests = vaex.cache.rows_digests
+
+    def rows_digests_logged(df, rows, *args, **kwargs):
+        calls.append((rows, kwargs['columns']))
+        return rows_digests(df, rows, *args, **kwargs)
+    monkeypatch.setattr(vaex.cache, 'rows_digests', rows_digests_logged)
+    for length, y in [(500, x[:500]), (800, -x[:800])]:
+        # y is modified, but the tasks do not depend on it
+        vaex.from_arrays(x=x[:length], y=y).export_hdf5(path)
+        df = vaex.open(path)
+        df.executor = executor
+        sum = df.sum('x', delay=True)
+        mean = df.mean('x', delay=True)
+        tasks = list(executor.task_queue)
+        calls[:] = []
+        df.execute()
+        assert [sum.get(), mean.get()] == [x[:length].sum(), x[:length].mean()]
+        assert [task.row_start for task in tasks] == ([0, 0] if length == 500 else [500, 500])
+        # the digests of the rows are computed once for all tasks, and only for the column x
+        assert calls == ([(500, ['x'])] if length == 500 else [(500, ['x']), (800, ['x'])])
+        df.close_files()
+
+
+def test_selection_mask_cache():
+    df = vaex.from_arrays(x=np.arange(10.))
+    df['y'] = df.x + 1
+    cache = vaex.cache.SelectionMaskCache()
+    cache.attach(df)
+    with small_buffer(df, 3):
+        assert df[df.x > 1].count(selection='y < 5') == 2
+        assert len(cache) > 0
+        assert cache.size < 100  # bit packed
+        hits = cache.hits
+        assert df[df.x > 1].count(selection='y < 5') == 2  # a new copy, which uses the masks of the other copy
+        assert cache.hits > hits
+        df['y'] = df.x
+        assert len(cache) == 0
+        assert df[df.x > 1].count(selection='y < 5') == 3
+        assert df[df.x > 2].count(selection='y < 5') == 2
+
+
+def test_selection_mask_cache_columns():
+    df = vaex.from_arrays(x=np.arange(10.))
+    cache = vaex.cache.SelectionMaskCache()
+    cache.attach(df)
+    with small_buffer(df, 3):
+        assert df[df.x < 3].count() == 3
+        # a copy with another column x should not use the masks
+        dfc = df.copy()
+        dfc.add_column('x', np.zeros(10))
+        assert dfc[dfc.x < 3].count() == 10
+        assert df[df.x < 3].count() == 3
+
+        # nor a copy with trimmed columns
+        assert df[df.x > 7].count() == 2
+        df.set_active_range(4, 10)
+        dft = df.trim()
+        assert dft[dft.x > 7].count() == 2
+        assert dft[dft.x > 7].x.tolist() == [8, 9]
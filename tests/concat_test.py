@@ -44,3 +44,34 @@ def test_concat_unequals_virtual_columns():
     ds = vaex.concat([ds1, ds2])
     assert ds.w.tolist() == [1+2, 2+3]
     assert ds.z.tolist() == [1+2, 2*3]
+
+
+def test_concat_offsets(tmpdir):
+    lengths = [3, 0, 5, 2, 7]
+    paths = []
+    for i, length in enumerate(lengths):
+        if length:
+            path = str(tmpdir.join('%d.hdf5' % i))
+            vaex.from_arrays(x=np.arange(length) + sum(lengths[:i]), y=np.arange(length) * 2.).export_hdf5(path)
+            paths.append(path)
+    dfs = [vaex.open(path) for path in paths]
+    # an empty DataFrame in the middle
+    dfs.insert(1, dfs[0][dfs[0].x < 0].extract())
+    df = vaex.concat(dfs)
+    column = df.columns['x']
+    assert column.chunk_offsets.tolist() == [0, 3, 8, 10, 17]
+    assert column[4:7].tolist() == [4, 5, 6]
+    assert np.shares_memory(column[4:7], dfs[2].columns['x'])  # within a file, we get a view
+    assert column[2:12].tolist() == list(range(2, 12))
+    assert df.x.tolist() == list(range(17))
+
+    executor = df.executor
+    previous = executor.split_chunks, executor.buffer_size
+    executor.split_chunks, executor.buffer_size = True, 4
+    try:
+        parts = []
+        df.map_reduce(lambda thread_index, i1, i2, x: parts.append((i1, i2)), lambda a, b: a, ['x'], info=True)
+        assert df.sum('x') == sum(range(17))
+    finally:
+        executor.split_chunks, executor.buffer_size = previous
+    assert sorted(parts) == [(0, 3), (3, 4), (4, 8), (8, 10), (10, 12), (12, 16), (16, 17)]
@@ -0,0 +1,48 @@
+from common import *
+import vaex.distributed
+
+
+def test_distributed(webserver, server):
+    df = vaex.from_arrays(x=np.arange(1000.))
+    df.name = 'distributed'
+    webserver.set_datasets([df])
+    other = vaex.server("%s://localhost:%d" % (scheme, test_port))
+    try:
+        datasets = [s.datasets(as_dict=True)['distributed'] for s in [server, other]]
+        dfd = vaex.distributed.DatasetDistributed(datasets)
+        assert dfd.count('x') == 1000
+        assert dfd.sum('x') == df.sum('x')
+        assert dfd.minmax('x').tolist() == [0, 999]
+        assert dfd.count('x', selection='x < 10') == 10
+        assert dfd.count('x', binby='x', limits=[0, 1000], shape=4).tolist() == [250] * 4
+        assert all(worker.throughput for worker in dfd.scheduler.workers)
+        # the active range of the servers is restored
+        assert datasets[0].get_active_range() == (0, 1000)
+
+        dfd.set_active_range(100, 200)
+        assert dfd.sum('x') == df.x.values[100:200].sum()
+    finally:
+        other.close()
+
+
+def test_distributed_failures(webserver, server):
+    df = vaex.from_arrays(x=np.arange(1000.))
+    df.name = 'distributed'
+    webserver.set_datasets([df])
+    dfr = server.datasets(as_dict=True)['distributed']
+    # a server that does not serve the dataset fails for all ranges
+    failing = vaex.remote.DatasetRest(server, 'doesnotexist', dfr.column_names, {'x': 'float64'}, len(df))
+    dfd = vaex.distributed.DatasetDistributed([failing, dfr])
+    assert dfd.sum('x') == df.sum('x')  # the failed ranges are done by the other server
+    workers = dfd.scheduler.workers
+    assert not workers[0].alive
+    assert workers[1].alive
+
+    # errors of the calculation itself are not retried
+    with pytest.raises(NameError):
+        dfd.sum('doesnotexist')
+    assert workers[1].alive
+
+    dfd = vaex.distributed.DatasetDistributed([failing])
+    with pytest.raises(RuntimeError):
+        dfd.sum('x')
@@ -0,0 +1,122 @@
+from common import *
+import vaex.execution
+import vaex.processpool
+
+
+def test_plan_shared_subexpressions():
+    x = np.arange(10.)
+    y = x**2
+    df = vaex.from_arrays(x=x, y=y)
+    calls = []
+
+    def f(x):
+        calls.append(len(x))
+        return x + 1
+    df.add_function('f', f)
+    df['r'] = 'sqrt(f(x)**2 + y)'
+    expressions = ['r', 'r * 2', 'f(x)**2 + y', 'x', 'f(x) * y']
+    plan = vaex.execution.ExpressionPlan(df, expressions)
+    # f(x), f(x)**2 + y and sqrt(...) are shared
+    assert len(plan.nodes) == 3
+    assert plan.codes['x'] is None
+
+    with small_buffer(df, 5):
+        for expression in expressions:
+            df.sum(expression, delay=True)
+        df.executor.execute()
+    # f is evaluated once per chunk
+    assert sum(calls) == len(x)
+    for expression in expressions:
+        assert df.sum(expression) == pytest.approx(df.evaluate(expression).sum())
+
+
+def test_shared_statistics():
+    x = np.arange(10.)
+    df = vaex.from_arrays(x=x, y=np.ma.array(x, mask=x == 3))
+    df = df[df.x > 1]
+    df.select(df.x < 7)
+    with small_buffer(df, 3):
+        counts = [df.count('y', binby='x', limits=[0, 10], shape=10, selection=selection, delay=True) for selection in [None, True]]
+        sums = [df.sum('y', binby='x', limits=[0, 10], shape=5, selection=selection, delay=True) for selection in [None, True]]
+        df.executor.execute()
+    assert counts[0].get().tolist() == [0, 0, 1, 0, 1, 1, 1, 1, 1, 1]
+    assert counts[1].get().tolist() == [0, 0, 1, 0, 1, 1, 1, 0, 0, 0]
+    assert sums[0].get().tolist() == [0, 2, 9, 13, 17]
+    assert sums[1].get().tolist() == [0, 2, 9, 6, 0]
+
+
+def test_chunk_planner():
+    planner = vaex.execution.ChunkPlanner(nthreads=4, min_size=10, cache_size=8000)
+    # 8 bytes per row, 4 threads: 250 rows fit into the cache
+    assert planner.chunk_size('key', 8, max_size=1000) == 250
+    assert planner.chunk_size('key', 8, max_size=100) == 100
+    assert planner.chunk_size('key', 1000, max_size=100) == 10
+    planner.record('key', 1000, 1.)  # 1000 rows per second, 0.1 seconds per chunk
+    assert planner.chunk_size('key', 8, max_size=1000) == 100
+
+    parts = planner.parts(1000, 100)
+    assert parts[0] == (0, 100)
+    assert parts[-1][1] == 1000
+    assert all(i2 == next_i1 for (i1, i2), (next_i1, next_i2) in zip(parts[:-1], parts[1:]))
+    sizes = [i2 - i1 for i1, i2 in parts]
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[-2] == 10  # guided towards the end
+    parts_reversed = planner.parts(1000, 100, reverse=True)
+    assert parts_reversed[0] == (900, 1000)
+    assert parts_reversed[-1][0] == 0
+
+
+def test_adaptive_executor():
+    x = np.arange(1000.)
+    executor = vaex.execution.Executor(vaex.multithreading.ThreadPoolIndex(max_workers=2), buffer_size=100, adaptive=True)
+    executor.chunk_planner.min_size = 10
+    df = vaex.from_arrays(x=x)
+    df.executor = executor
+    df.select(df.x < 500)
+    for i in range(3):
+        assert df.sum('x') == x.sum()
+        assert df.count('x', selection=True) == 500
+    assert len(executor.chunk_planner.throughput) > 0
+
+
+def test_process_executor(tmpdir):
+    x = np.arange(1000.)
+    y = np.ma.array(x**2, mask=x % 3 == 0)
+    path = str(tmpdir.join('test.hdf5'))
+    vaex.from_arrays(x=x, y=y).export_hdf5(path)
+    df_file = df = vaex.open(path)
+    df['z'] = df.x * 2 + 1
+    df = df[df.x < 800]
+    df.select(df.x > 100)
+    expected = [df.sum('z'), df.count('y', selection=True), df.minmax('y').tolist(), df.count(binby='x', limits=[0, 1000], shape=4).tolist()]
+    executor = vaex.processpool.ExecutorProcess(processes=2, buffer_size=100)
+    try:
+        df.executor = executor
+        assert [df.sum('z'), df.count('y', selection=True), df.minmax('y').tolist(), df.count(binby='x', limits=[0, 1000], shape=4).tolist()] == expected
+        assert executor.process_pool is not None
+        # tasks other than statistics, and in memory DataFrames, use the threads
+        df_file.executor = executor
+        assert df_file.sort('x', ascending=False).x.tolist() == x[::-1].tolist()
+        df_memory = vaex.from_arrays(x=x)
+        df_memory.executor = executor
+        assert df_memory.sum('x') == x.sum()
+    finally:
+        executor.close()
+
+
+def test_prefetch(tmpdir):
+    x = np.arange(1000.)
+    df = vaex.from_arrays(x=x, y=x**2, z=np.ma.array(x, mask=x < 10))
+    path = str(tmpdir.join('test.hdf5'))
+    df.export_hdf5(path)
+    df = vaex.open(path)
+    dff = df[df.z > 100]
+    dff.select(dff.x < 500)
+    assert sorted(vaex.execution._needed_columns(dff, [vaex.tasks.TaskValueCounts(dff, 'x', selection=True)], ['x'])) == ['x', 'z']
+    with small_buffer(dff, 100):
+        assert dff.sum('x', selection=True) == x[101:500].sum()
+    stats = dff.executor.pass_stats
+    assert stats['prefetch']
+    assert stats['rows'] == 1000
+    assert stats['io_wait'] >= 0 and stats['compute'] > 0
+    df.close_files()
@@ -8,4 +8,116 @@ def test_export(ds_local, tmpdir):
 	ds.export_hdf5(path)
 	ds = ds.sample(5)
 	path = str(tmpdir.join('sample.hdf5'))
-	ds.export_hdf5(path)
\ No newline at end of file
+	ds.export_hdf5(path)
+
+@pytest.mark.parametrize("compression", ['gzip', 'lzf'])
+def test_export_hdf5_compressed(tmpdir, compression):
+	x = np.ma.array(np.arange(10.), mask=np.arange(10) % 4 == 1)
+	t = np.arange('2019-01-01', '2019-01-11', dtype='datetime64[D]')
+	df = vaex.from_arrays(x=x, t=t, i=np.arange(10))
+	path = str(tmpdir.join('compressed.hdf5'))
+	df.export_hdf5(path, compression=compression)
+	path_chunked = str(tmpdir.join('chunked.hdf5'))
+	vaex.hdf5.export._compress_hdf5(path, path_chunked, vaex.hdf5.export._compression_options(compression), chunk_length=4)
+	for path in [path, path_chunked]:
+		dfc = vaex.open(path)
+		column = dfc.columns['x']
+		assert isinstance(column, vaex.hdf5.dataset.ColumnHdf5Chunked)
+		assert dfc.is_masked('x')
+		assert dfc.x.tolist() == x.tolist()
+		assert dfc.t.tolist() == t.tolist()
+		with small_buffer(dfc, 3):
+			assert dfc.sum('i') == 45
+			assert dfc.count('x') == 7
+		dfc.set_active_range(3, 9)
+		dft = dfc.trim()
+		assert dft.x.tolist() == x[3:9].tolist()
+		assert dft.i.tolist() == list(range(3, 9))
+		dfc.close_files()
+	assert column.chunk_offsets.tolist() == [0, 4, 8, 10]
+	with pytest.raises(ValueError):
+		df.export_hdf5(path, compression='zip')
+
+	# a mask that is not chunked (an array) should be trimmed like the data
+	dfc = vaex.open(path)
+	mask = np.arange(10) % 3 == 0
+	column = vaex.hdf5.dataset.ColumnHdf5Chunked(dfc.columns['i'].data, mask=mask)
+	i = np.ma.array(np.arange(10), mask=mask)
+	assert column.trim(3, 9)[:].tolist() == i[3:9].tolist()
+	assert column.trim(3, 9).trim(1, 5)[1:4].tolist() == i[5:8].tolist()
+	dfc.close_files()
+
+
+@pytest.mark.parametrize("compression", [None, 'gzip'])
+def test_export_hdf5_zone_maps(tmpdir, compression):
+	y = np.arange(20.)
+	y[5] = np.nan
+	m = np.ma.array(np.arange(20), mask=np.arange(20) % 7 == 3)
+	df = vaex.from_arrays(x=np.arange(20), y=y, m=m)
+	path = str(tmpdir.join('zone_maps.hdf5'))
+	df.export_hdf5(path, zone_maps=4, compression=compression)
+	df = vaex.open(path)
+	assert sorted(df._zone_maps) == ['m', 'x', 'y']
+	assert df._zone_maps['y'].null_counts.tolist() == [0, 1, 0, 0, 0]
+	assert vaex.zonemaps.expression_segments(df, '(x > 9) & (y < 14)', 0, 20) == [(0, 8, 0), (8, 16, -1), (16, 20, 0)]
+	with small_buffer(df, 3):
+		df.select('x > 9')
+		assert df.count('*', selection=True) == 10
+		assert df.sum('x', selection=True) == sum(range(10, 20))
+		assert df.executor.pass_stats['skipped'] == 8  # the blocks with x <= 7
+		assert df.count('y') == 19
+		assert df.minmax('y').tolist() == [0, 19]
+	with small_buffer(df, 8):  # parts cover whole blocks
+		assert df.minmax('x').tolist() == [0, 19]
+		assert df.executor.pass_stats['skipped'] == 20  # all from the zone maps
+	with small_buffer(df, 3):
+		assert df.count('m') == 17
+		assert df.minmax('m').tolist() == [0, 19]
+		dff = df[(df.x >= 8) | (df.y < 1)]
+		assert len(dff) == 13
+		assert dff.minmax('x').tolist() == [0, 19]
+		assert dff.m.tolist() == [0] + [None if i % 7 == 3 else i for i in range(8, 20)]
+
+	df.set_active_range(2, 17)
+	dft = df.trim()
+	assert dft._zone_maps['x'].offset == 2
+	with small_buffer(dft, 3):
+		assert dft.count('x', selection='x > 12') == 4
+		assert dft.minmax('x').tolist() == [2, 16]
+	dft['x'] = dft.x * 2  # the zone map is not used for the renamed column
+	assert vaex.zonemaps.get(dft, 'x') is None
+	assert dft.minmax('x').tolist() == [4, 32]
+	df.close_files()
+
+
+def test_export_hdf5_zone_maps_masked(tmpdir):
+	# True | masked and ~masked are masked (not selected), with or without zone maps
+	x = np.arange(1000.) % 100
+	y = np.ma.array(np.arange(1000.) % 50, mask=np.arange(1000) % 7 == 0)
+	dfs = []
+	for zone_maps in [None, 64]:
+		path = str(tmpdir.join('zone_maps_%s.hdf5' % zone_maps))
+		vaex.from_arrays(x=x, y=y).export_hdf5(path, zone_maps=zone_maps)
+		dfs.append(vaex.open(path))
+	expressions = ['(x > 90) | (y > 40)', '(x < 200) | (y > 40)', '(x > 90) & (y > 40)', '~((x < 200) & (y > 40))',
+				   '~(y < -1)', '(x < 200) | ~(y > 40)']
+	counts = []
+	for df in dfs:
+		counts.append([])
+		for expression in expressions:
+			df.select(expression)
+			counts[-1].append(df.count(selection=True))
+		df.select('x < 200')
+		df.select('y > 40', mode='or')
+		counts[-1].append(df.count(selection=True))
+		df.select('y > -1')
+		df.select('x > 200', mode='xor')
+		counts[-1].append(df.count(selection=True))
+	assert counts[0] == counts[1]
+	assert counts[1][1] == 857
+	# while the blocks of columns without missing values are still known
+	dfs[1].select('(x > 200) | (x < -1)')
+	assert dfs[1].count(selection=True) == 0
+	assert dfs[1].executor.pass_stats['skipped'] == 1000
+	for df in dfs:
+		df.close_files()
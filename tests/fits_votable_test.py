@@ -0,0 +1,113 @@
+from common import *
+import os
+import astropy.io.fits
+import astropy.io.votable
+import astropy.table
+import vaex.file.other
+
+
+def test_fits_lazy_columns(tmpdir):
+    path = str(tmpdir.join('test.fits'))
+    columns = [
+        astropy.io.fits.Column(name='a', format='J', array=np.arange(5, dtype=np.int32)),
+        astropy.io.fits.Column(name='b', format='D', array=np.arange(5) * 1.5),
+        astropy.io.fits.Column(name='u', format='I', bzero=32768, array=np.array([0, 1, 65535, 3, 4], dtype=np.uint16)),
+        astropy.io.fits.Column(name='n', format='J', null=-1, array=np.array([1, -1, 3, 4, 5], dtype=np.int32)),
+        astropy.io.fits.Column(name='v', format='3E', array=np.arange(15, dtype=np.float32).reshape(5, 3)),
+    ]
+    astropy.io.fits.BinTableHDU.from_columns(columns).writeto(path)
+    df = vaex.open(path)
+    for name in 'abun':
+        assert isinstance(df.columns[name], vaex.file.other.ColumnFits)
+    assert df.a.tolist() == list(range(5))
+    assert df.b.tolist() == [0, 1.5, 3, 4.5, 6]
+    assert df.u.tolist() == [0, 1, 65535, 3, 4]
+    assert df.n.tolist() == [1, None, 3, 4, 5]
+    with small_buffer(df, 2):
+        assert df.sum('a') == 10
+        assert df.count('n') == 4
+    df.set_active_range(1, 4)
+    assert df.trim().u.tolist() == [1, 65535, 3]
+    df.close_files()
+
+    df = vaex.open(path, column_names=['b', 'u'])
+    assert df.get_column_names() == ['b', 'u']
+    df.close_files()
+
+
+def test_fits_bundled(tmpdir):
+    # the columns that are not mapped (strings) are read by astropy
+    basedir = os.path.join(os.path.dirname(vaex.__file__), 'test', 'files')
+    df = vaex.open(os.path.join(basedir, 'gaia-small-fits-basic.fits'))
+    dfc = vaex.open(os.path.join(basedir, 'gaia-small-colfits-basic.fits'))
+    assert isinstance(df.columns['ra'], vaex.file.other.ColumnFits)
+    assert df.get_column_names() == dfc.get_column_names()
+    assert df.phot_variable_flag.tolist() == dfc.phot_variable_flag.tolist()
+    assert df.ra.tolist() == dfc.ra.tolist()
+    path = str(tmpdir.join('test.hdf5'))
+    df.export_hdf5(path)
+    dfh = vaex.open(path)
+    assert dfh.phot_variable_flag.tolist() == dfc.phot_variable_flag.tolist()
+    dfh.close_files()
+    df.close_files()
+    dfc.close_files()
+
+
+def test_votable_tabledata(tmpdir):
+    path = str(tmpdir.join('test.vot'))
+    table = astropy.table.Table()
+    table['a'] = np.arange(5)
+    table['b'] = astropy.table.MaskedColumn([0, 1.5, 3, 4.5, 6], mask=[0, 0, 1, 0, 0], unit='km')
+    table['c'] = ['x', 'yy', 'z', 'w', 'q']
+    table.write(path, format='votable')
+    df = vaex.open(path)
+    assert df.get_column_names() == ['a', 'b', 'c']
+    assert df.a.tolist() == list(range(5))
+    assert df.b.tolist() == [0, 1.5, None, 4.5, 6]
+    assert df.c.tolist() == ['x', 'yy', 'z', 'w', 'q']
+    assert str(df.unit('b')) == 'km'
+
+    df = vaex.open(path, column_names=['c'])
+    assert df.get_column_names() == ['c']
+    assert df.c.tolist() == ['x', 'yy', 'z', 'w', 'q']
+
+    # the binary serialization is read by astropy
+    table.write(path, format='votable', tabledata_format='binary', overwrite=True)
+    df = vaex.open(path, column_names=['a', 'b'])
+    assert df.get_column_names() == ['a', 'b']
+    assert df.a.tolist() == list(range(5))
+
+
+def test_votable_tabledata_astropy():
+    # the same dtypes (char as bytes), masks and values as astropy
+    path = os.path.join(os.path.dirname(vaex.__file__), 'test', 'files', 'gaia-small-votable.vot')
+    table = astropy.io.votable.parse(path).get_first_table().array
+    df = vaex.open(path)
+    assert df.get_column_names() == list(table.dtype.names)
+    assert df.columns['parallax'].mask.sum() == 25  # NaN
+    assert df.columns['phot_variable_flag'].dtype.kind == 'S'
+    for name in table.dtype.names:
+        column = df.columns[name]
+        assert np.ma.isMaskedArray(column)
+        assert column.dtype == table[name].dtype or table[name].dtype.kind == 'O'
+        assert column.mask.tolist() == table[name].mask.tolist()
+        assert column.tolist() == table[name].tolist()
+
+
+def test_votable_tabledata_arrays(tmpdir, caplog):
+    path = str(tmpdir.join('test.vot'))
+    with open(path, 'w') as f:
+        f.write('''<?xml version="1.0"?>
+<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3"><RESOURCE><TABLE>
+<FIELD name="v" datatype="float" arraysize="2"/>
+<FIELD name="w" datatype="int" arraysize="2x3"/>
+<FIELD name="z" datatype="int" arraysize="*"/>
+<DATA><TABLEDATA>
+<TR><TD>1 2</TD><TD>1 2 3 4 5 6</TD><TD>1 2 3</TD></TR>
+<TR><TD>NaN 2</TD><TD></TD><TD>1</TD></TR>
+</TABLEDATA></DATA></TABLE></RESOURCE></VOTABLE>''')
+    df = vaex.open(path)
+    assert df.get_column_names() == ['v', 'w']
+    assert df.columns['v'].tolist() == [[1, 2], [None, 2]]
+    assert df.columns['w'].tolist() == [[[1, 2], [3, 4], [5, 6]], [[None, None]] * 3]
+    assert "skipping column 'z'" in caplog.text
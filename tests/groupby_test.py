@@ -0,0 +1,79 @@
+from common import *
+import numpy as np
+import vaex
+import vaex.hash
+
+
+def test_hash_table():
+    table = vaex.hash.HashTable(capacity=2)
+    assert table.update([np.array([3, 1, 3, 2])]).tolist() == [0, 1, 0, 2]
+    assert table.update([np.array([2, 4])]).tolist() == [2, 3]
+    assert table.keys()[0].tolist() == [3, 1, 2, 4]
+    assert table.lookup([np.array([4, 5])]).tolist() == [3, -1]
+
+    other = vaex.hash.HashTable()
+    other.update([np.array([5, 1])])
+    assert table.merge(other).tolist() == [4, 1]
+
+
+def test_hash_table_strings_and_missing():
+    table = vaex.hash.HashTable()
+    names = np.array(['aap', 'noot', 'aap', 'mies'], dtype='S4')
+    values = np.ma.array([1., np.nan, 1., 2], mask=[False, False, False, True])
+    assert table.update([names, values]).tolist() == [0, 1, 0, 2]
+    # different string width, and nan's should be equal
+    assert table.lookup([np.array(['noot', 'aap'], dtype='S10'), np.array([np.nan, 2.])]).tolist() == [1, -1]
+
+
+def test_groupby_agg():
+    df = vaex.from_arrays(name=np.array(['a', 'b', 'a', 'c', 'b', 'a']),
+                          g=np.array([1, 1, 1, 2, 2, 1]),
+                          x=np.arange(6.),
+                          y=np.ma.array([1, 2, 3, 4, 5, 6.], mask=[0, 0, 1, 0, 0, 0]))
+    with small_buffer(df, 2):
+        dfg = df.groupby('name').agg({'x': ['sum', 'mean', 'min', 'max', 'first'], 'y': ['count', 'mean']})
+    assert dfg.get_column_names() == ['name', 'x_sum', 'x_mean', 'x_min', 'x_max', 'x_first', 'y_count', 'y_mean']
+    assert dfg.evaluate('name').tolist() == ['a', 'b', 'c']
+    assert dfg.evaluate('x_sum').tolist() == [7, 5, 3]
+    assert dfg.evaluate('x_min').tolist() == [0, 1, 3]
+    assert dfg.evaluate('x_max').tolist() == [5, 4, 3]
+    assert dfg.evaluate('x_first').tolist() == [0, 1, 3]
+    assert dfg.evaluate('y_count').tolist() == [2, 2, 1]
+    assert dfg.evaluate('y_mean').tolist() == [3.5, 3.5, 4]
+
+    dfg = df.groupby([df['name'], df.g]).agg('count')
+    assert dfg.evaluate('g').tolist() == [1, 1, 2, 2]
+    assert dfg.evaluate('count').tolist() == [3, 1, 1, 1]
+
+    assert df.groupby('g').size().tolist() == [4, 2]
+
+
+def test_groupby_filtered():
+    df = vaex.from_arrays(g=np.array([1, 2, 1, 2, 1]), x=np.arange(5.))
+    df = df[df.x > 0]
+    dfg = df.groupby('g').agg({'x': ['first', 'std']})
+    assert dfg.evaluate('x_first').tolist() == [2, 1]
+    assert dfg.evaluate('x_std').tolist() == [1, 1]
+
+
+def test_groupby_first_missing():
+    x = np.ma.array([np.nan, 5., 7., 8., 9., np.nan], mask=[False, False, True, False, False, False])
+    df = vaex.from_arrays(g=np.array([1, 1, 2, 2, 1, 3]), x=x)
+    with small_buffer(df, 2):
+        dfg = df.groupby('g').agg({'x': 'first'})
+    # the leading nan and masked value are skipped, a group without values gives a missing value
+    assert dfg.evaluate('x_first').tolist() == [5, 8, None]
+
+
+def test_groupby_int64():
+    # integers are aggregated as integers, floats would lose precision above 2**53
+    big = 2**62 + 1
+    top = 2**63 - 1
+    x = np.ma.array([big, 1, -big, big, 7, top], mask=[False, False, False, False, True, False], dtype=np.int64)
+    df = vaex.from_arrays(g=np.array([1, 1, 2, 2, 3, 4]), x=x)
+    with small_buffer(df, 2):
+        dfg = df.groupby('g').agg({'x': ['sum', 'min', 'max']})
+    assert dfg.evaluate('x_sum').tolist() == [big + 1, 0, 0, top]
+    assert dfg.evaluate('x_min').tolist() == [1, -big, None, top]
+    assert dfg.evaluate('x_max').tolist() == [big, big, None, top]
+    assert dfg.evaluate('x_max').dtype == np.int64
@@ -1,3 +1,4 @@
+import pytest
 import vaex
 import numpy as np
 import numpy.ma
@@ -72,3 +73,25 @@ def test_right_x_x():
     assert df.evaluate('y'  ).tolist() == [2, None, 0]
     assert df.evaluate('y_r').tolist() == [None, 1, 2]
 
+
+def test_inner_a_b():
+    df = df_a.join(other=df_b, left_on='a', right_on='b', rsuffix='_r', how='inner')
+    assert df.evaluate('a').tolist() == ['A', 'B']
+    assert df.evaluate('b').tolist() == ['A', 'B']
+    assert df.evaluate('x').tolist() == [0, 1]
+    assert df.evaluate('x_r').tolist() == [2, 1]
+    assert df.evaluate('y_r').tolist() == [None, 1]
+
+def test_join_multiple_keys():
+    df_l = vaex.from_arrays(k1=np.array([1, 1, 2, 2]), k2=np.array(['a', 'b', 'a', 'b']), x=np.arange(4))
+    df_r = vaex.from_arrays(k1=np.array([2, 1, 2]), k2=np.array(['b', 'b', 'c']), z=np.array([10, 20, 30]))
+    df = df_l.join(df_r, on=['k1', 'k2'], rsuffix='_r')
+    assert df.evaluate('z').tolist() == [None, 20, None, 10]
+    # many to one
+    df = df_l.join(vaex.from_arrays(k1=np.array([2, 1]), w=np.array([5, 6])), on='k1', rsuffix='_r')
+    assert df.evaluate('w').tolist() == [6, 6, 5, 5]
+
+def test_join_duplicate_keys():
+    df_r = vaex.from_arrays(x=np.array([0., 0.]), z=np.array([1, 2]))
+    with pytest.raises(ValueError):
+        df_a.join(df_r, on='x', rsuffix='_r')
@@ -55,3 +55,62 @@ def test_open():
 
 
 
+
+def test_convert_csv(tmpdir):
+    import numpy as np
+    import vaex.hdf5.export
+    csv = str(tmpdir.join('test.csv'))
+    with open(csv, 'w') as f:
+        f.write('x,y,name,code\n')
+        for i in range(10):
+            # y gets a missing value in the 2nd chunk, code is numeric in the 1st chunk only
+            y = '' if i == 5 else str(i)
+            name = '' if i == 7 else 'name%d' % i if i != 3 else 'naïve'
+            code = '%d.50' % i if i < 4 else 'A%d' % i
+            f.write('%d,%s,%s,%s\n' % (i, y, name, code))
+    target = str(tmpdir.join('test.hdf5'))
+    vaex.hdf5.export.convert_csv(csv, target, chunk_size=4)
+    df = vaex.open(target)
+    assert df.get_column_names() == ['x', 'y', 'name', 'code', 'index']
+    assert df.x.values.tolist() == list(range(10))
+    assert df.x.dtype == np.int64
+    assert np.isnan(df.y.values[5])
+    assert df['name'].values.tolist()[:3] == [b'name0', b'name1', b'name2']
+    assert df['name'].values[3].decode('utf8') == 'naïve'
+    assert df['name'].values.mask.tolist() == [i == 7 for i in range(10)]
+    assert df.code.values.tolist() == [b'0.50', b'1.50', b'2.50', b'3.50', b'A4', b'A5', b'A6', b'A7', b'A8', b'A9']
+    assert df['index'].values.tolist() == list(range(10))
+    df.close_files()
+
+    # via vaex.open, which converts in chunks
+    df = vaex.open(csv, convert=True, copy_index=False)
+    assert df.get_column_names() == ['x', 'y', 'name', 'code']
+    assert df.x.values.tolist() == list(range(10))
+    df.close_files()
+
+
+def test_convert_csv_many(tmpdir):
+    import numpy as np
+    import vaex.hdf5.export
+    paths = []
+    for i, (x, name) in enumerate([('1,2', 'a,bb'), ('3.5,4', 'ccc,')]):
+        paths.append(str(tmpdir.join('test%d.csv' % i)))
+        with open(paths[-1], 'w') as f:
+            f.write('x,name\n')
+            for x, name in zip(x.split(','), name.split(',')):
+                f.write('%s,%s\n' % (x, name))
+    target = str(tmpdir.join('test.hdf5'))
+    vaex.hdf5.export.convert_csv_many(paths, target, processes=2)
+    df = vaex.open(target)
+    assert df.x.values.tolist() == [1, 2, 3.5, 4]
+    assert df['name'].values.tolist() == [b'a', b'bb', b'ccc', None]
+    assert df['index'].values.tolist() == [0, 1, 0, 1]
+    df.close_files()
+
+    # unchanged files are not converted again
+    mtimes = [os.path.getmtime(path + '.hdf5') for path in paths]
+    os.utime(paths[1], (0, 0))  # but modified files are
+    vaex.hdf5.export.convert_csv_many(paths, target, processes=2)
+    assert os.path.getmtime(paths[0] + '.hdf5') == mtimes[0]
+    assert os.path.getmtime(paths[1] + '.hdf5') != mtimes[1]
+    assert vaex.hdf5.export._is_converted(paths[1], paths[1] + '.hdf5')
@@ -0,0 +1,47 @@
+from common import *
+import os
+import subprocess
+import sys
+import vaex.dataset_mmap
+
+
+@pytest.mark.parametrize("mode", [True, 'direct'])
+def test_column_reader(tmpdir, monkeypatch, mode):
+    x = np.arange(100000, dtype='f8')
+    m = np.ma.array(x, mask=x % 7 == 0)
+    df = vaex.from_arrays(x=x, i=np.arange(100000, dtype='i4'), m=m)
+    path = str(tmpdir.join('test.hdf5'))
+    df.export_hdf5(path)
+    if mode == 'direct':
+        try:
+            os.close(vaex.dataset_mmap.open_direct(path))
+        except OSError:
+            pytest.skip('filesystem does not support O_DIRECT')
+    monkeypatch.setattr(vaex.dataset_mmap, 'no_mmap', mode)
+    df = vaex.open(path)
+    column = df.columns['x']
+    assert isinstance(column, vaex.dataset_mmap.ColumnReader)
+    assert column[10:20].tolist() == x[10:20].tolist()
+    vaex.dataset_mmap._read_ahead.submit(lambda: None).result()  # wait for the read ahead
+    assert (20, 30) in [key[-2:] for key in vaex.dataset_mmap.buffer_pool.values]  # read ahead
+    with small_buffer(df, 3000):
+        assert df.sum('x') == x.sum()
+        assert df.sum('i') == x.sum()
+        assert df.sum('m') == m.sum()
+        assert df.count('m') == m.count()
+    assert df.is_masked('m')
+    assert df.columns['m'][7] is np.ma.masked
+    assert df.columns['m'][-1] == x[-1]
+    df.set_active_range(5, 12345)
+    dft = df.trim()
+    assert dft.columns['i'][:3].tolist() == [5, 6, 7]
+    assert dft.x.tolist() == x[5:12345].tolist()
+    assert dft.m.tolist() == m[5:12345].tolist()
+    df.close_files()
+
+
+def test_no_mmap_env():
+    code = "import vaex.dataset_mmap; print(vaex.dataset_mmap.no_mmap)"
+    for value, expected in [('0', b'False'), ('', b'False'), ('1', b'True'), ('direct', b'direct')]:
+        env = dict(os.environ, VAEX_NO_MMAP=value)
+        assert subprocess.check_output([sys.executable, '-c', code], env=env).strip() == expected
@@ -0,0 +1,47 @@
+from common import *
+import vaex.protocol
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_protocol_encode_decode(compression):
+    x = np.ma.array(np.arange(1000.), mask=np.arange(1000) % 3 == 0)
+    message = dict(job_id='a', result=dict(grid=np.arange(24).reshape(2, 3, 4), x=x, s=np.array(['a', None], dtype=object)),
+                   values=[np.float64(1.5), np.int32(2), 'b'])
+    frame = vaex.protocol.encode(message, compression)
+    if compression:
+        assert len(frame) < x.nbytes
+    decoded = vaex.protocol.decode(frame)
+    assert decoded['job_id'] == 'a'
+    assert decoded['result']['grid'].tolist() == np.arange(24).reshape(2, 3, 4).tolist()
+    assert decoded['result']['grid'].dtype == np.arange(24).dtype
+    assert decoded['result']['x'].tolist() == x.tolist()
+    assert decoded['result']['s'] == ['a', None]
+    assert decoded['values'] == [1.5, 2, 'b']
+    decoded['result']['grid'][0] = 1  # a writable copy
+
+
+def test_protocol_chunks():
+    frame1 = vaex.protocol.encode(dict(job_id='1', result=np.arange(1000)))
+    frame2 = vaex.protocol.encode(dict(job_id='2', result=np.arange(100.)))
+    chunks1 = vaex.protocol.split(frame1, 1000)
+    chunks2 = vaex.protocol.split(frame2, 1000)
+    assert len(chunks1) > 1
+    assert vaex.protocol.split(frame1) == [frame1]
+    assembler = vaex.protocol.Assembler()
+    # interleaved, like they can be on a websocket
+    messages = [assembler.feed(chunk) for pair in zip(chunks1, chunks2) for chunk in pair]
+    messages += [assembler.feed(chunk) for chunk in chunks1[len(chunks2):]]
+    messages = [message for message in messages if message is not None]
+    assert [message['job_id'] for message in messages] == ['2', '1']
+    assert messages[1]['result'].tolist() == list(range(1000))
+    assert not assembler.chunks
+
+
+def test_protocol_versions():
+    assert vaex.protocol.negotiate(None) == (None, None)
+    assert vaex.protocol.negotiate(dict(version=2, compression=['brotli', 'zlib'])) == (1, 'zlib')
+    assert vaex.protocol.negotiate(dict(version=1)) == (1, None)
+    frame = bytearray(vaex.protocol.encode(dict(result=1)))
+    frame[3] = vaex.protocol.VERSION + 1
+    with pytest.raises(ValueError):
+        vaex.protocol.decode(bytes(frame))
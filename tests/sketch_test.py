@@ -0,0 +1,58 @@
+from common import *
+import vaex.sketch
+
+
+def test_kll():
+    x = np.random.RandomState(42).normal(size=200000)
+    quantiles = np.array([0.01, 0.25, 0.5, 0.75, 0.99])
+    sketches = []
+    for part in np.array_split(x, 4):
+        sketch = vaex.sketch.KLL(k=256, seed=len(sketches))
+        for chunk in np.array_split(part, 7):
+            sketch.update(chunk)
+        sketches.append(sketch)
+    for other in sketches[1:]:
+        sketches[0].merge(other)
+    sketch = sketches[0]
+    assert len(sketch) == len(x)
+    assert sketch.nbytes < 10000
+    ranks = np.searchsorted(np.sort(x), sketch.quantile(quantiles)) / len(x)
+    assert np.abs(ranks - quantiles).max() < 0.01
+
+    # exact for small number of values
+    sketch = vaex.sketch.KLL()
+    sketch.update(x[:100])
+    assert sketch.quantile(quantiles).tolist() == pytest.approx(np.percentile(x[:100], quantiles * 100).tolist())
+    assert np.isnan(vaex.sketch.KLL().quantile(0.5))
+
+
+def test_percentile_sketch():
+    x = np.arange(100.)
+    y = np.ma.array(x, mask=x % 2 == 0)
+    df = vaex.from_arrays(x=x, y=y)
+    with small_buffer(df, 7):
+        assert df.median_sketch('x') == np.median(x)
+        assert df.percentile_sketch('x', [10, 90]).tolist() == np.percentile(x, [10, 90]).tolist()
+        assert df.percentile_sketch(['x', 'y'], 50) == [np.median(x), np.median(x[1::2])]
+        medians = df.median_sketch('x', binby='x', limits=[0, 100], shape=4)
+        assert medians.tolist() == [np.median(x[i * 25:(i + 1) * 25]) for i in range(4)]
+        medians = df.median_sketch('x', binby='x', limits=[0, 200], shape=4)
+        assert np.isnan(medians[2:]).all()  # no values in the bin
+        df.select(df.x < 50)
+        assert df.median_sketch('x', selection=True) == np.median(x[:50])
+        dff = df[df.x >= 50]
+        assert dff.median_sketch('x') == np.median(x[50:])
+
+
+def test_nlargest_nsmallest():
+    x = np.ma.array([3, 1, 4, 1, 5, 9, 2, 6, 5, 3], mask=[0, 0, 0, 0, 0, 1, 0, 0, 0, 0])
+    df = vaex.from_arrays(x=x, i=np.arange(10))
+    with small_buffer(df, 3):
+        assert df.nlargest(3, 'x').i.tolist() == [7, 4, 8]  # 9 is masked, for equal values the first row comes first
+        assert df.nsmallest(3, 'x').i.tolist() == [1, 3, 6]
+        assert df.nsmallest(3, '-x').i.tolist() == [7, 4, 8]
+        assert df.nlargest(100, 'x').i.tolist() == [7, 4, 8, 2, 0, 9, 6, 1, 3]
+        dff = df[df.i > 3]
+        assert dff.nlargest(2, 'x').i.tolist() == [7, 4]
+        dff.select(dff.i > 4)
+        assert dff.nlargest(2, 'x', selection=True).i.tolist() == [7, 8]
@@ -19,3 +19,69 @@ def test_sort(ds_local):
     ds_sorted = dss.sort('x', ascending=False)
     assert ds_sorted.x.evaluate().tolist() == x[::-1]
 
+
+
+def test_sort_multiple_keys():
+    df = vaex.from_arrays(s=np.array(['b', 'a', 'c', 'a', 'b', 'a']),
+                          x=np.array([1, 2, 3, 4, 5, 6]),
+                          y=np.ma.array([1., np.nan, 2., 3., 1., 0.], mask=[0, 0, 0, 0, 0, 1]))
+    with small_buffer(df, 2):
+        assert df.sort(['s', 'x'], ascending=[True, False]).x.tolist() == [6, 4, 2, 5, 1, 3]
+        # missing values (and nan's) are put last, for equal keys the order is kept
+        assert df.sort('y').x.tolist() == [1, 5, 3, 4, 2, 6]
+        assert df.sort('y', ascending=False).x.tolist() == [4, 3, 1, 5, 2, 6]
+        assert df.sort(['s', 'y'], ascending=False).x.tolist() == [3, 1, 5, 4, 2, 6]
+    with pytest.raises(ValueError):
+        df.sort(['s', 'x'], ascending=[True])
+
+
+def test_sort_merge():
+    x = np.random.RandomState(42).randint(0, 100, size=10000)
+    df = vaex.from_arrays(x=x, i=np.arange(len(x)))
+    with small_buffer(df, 1000):
+        dfs = df.sort('x')
+    assert dfs.i.tolist() == np.argsort(x, kind='mergesort').tolist()
+    keys = [vaex.sort.normalize(x[i1:i1 + 1000], True) for i1 in range(0, len(x), 1000)]
+    runs = [vaex.sort.Run([key], np.arange(i1, i1 + 1000), [True], spill=True, sorted=False) for i1, key in zip(range(0, len(x), 1000), keys)]
+    assert vaex.sort.merge(runs, [True], batch_size=100).tolist() == np.argsort(x, kind='mergesort').tolist()
+
+
+def test_export_sorted(tmpdir):
+    df = vaex.from_arrays(x=np.array([3, 1, 2, 0]), y=np.array([0., 1., 2., 3.]))
+    path = str(tmpdir.join('sorted.hdf5'))
+    with small_buffer(df, 3):
+        df.export_hdf5(path, sort='x', ascending=False)
+    df = vaex.open(path)
+    assert df.x.tolist() == [3, 2, 1, 0]
+    assert df.y.tolist() == [0, 2, 1, 3]
+
+
+@pytest.mark.parametrize("format", ['hdf5', 'arrow'])
+def test_export_sorted_filtered(tmpdir, format):
+    import vaex_arrow.dataset  # registers the arrow format
+    df = vaex.from_arrays(x=np.arange(10), y=np.arange(10.) % 4)
+    df = df[df.x > 2]
+    df.select(df.x < 8)
+    path = str(tmpdir.join('sorted.' + format))
+    with small_buffer(df, 3):
+        getattr(df, 'export_' + format)(path, sort='y')
+    dfs = vaex.open(path)
+    assert dfs.x.tolist() == [4, 8, 5, 9, 6, 3, 7]
+    dfs.close_files()
+
+    with small_buffer(df, 3):
+        getattr(df, 'export_' + format)(path, sort='y', selection=True)
+    dfs = vaex.open(path)
+    assert dfs.x.tolist() == [4, 5, 6, 3, 7]
+    dfs.close_files()
+
+
+def test_sort_selection():
+    # the selection (and the filter) is applied chunk by chunk by the sort, instead of taking the rows up front
+    df = vaex.from_arrays(x=np.arange(10), y=np.arange(10.) % 4)
+    df = df[df.x > 2]
+    df.select(df.x < 8)
+    with small_buffer(df, 3):
+        assert df._sort('y', filtered=True).tolist() == [4, 8, 5, 9, 6, 3, 7]
+        assert df._sort('y', selection=True).tolist() == [4, 5, 6, 3, 7]
+        assert df._sort('y').tolist() == [0, 4, 8, 1, 5, 9, 2, 6, 3, 7]
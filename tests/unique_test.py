@@ -0,0 +1,35 @@
+from common import *
+
+
+def test_unique():
+    x = np.ma.array([3., 1., np.nan, 3., 2., 1., 3., 0.], mask=[0, 0, 0, 0, 0, 0, 0, 1])
+    s = np.array(['aap', 'noot', 'mies', 'aap', 'noot', 'aap', 'aap', 'mies'])
+    df = vaex.from_arrays(x=x, s=s, i=np.arange(8))
+    with small_buffer(df, 3):
+        values = df.unique('x')
+        assert values.data[:3].tolist() == [1, 2, 3]
+        assert np.isnan(values.data[3])
+        assert values.mask.tolist() == [0, 0, 0, 0, 1]
+        assert df.unique('s').tolist() == ['aap', 'mies', 'noot']
+        values, inverse = df.unique('s', return_inverse=True)
+        assert values[inverse].tolist() == s.tolist()
+        dff = df[df.i < 2]
+        assert dff.unique('s').tolist() == ['aap', 'noot']
+
+
+def test_value_counts():
+    x = np.ma.array([3., 1., np.nan, 3., 2., 1., 3., 0.], mask=[0, 0, 0, 0, 0, 0, 0, 1])
+    s = np.array(['aap', 'noot', 'mies', 'aap', 'noot', 'aap', 'aap', 'mies'])
+    df = vaex.from_arrays(x=x, s=s)
+    with small_buffer(df, 3):
+        counts = df.x.value_counts()
+        assert counts.values.tolist() == [3, 2, 1, 1, 1]
+        assert counts.index.values[:3].tolist() == [3, 1, 2]
+        assert np.isnan(counts.index.values[3:]).all()  # NaN and the missing value
+        counts = df.x.value_counts(dropna=True, ascending=True)
+        assert counts.to_dict() == {2: 1, 1: 2, 3: 3}
+        assert df.s.value_counts().to_dict() == {'aap': 4, 'noot': 2, 'mies': 2}
+        dff = df[df.x > 1]
+        assert dff.s.value_counts().to_dict() == {'aap': 3, 'noot': 1}
+        dfc = df.ordinal_encode('s')
+        assert dfc.s.value_counts().to_dict() == {'aap': 4, 'noot': 2, 'mies': 2}
@@ -0,0 +1,136 @@
+from common import *
+import gc
+import json
+import time
+
+
+def test_pass_batching(webserver, server):
+    df = create_base_ds()
+    df.name = 'batching'
+    webserver.set_datasets([df])
+    dfr = server.datasets(as_dict=True)['batching']
+    batcher = webserver.batcher(df)
+    batcher.window = batcher.latency = 0.5  # such that all requests are in a single batch
+    passes = batcher.executor.passes
+    try:
+        promises = [dfr.count('x', selection='x > %d' % i, delay=True) for i in range(5)]
+        promises.append(dfr.minmax('x', delay=True))
+        results = [promise.get() for promise in promises]
+    finally:
+        batcher.window, batcher.latency = webserver.batch_window, webserver.batch_latency
+    assert results[:5] == [df.count('x', selection='x > %d' % i) for i in range(5)]
+    assert results[5].tolist() == df.minmax('x').tolist()
+    # the copies of the dataset (one per request) share the pass over the data
+    assert batcher.executor.passes - passes == 1
+
+    # errors are sent back to the request
+    with pytest.raises(NameError):
+        dfr.count('doesnotexist')
+
+
+def test_protocol_chunks(webserver, server, monkeypatch):
+    df = vaex.from_arrays(x=np.arange(10000.))
+    df.name = 'protocol'
+    webserver.set_datasets([df])
+    dfr = server.datasets(as_dict=True)['protocol']
+    monkeypatch.setattr(vaex.protocol, 'chunk_size_default', 1000)
+    assert dfr.evaluate('x').tolist() == df.x.tolist()
+    assert dfr.sum('x') == df.sum('x')
+    assert not server.assembler.chunks
+
+
+def test_cancel(webserver, server):
+    df = create_base_ds()
+    df.name = 'cancel'
+    webserver.set_datasets([df])
+    dfr = server.datasets(as_dict=True)['cancel']
+    batcher = webserver.batcher(df)
+    batcher.window = batcher.latency = 0.5  # such that we can cancel before the pass
+    try:
+        promise = dfr.sum('x', delay=True)
+        promise.cancel()
+        with pytest.raises(vaex.execution.UserAbort):
+            promise.get()
+    finally:
+        batcher.window, batcher.latency = webserver.batch_window, webserver.batch_latency
+    assert dfr.sum('x') == df.sum('x')  # other requests are not affected
+
+
+def _handlers():
+    return [k for k in gc.get_objects() if type(k) is vaex.webserver.ProgressWebSocket]
+
+
+def test_cancel_unknown(webserver):
+    df = create_base_ds()
+    df.name = 'cancel_unknown'
+    webserver.set_datasets([df])
+    others = _handlers()
+    # a connection of its own, the handlers of other connections can have jobs that wait for their clients
+    server = vaex.server("%s://localhost:%d" % (scheme, test_port))
+    try:
+        dfr = server.datasets(as_dict=True)['cancel_unknown']
+        # e.g. a job that finished before the cancel arrived
+        message = json.dumps(dict(cancel='unknown'))
+        server.io_loop.add_callback(lambda: server.websocket_connected.then(lambda socket: socket.write_message(message)).end())
+        assert dfr.sum('x') == df.sum('x')
+        handlers = [handler for handler in _handlers() if not any(handler is other for other in others)]
+        assert len(handlers) == 1
+        handler = handlers[0]
+        # the result can arrive before the handler is done with the job
+        for i in range(50):
+            if not handler.jobs:
+                break
+            time.sleep(0.1)
+        assert not handler.cancelled
+        assert not handler.jobs
+    finally:
+        server.close()
+
+
+def _slow(x):
+    time.sleep(0.002)
+    return x
+
+
+def test_partial_results(webserver, server):
+    df = vaex.from_arrays(x=np.arange(100000.))
+    df.add_function('slow', _slow)
+    df.name = 'partial'
+    webserver.set_datasets([df])
+    dfr = server.datasets(as_dict=True)['partial']
+    batcher = webserver.batcher(df)
+    batcher.executor.buffer_size = 1000  # such that the pass takes a while
+    server.partial_interval = 0.05
+    try:
+        promise = dfr.mean('slow(x)', binby='x', limits=[0, 100000], shape=4, delay=True)
+        partials = []
+        promise.signal_partial.connect(lambda partial: partials.append(partial))
+        result = promise.get()
+    finally:
+        server.partial_interval = None
+    assert result.tolist() == df.mean('x', binby='x', limits=[0, 100000], shape=4).tolist()
+    assert len(partials) > 0
+    for partial in partials:
+        assert partial.shape == (4,)
+        assert np.all((partial[~np.isnan(partial)] >= 0) & (partial[~np.isnan(partial)] < 100000))
+    assert promise.partial_result is partials[-1]
+
+
+def test_batch_error(webserver, server):
+    df = vaex.from_arrays(x=np.arange(10.), s=np.array(['a'] * 10))
+    df.name = 'batch_error'
+    webserver.set_datasets([df])
+    dfr = server.datasets(as_dict=True)['batch_error']
+    batcher = webserver.batcher(df)
+    batcher.window = batcher.latency = 0.5  # such that both requests are in a single batch
+    passes = batcher.executor.passes
+    try:
+        good = dfr.sum('x', delay=True)
+        bad = dfr.sum('x + s', delay=True)  # fails while passing over the data
+        with pytest.raises(TypeError):
+            bad.get()
+        # the other request of the batch is not affected
+        assert good.get() == 45
+    finally:
+        batcher.window, batcher.latency = webserver.batch_window, webserver.batch_latency
+    assert batcher.executor.passes - passes == 1